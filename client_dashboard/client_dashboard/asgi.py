@@ -5,12 +5,37 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+Em produção roda sob gunicorn com o worker ``uvicorn_worker.UvicornWorker``
+(ver Procfile). Servido por aqui, os endpoints de chat usam as views
+assíncronas de ``core.async_views``, salvo se CHAT_ASYNC_PROXY for definido.
+Conexões WebSocket (``/ws/chat/<chatbot_id>/``) vão para ``core.websocket``.
+
+Ao final do carregamento ``core.startup`` aquece a aplicação e registra o
+tempo de cada etapa da inicialização.
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+# Primeiro import: marca o início da inicialização (tempos no log "Aplicação pronta")
+from core import startup
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'client_dashboard.settings')
+os.environ.setdefault('CHAT_ASYNC_PROXY', 'True')
+
+with startup.phase('django'):
+    from django.core.asgi import get_asgi_application
+
+    django_application = get_asgi_application()
+
+with startup.phase('application'):
+    # Importado depois do setup do Django (usa models e settings)
+    from core.websocket import websocket_application
+
+startup.finish()
+
 
-application = get_asgi_application()
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
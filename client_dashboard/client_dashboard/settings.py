@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config
+from decouple import Csv, config
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -63,10 +63,12 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'core.metrics.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.replicas.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -95,14 +97,68 @@ WSGI_APPLICATION = 'client_dashboard.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Endpoints de chat assíncronos (core.async_views), servidos por client_dashboard.asgi
+CHAT_ASYNC_PROXY = config('CHAT_ASYNC_PROXY', default=False, cast=bool)
+
 DATABASES = {
     'default': dj_database_url.config(
         default=f'sqlite:///{BASE_DIR / "db.sqlite3"}',
-        conn_max_age=600,
+        # Sob ASGI o ORM roda em threads por requisição e conexões persistentes
+        # se acumulariam; nesse modo cada requisição abre e fecha a sua.
+        conn_max_age=0 if CHAT_ASYNC_PROXY else 600,
         conn_health_checks=True,
     )
 }
 
+# Réplicas de leitura (core.replicas): URLs separadas por vírgula. Só as leituras
+# das views de chat e do embed vão para elas, em rodízio; as escritas ficam no primário.
+DATABASE_REPLICA_URLS = config('DATABASE_REPLICA_URLS', default='', cast=Csv())
+
+for _index, _url in enumerate(DATABASE_REPLICA_URLS, start=1):
+    DATABASES[f'replica{_index}'] = {
+        **dj_database_url.parse(_url, conn_max_age=0 if CHAT_ASYNC_PROXY else 600, conn_health_checks=True),
+        # Nos testes a réplica é o próprio banco de testes
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'HEALTH_INTERVAL': config('DATABASE_REPLICA_HEALTH_INTERVAL', default=5.0, cast=float),
+    'STICKY_SECONDS': config('DATABASE_REPLICA_STICKY_SECONDS', default=15, cast=int),
+}
+
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter'] if DATABASE_REPLICAS['ALIASES'] else []
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Com REDIS_URL o cache é compartilhado entre workers; sem ele, cada processo
+# usa o seu próprio cache em memória.
+
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Cache do ChatbotConfig nos endpoints de chat e embed (core.config_cache)
+CHATBOT_CONFIG_CACHE = {
+    'LOCAL_TTL': config('CHATBOT_CONFIG_LOCAL_TTL', default=5.0, cast=float),
+    'LOCAL_MAX_ENTRIES': config('CHATBOT_CONFIG_LOCAL_MAX_ENTRIES', default=1000, cast=int),
+    'SHARED_TTL': config('CHATBOT_CONFIG_SHARED_TTL', default=300, cast=int),
+    'NEGATIVE_TTL': config('CHATBOT_CONFIG_NEGATIVE_TTL', default=30, cast=int),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -157,3 +213,183 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # X-Frame-Options configuration to allow embedding
 X_FRAME_OPTIONS = 'SAMEORIGIN'
+
+# Pool de conexões keep-alive para os webhooks dos clientes (core.webhook_client)
+# Os limites valem por host; HTTP2 requer o pacote opcional h2.
+WEBHOOK_CLIENT = {
+    'MAX_CONNECTIONS': config('WEBHOOK_MAX_CONNECTIONS', default=100, cast=int),
+    'MAX_KEEPALIVE_CONNECTIONS': config('WEBHOOK_MAX_KEEPALIVE_CONNECTIONS', default=20, cast=int),
+    'KEEPALIVE_EXPIRY': config('WEBHOOK_KEEPALIVE_EXPIRY', default=30.0, cast=float),
+    'HTTP2': config('WEBHOOK_HTTP2', default=False, cast=bool),
+}
+
+# Novas tentativas e hedging das chamadas ao webhook (core.webhook_retry). O
+# prazo, o número de tentativas e o hedging em si são configurados por chatbot.
+WEBHOOK_RETRY = {
+    'BACKOFF_BASE': config('WEBHOOK_RETRY_BACKOFF_BASE', default=0.1, cast=float),
+    'BACKOFF_MAX': config('WEBHOOK_RETRY_BACKOFF_MAX', default=2.0, cast=float),
+    'HEDGE_THREADS': config('WEBHOOK_RETRY_HEDGE_THREADS', default=32, cast=int),
+    'RETRY_AMBIGUOUS': config('WEBHOOK_RETRY_AMBIGUOUS', default=False, cast=bool),
+}
+
+# Codec JSON do chat (core.codec): 'auto' usa orjson quando instalado
+JSON_CODEC = config('JSON_CODEC', default='auto')
+
+# Limites de tamanho dos corpos tratados pelo proxy de chat (core.proxy)
+CHAT_PROXY = {
+    'MAX_REQUEST_BYTES': config('CHAT_MAX_REQUEST_BYTES', default=16384, cast=int),
+    'MAX_WEBHOOK_BYTES': config('CHAT_MAX_WEBHOOK_BYTES', default=1048576, cast=int),
+}
+
+# Sondas periódicas dos webhooks (core.health, processo "manage.py run_health_checker").
+# O perfil de latência encurta o timeout de conexão e webhooks mortos têm o circuito aberto.
+WEBHOOK_HEALTH = {
+    'INTERVAL': config('WEBHOOK_HEALTH_INTERVAL', default=30.0, cast=float),
+    'CONCURRENCY': config('WEBHOOK_HEALTH_CONCURRENCY', default=20, cast=int),
+    'TIMEOUT': config('WEBHOOK_HEALTH_TIMEOUT', default=5.0, cast=float),
+    'WINDOW': config('WEBHOOK_HEALTH_WINDOW', default=60, cast=int),
+    'DEAD_AFTER': config('WEBHOOK_HEALTH_DEAD_AFTER', default=3, cast=int),
+    'CONNECT_FACTOR': config('WEBHOOK_HEALTH_CONNECT_FACTOR', default=3.0, cast=float),
+}
+
+# Cache de respostas por chatbot (core.reply_cache); ativado e com TTL por chatbot
+REPLY_CACHE = {
+    'LOCAL_MAX_ENTRIES': config('REPLY_CACHE_LOCAL_MAX_ENTRIES', default=5000, cast=int),
+    'MAX_MESSAGE_LENGTH': config('REPLY_CACHE_MAX_MESSAGE_LENGTH', default=500, cast=int),
+}
+
+# Mensagens reenviadas com a mesma Idempotency-Key (core.idempotency)
+IDEMPOTENCY = {
+    'TTL': config('IDEMPOTENCY_TTL', default=300, cast=int),
+    'POLL_INTERVAL': config('IDEMPOTENCY_POLL_INTERVAL', default=0.05, cast=float),
+    'SYNC_MAX_WAIT': config('IDEMPOTENCY_SYNC_MAX_WAIT', default=3.0, cast=float),
+}
+
+# Cache do widget embutido: ETag/304 e HTML renderizado (core.embed_cache)
+EMBED_CACHE = {
+    'TTL': config('EMBED_CACHE_TTL', default=3600, cast=int),
+    'MAX_AGE': config('EMBED_CACHE_MAX_AGE', default=0, cast=int),
+}
+
+# Entrega em fila para chatbots com delivery_mode='queue' (core.delivery_queue).
+# 'database' requer o processo "manage.py run_delivery_worker"; 'inprocess'
+# entrega em threads do próprio servidor (apenas desenvolvimento).
+DELIVERY_QUEUE = {
+    'BACKEND': config('DELIVERY_QUEUE_BACKEND', default='database'),
+    'MAX_ATTEMPTS': config('DELIVERY_QUEUE_MAX_ATTEMPTS', default=5, cast=int),
+    'TIMEOUT': config('DELIVERY_QUEUE_TIMEOUT', default=120.0, cast=float),
+    'LONG_POLL_TIMEOUT': config('DELIVERY_QUEUE_LONG_POLL_TIMEOUT', default=25.0, cast=float),
+}
+
+# Canal WebSocket do widget (core.websocket), servido pelo asgi.py com uvicorn
+WEBSOCKET = {
+    'MAX_MESSAGE_BYTES': config('WEBSOCKET_MAX_MESSAGE_BYTES', default=16384, cast=int),
+    'CONFIG_REFRESH': config('WEBSOCKET_CONFIG_REFRESH', default=30.0, cast=float),
+    'QUEUED_REPLY_TIMEOUT': config('WEBSOCKET_QUEUED_REPLY_TIMEOUT', default=600.0, cast=float),
+}
+
+# Circuit breaker por webhook_url, compartilhado pelo cache (core.circuit_breaker)
+CIRCUIT_BREAKER = {
+    'WINDOW': config('CIRCUIT_BREAKER_WINDOW', default=60, cast=int),
+    'MIN_REQUESTS': config('CIRCUIT_BREAKER_MIN_REQUESTS', default=5, cast=int),
+    'FAILURE_RATE': config('CIRCUIT_BREAKER_FAILURE_RATE', default=0.5, cast=float),
+    'COOLDOWN': config('CIRCUIT_BREAKER_COOLDOWN', default=30, cast=int),
+}
+
+# Limites de taxa e concorrência dos endpoints de chat (core.ratelimit).
+# Os limites em si são configurados por chatbot; no Railway há um proxy
+# reverso na frente, que acrescenta o IP do visitante em X-Forwarded-For.
+RATE_LIMIT = {
+    'TRUSTED_PROXY_COUNT': config('RATE_LIMIT_TRUSTED_PROXY_COUNT', default=0, cast=int),
+}
+
+# Registro das conversas, gravado em lote por uma thread de fundo (core.conversation_log)
+CONVERSATION_LOG = {
+    'ENABLED': config('CONVERSATION_LOG_ENABLED', default=True, cast=bool),
+    'BATCH_SIZE': config('CONVERSATION_LOG_BATCH_SIZE', default=200, cast=int),
+    'FLUSH_INTERVAL': config('CONVERSATION_LOG_FLUSH_INTERVAL', default=2.0, cast=float),
+    'MAX_BUFFERED': config('CONVERSATION_LOG_MAX_BUFFERED', default=10000, cast=int),
+}
+
+# Trocas anteriores da sessão enviadas ao webhook (core.session_context); o
+# número de trocas é configurado por chatbot (context_turns)
+SESSION_CONTEXT = {
+    'ENABLED': config('SESSION_CONTEXT_ENABLED', default=True, cast=bool),
+    'TTL': config('SESSION_CONTEXT_TTL', default=1800, cast=int),
+    'LOCAL_TTL': config('SESSION_CONTEXT_LOCAL_TTL', default=5.0, cast=float),
+    'LOCAL_MAX_SESSIONS': config('SESSION_CONTEXT_LOCAL_MAX_SESSIONS', default=10000, cast=int),
+    'MAX_MESSAGE_CHARS': config('SESSION_CONTEXT_MAX_MESSAGE_CHARS', default=2000, cast=int),
+    'MAX_CHARS': config('SESSION_CONTEXT_MAX_CHARS', default=8000, cast=int),
+}
+
+# Uso por chatbot (mensagens, erros, latência) agregado por minuto/hora/dia
+# para o dashboard (core.usage); retenção aplicada por "manage.py compact_usage"
+USAGE = {
+    'ENABLED': config('USAGE_ENABLED', default=True, cast=bool),
+    'FLUSH_INTERVAL': config('USAGE_FLUSH_INTERVAL', default=10.0, cast=float),
+    'MINUTE_RETENTION_DAYS': config('USAGE_MINUTE_RETENTION_DAYS', default=2, cast=int),
+    'HOUR_RETENTION_DAYS': config('USAGE_HOUR_RETENTION_DAYS', default=90, cast=int),
+    'DAY_RETENTION_DAYS': config('USAGE_DAY_RETENTION_DAYS', default=730, cast=int),
+}
+
+# Exportação do histórico de conversas em streaming (core.export)
+EXPORT = {
+    'CHUNK_SIZE': config('EXPORT_CHUNK_SIZE', default=2000, cast=int),
+    'BUFFER_BYTES': config('EXPORT_BUFFER_BYTES', default=65536, cast=int),
+}
+
+# Gravação em lote das alterações em tempo real do dashboard (core.live_settings):
+# o navegador espera DEBOUNCE_MS sem edições (no máximo MAX_WAIT_MS) antes de enviar.
+LIVE_SETTINGS = {
+    'DEBOUNCE_MS': config('LIVE_SETTINGS_DEBOUNCE_MS', default=800, cast=int),
+    'MAX_WAIT_MS': config('LIVE_SETTINGS_MAX_WAIT_MS', default=5000, cast=int),
+}
+
+# Distribuição das mensagens entre os endpoints do webhook de cada chatbot (core.balancer):
+# ewma (latência x chamadas em andamento) ou least_outstanding, ponderados pelo peso.
+WEBHOOK_BALANCER = {
+    'ALGORITHM': config('WEBHOOK_BALANCER_ALGORITHM', default='ewma'),
+    'EWMA_ALPHA': config('WEBHOOK_BALANCER_EWMA_ALPHA', default=0.3, cast=float),
+    'EJECT_AFTER': config('WEBHOOK_BALANCER_EJECT_AFTER', default=5, cast=int),
+    'EJECT_SECONDS': config('WEBHOOK_BALANCER_EJECT_SECONDS', default=30.0, cast=float),
+    'MAX_EJECT_SECONDS': config('WEBHOOK_BALANCER_MAX_EJECT_SECONDS', default=300.0, cast=float),
+    'MAX_ENDPOINTS': config('WEBHOOK_BALANCER_MAX_ENDPOINTS', default=10, cast=int),
+}
+
+# Métricas por requisição expostas em /metrics no formato do Prometheus (core.metrics).
+# Os workers publicam seus números no cache; com Redis, /metrics soma todos eles.
+METRICS = {
+    'ENABLED': config('METRICS_ENABLED', default=True, cast=bool),
+    'FLUSH_INTERVAL': config('METRICS_FLUSH_INTERVAL', default=10, cast=int),
+    # Obrigatório: sem token, /metrics responde 404
+    'TOKEN': config('METRICS_TOKEN', default=''),
+}
+
+# Inicialização dos processos web (core.startup): aquecer URLconf, templates e o
+# contexto TLS dos webhooks antes da primeira requisição
+STARTUP = {
+    'WARMUP': config('STARTUP_WARMUP', default=True, cast=bool),
+}
+
+# Logs da aplicação em JSON, uma linha por evento (core.log).
+# CHAT_LOG_LEVEL=DEBUG mostra os detalhes do dashboard; CHAT_LOG_ENABLED=False desliga.
+CHAT_LOG_ENABLED = config('CHAT_LOG_ENABLED', default=True, cast=bool)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'core.log.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+        'null': {'class': 'logging.NullHandler'},
+    },
+    'loggers': {
+        'core': {
+            'handlers': ['console' if CHAT_LOG_ENABLED else 'null'],
+            'level': config('CHAT_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -19,8 +19,11 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('accounts/', include('django.contrib.auth.urls')), # Rotas de login, logout, etc.
     path('', include('core.urls')), # Inclui as URLs do app core
 ]
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 
 import os
 
-from django.core.wsgi import get_wsgi_application
+# Primeiro import: marca o início da inicialização (ver core.startup)
+from core import startup
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'client_dashboard.settings')
 
-application = get_wsgi_application()
+with startup.phase('django'):
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+
+startup.finish()
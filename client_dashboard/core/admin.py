@@ -1,8 +1,52 @@
 from django.contrib import admin
-from .models import ChatbotConfig
+from .models import ChatbotConfig, Conversation, DeliveryJob, Message, UsageRollup, WebhookEndpoint
+
+
+class WebhookEndpointInline(admin.TabularInline):
+    model = WebhookEndpoint
+    fields = ('url', 'weight', 'enabled', 'health_availability', 'health_latency_p95_ms', 'health_checked_at')
+    readonly_fields = ('health_availability', 'health_latency_p95_ms', 'health_checked_at')
+    extra = 0
 
 @admin.register(ChatbotConfig)
 class ChatbotConfigAdmin(admin.ModelAdmin):
     list_display = ('user', 'webhook_url', 'primary_color', 'welcome_message')
     search_fields = ('user__username', 'webhook_url')
     list_filter = ('primary_color',)
+    list_select_related = ('user',)
+    inlines = (WebhookEndpointInline,)
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ('session_id', 'chatbot', 'started_at', 'last_message_at')
+    search_fields = ('session_id',)
+    raw_id_fields = ('chatbot',)
+    # ChatbotConfig.__str__ usa o usuário. Explícito porque o padrão do admin
+    # (select_related() sem campos) faz JOIN com todas as FKs
+    list_select_related = ('chatbot__user',)
+
+
+@admin.register(Message)
+class MessageAdmin(admin.ModelAdmin):
+    list_display = ('conversation', 'role', 'content', 'created_at')
+    list_filter = ('role',)
+    raw_id_fields = ('conversation', 'chatbot')
+    # Conversation.__str__ só usa chatbot_id
+    list_select_related = ('conversation',)
+
+
+@admin.register(DeliveryJob)
+class DeliveryJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'chatbot', 'status', 'attempts', 'available_at', 'created_at')
+    list_filter = ('status',)
+    raw_id_fields = ('chatbot',)
+    list_select_related = ('chatbot__user',)
+
+
+@admin.register(UsageRollup)
+class UsageRollupAdmin(admin.ModelAdmin):
+    list_display = ('chatbot', 'period', 'bucket_start', 'requests', 'errors', 'rate_limited', 'latency_max_ms')
+    list_filter = ('period',)
+    raw_id_fields = ('chatbot',)
+    list_select_related = ('chatbot__user',)
@@ -0,0 +1,201 @@
+"""
+Variantes assíncronas dos endpoints de chat.
+
+Servidas pelo ``client_dashboard.asgi`` (worker ASGI), não prendem um worker
+enquanto o webhook do cliente responde: cada mensagem em espera é só uma
+corrotina no event loop. Ativadas com ``CHAT_ASYNC_PROXY=True``; as demais
+views continuam síncronas.
+"""
+import logging
+
+import httpx
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import balancer, conversation_log, delivery_queue, idempotency, metrics, proxy, ratelimit, replicas, reply_cache, session_context, streaming, webhook_retry
+from .config_cache import aget_chatbot_config
+from .models import ChatbotConfig
+
+logger = logging.getLogger(__name__)
+
+
+async def _forward_legacy_message(config, message, on_reply, trace):
+    """Versão assíncrona de ``views._forward_legacy_message``."""
+    targets = await balancer.aavailable(config)
+    if not targets:
+        return proxy.legacy_fallback_response()
+
+    try:
+        webhook_response = await webhook_retry.apost_stream(
+            config,
+            json={'message': message},
+            headers=proxy.WEBHOOK_HEADERS,
+            trace=trace,
+            deadline=proxy.legacy_deadline(config),
+            targets=targets
+        )
+        try:
+            body = await proxy.aread_webhook_body(webhook_response)
+        finally:
+            await webhook_response.aclose()
+        webhook_response.raise_for_status()
+        return proxy.legacy_reply_response(body, on_reply)
+    except (httpx.HTTPError, ValueError):
+        return proxy.legacy_fallback_response()
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@replicas.read_from_replica
+async def chat_api_async(request):
+    """Versão assíncrona de ``views.chat_api``."""
+    try:
+        chatbot_id = proxy.legacy_chatbot_id(request)
+
+        config = await aget_chatbot_config(chatbot_id)
+        if config is None:
+            return JsonResponse({'error': 'Chatbot não encontrado'}, status=404)
+        metrics.tag_chatbot(config.pk)
+
+        if not config.webhook_url:
+            return proxy.legacy_missing_webhook_response()
+
+        data = proxy.parse_legacy_request(request)
+
+        retry_after = await ratelimit.acheck_rate_limit(config, ratelimit.client_ip(request))
+        if retry_after:
+            return proxy.rate_limited_response(retry_after)
+        slot = await ratelimit.aacquire_slot(config)
+        if slot is None:
+            return proxy.rate_limited_response(1)
+
+        try:
+            on_reply = conversation_log.start_exchange(config.pk, proxy.session_id(request, data), data['message'])
+            trace = webhook_retry.WebhookTrace()
+            return trace.apply(await _forward_legacy_message(config, data['message'], on_reply, trace))
+        finally:
+            await slot.arelease()
+
+    except proxy.ChatRequestError as e:
+        return e.response
+    except Exception:
+        logger.exception('Erro interno na chat_api_async')
+        return JsonResponse({'error': 'Erro interno do servidor'}, status=500)
+
+
+async def _forward_proxy_message(request, data, payload, config, on_reply, trace, lookup):
+    """Versão assíncrona de ``views._forward_proxy_message``."""
+    targets = await balancer.aavailable(config)
+    if not targets:
+        return proxy.circuit_open_response(await balancer.aretry_after(config))
+
+    wants_stream = streaming.client_accepts_stream(request, data)
+    try:
+        webhook_response = await webhook_retry.apost_stream(
+            config,
+            json=payload,
+            headers=proxy.webhook_headers(wants_stream),
+            trace=trace,
+            targets=targets
+        )
+    except httpx.HTTPError as e:
+        return proxy.webhook_error_response(e)
+    lookup.observe(webhook_response)
+
+    is_stream = webhook_response.is_success and streaming.is_stream_response(webhook_response)
+    if is_stream and wants_stream:
+        return streaming.arelay_stream(webhook_response, on_complete=lookup.awrap(on_reply))
+
+    try:
+        if is_stream:
+            return await streaming.acollect_reply(webhook_response, on_complete=lookup.awrap(on_reply))
+        body = await proxy.aread_webhook_body(webhook_response)
+        webhook_response.raise_for_status()
+    except httpx.HTTPError as e:
+        return proxy.webhook_error_response(e)
+    finally:
+        await webhook_response.aclose()
+
+    return await proxy.awebhook_reply_response(webhook_response, body, on_reply=on_reply, on_data=lookup.astore)
+
+
+async def _respond_proxy_message(request, data, config, session_id):
+    """Versão assíncrona de ``views._respond_proxy_message``."""
+    retry_after = await ratelimit.acheck_rate_limit(config, ratelimit.client_ip(request))
+    if retry_after:
+        return proxy.rate_limited_response(retry_after)
+
+    if config.delivery_mode == ChatbotConfig.DELIVERY_QUEUE:
+        conversation_log.start_exchange(config.pk, session_id, data['message'])
+        context = await session_context.aload(config, session_id)
+        return delivery_queue.queued_response(await delivery_queue.aenqueue(config, data, session_id, context))
+
+    context = await session_context.aload(config, session_id)
+    lookup = reply_cache.lookup(config, data['message'], context)
+    cached = await lookup.afetch(config.webhook_timeout)
+    if cached is not None:
+        conversation_log.start_exchange(config.pk, session_id, data['message'])(cached['reply'])
+        await session_context.aremember(config, session_id, data['message'], cached['reply'], context)
+        return reply_cache.hit_response(cached)
+
+    slot = await ratelimit.aacquire_slot(config)
+    if slot is None:
+        lookup.finish()
+        return proxy.rate_limited_response(1)
+
+    try:
+        on_reply = conversation_log.start_exchange(config.pk, session_id, data['message'])
+        on_reply = session_context.aextend(config, session_id, data['message'], context, on_reply)
+        payload = proxy.build_webhook_payload(data, session_id, context)
+        trace = webhook_retry.WebhookTrace()
+        response = trace.apply(await _forward_proxy_message(request, data, payload, config, on_reply, trace, lookup))
+    except Exception:
+        await slot.arelease()
+        lookup.finish()
+        raise
+    return await slot.abind(lookup.bind(response))
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@replicas.read_from_replica
+async def chat_proxy_api_async_view(request):
+    """Versão assíncrona de ``views.chat_proxy_api_view``."""
+    try:
+        data = proxy.parse_proxy_request(request)
+        chatbot_id = data['chatbot_id']
+
+        config = await aget_chatbot_config(chatbot_id)
+        if config is None:
+            return proxy.chatbot_not_found(chatbot_id)
+        metrics.tag_chatbot(config.pk)
+
+        if not config.webhook_url:
+            return proxy.webhook_not_configured(chatbot_id)
+
+        session_id = proxy.session_id(request, data)
+        submission = idempotency.submission(config, request, data, session_id)
+        replayed = await submission.afetch()
+        if replayed is not None:
+            return replayed
+
+        try:
+            response = await _respond_proxy_message(request, data, config, session_id)
+        except Exception:
+            await submission.arelease()
+            raise
+        return await submission.abind(response)
+
+    except proxy.ChatRequestError as e:
+        return e.response
+    except Exception:
+        logger.exception('Erro interno na chat_proxy_api_async_view')
+        return proxy.internal_error_response()
+
+
+@require_http_methods(["GET"])
+async def chat_job_result_async_view(request, job_id):
+    """Versão assíncrona do long-poll: a espera não ocupa uma thread."""
+    result = await delivery_queue.await_result(job_id, delivery_queue.long_poll_timeout(request))
+    return delivery_queue.result_response(job_id, result)
@@ -0,0 +1,238 @@
+"""
+Distribuição das mensagens entre os endpoints do webhook de um chatbot.
+
+O pool de um chatbot é o ``webhook_url`` principal (peso ``webhook_weight``)
+mais os ``WebhookEndpoint`` ativos. Para cada chamada, ``choose`` sorteia dois
+endpoints na proporção dos pesos e fica com o de menor custo ("power of two
+choices"), conforme ``ALGORITHM``:
+
+- ``ewma`` (padrão): média móvel exponencial da latência até os headers,
+  multiplicada pelas chamadas em andamento mais um e dividida pelo peso;
+- ``least_outstanding``: chamadas em andamento mais um, divididas pelo peso.
+
+Esses números são do processo: cada worker decide com o que ele mesmo viu.
+Um endpoint com ``EJECT_AFTER`` falhas seguidas (erro de conexão, timeout ou
+5xx) fica fora do sorteio por ``EJECT_SECONDS``, tempo que dobra a cada nova
+ejeção seguida (até ``MAX_EJECT_SECONDS``); se todos estiverem ejetados, todos
+voltam a valer. Endpoints com o circuito aberto (``core.circuit_breaker``,
+compartilhado entre os workers) ficam de fora já em ``available``.
+
+Com um único endpoint, tudo isso se reduz ao comportamento de antes.
+"""
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import circuit_breaker, health
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    # ewma ou least_outstanding
+    'ALGORITHM': 'ewma',
+    # Peso da última latência na média móvel
+    'EWMA_ALPHA': 0.3,
+    # Falhas seguidas que ejetam um endpoint
+    'EJECT_AFTER': 5,
+    'EJECT_SECONDS': 30.0,
+    'MAX_EJECT_SECONDS': 300.0,
+    # Endpoints adicionais por chatbot (além do webhook principal)
+    'MAX_ENDPOINTS': 10,
+}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'WEBHOOK_BALANCER', {}))
+    return options
+
+
+def max_endpoints():
+    """Endpoints adicionais permitidos por chatbot."""
+    return _options()['MAX_ENDPOINTS']
+
+
+class Target:
+    """Endpoint do pool de um chatbot, pronto para ser chamado."""
+
+    __slots__ = ('url', 'weight', 'connect_timeout', 'primary')
+
+    def __init__(self, url, weight, connect_timeout=None, primary=False):
+        self.url = url
+        self.weight = weight
+        self.connect_timeout = connect_timeout
+        self.primary = primary
+
+    def __repr__(self):
+        return f'Target({self.url!r}, weight={self.weight})'
+
+
+class EndpointStats:
+    """Números de um endpoint vistos por este processo."""
+
+    __slots__ = ('outstanding', 'ewma_ms', 'requests', 'failures', 'consecutive_failures', 'ejections', 'ejected_until')
+
+    def __init__(self):
+        self.outstanding = 0
+        self.ewma_ms = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+
+# Por URL; as views síncronas chamam de várias threads (hedging)
+_stats = {}
+_lock = threading.Lock()
+
+
+def _get(url):
+    stats = _stats.get(url)
+    if stats is None:
+        stats = _stats[url] = EndpointStats()
+    return stats
+
+
+def targets(config):
+    """Endpoints do chatbot: o webhook principal e os adicionais ativos."""
+    pool = [Target(config.webhook_url, config.webhook_weight, health.connect_timeout(config), primary=True)]
+    seen = {config.webhook_url}
+    for endpoint in config.active_webhook_endpoints():
+        if endpoint.url not in seen:
+            seen.add(endpoint.url)
+            pool.append(Target(endpoint.url, endpoint.weight, health.connect_timeout(endpoint)))
+    return pool
+
+
+def available(config):
+    """Endpoints que podem ser chamados agora; lista vazia se todos os circuitos estão abertos."""
+    pool = targets(config)
+    allowed = set(circuit_breaker.available([target.url for target in pool]))
+    return [target for target in pool if target.url in allowed]
+
+
+def retry_after(config):
+    """Segundos até algum endpoint do chatbot aceitar uma chamada de teste."""
+    return min(circuit_breaker.retry_after(target.url) for target in targets(config))
+
+
+aavailable = sync_to_async(available)
+aretry_after = sync_to_async(retry_after)
+
+
+def _cost(target, algorithm):
+    stats = _stats.get(target.url)
+    if stats is None:
+        return 0.0
+    if algorithm == 'least_outstanding':
+        return (stats.outstanding + 1) / target.weight
+    # Sem latência medida ainda: o endpoint recebe chamadas até ter uma
+    return (stats.outstanding + 1) * (stats.ewma_ms or 0.0) / target.weight
+
+
+def _pick(candidates):
+    return random.choices(candidates, weights=[target.weight for target in candidates])[0]
+
+
+def choose(pool, exclude=()):
+    """Endpoint para a próxima chamada, evitando os de ``exclude`` e os ejetados."""
+    candidates = [target for target in pool if target.url not in exclude] or pool
+    if len(candidates) == 1:
+        return candidates[0]
+    now = time.monotonic()
+    algorithm = _options()['ALGORITHM']
+    with _lock:
+        healthy = [target for target in candidates if _get(target.url).ejected_until <= now] or candidates
+        if len(healthy) == 1:
+            return healthy[0]
+        first = _pick(healthy)
+        second = _pick([target for target in healthy if target is not first])
+        return second if _cost(second, algorithm) < _cost(first, algorithm) else first
+
+
+def start(url):
+    """Marca uma chamada em andamento; retorna o instante de início para ``finish``."""
+    with _lock:
+        _get(url).outstanding += 1
+    return time.perf_counter()
+
+
+def finish(url, started, failed):
+    """
+    Encerra a chamada iniciada em ``started``.
+
+    ``failed`` é ``None`` para chamadas canceladas (hedging), que não contam
+    como sucesso nem como falha.
+    """
+    latency_ms = (time.perf_counter() - started) * 1000
+    options = _options()
+    ejected_for = None
+    with _lock:
+        stats = _get(url)
+        stats.outstanding -= 1
+        if failed is None:
+            return
+        stats.requests += 1
+        if not failed:
+            stats.consecutive_failures = 0
+            stats.ejections = 0
+            if stats.ewma_ms is None:
+                stats.ewma_ms = latency_ms
+            else:
+                stats.ewma_ms += options['EWMA_ALPHA'] * (latency_ms - stats.ewma_ms)
+            return
+        # A latência de uma falha (ex.: conexão recusada) não entra na média
+        stats.failures += 1
+        stats.consecutive_failures += 1
+        now = time.monotonic()
+        if stats.consecutive_failures >= options['EJECT_AFTER'] and stats.ejected_until <= now:
+            stats.ejections += 1
+            stats.consecutive_failures = 0
+            ejected_for = min(options['MAX_EJECT_SECONDS'], options['EJECT_SECONDS'] * 2 ** (stats.ejections - 1))
+            stats.ejected_until = now + ejected_for
+    if ejected_for is not None:
+        logger.warning('Endpoint do webhook ejetado', extra={'webhook_url': url, 'seconds': ejected_for})
+
+
+def endpoint_stats(url):
+    """Números do endpoint neste processo, para o dashboard."""
+    with _lock:
+        stats = _stats.get(url)
+        if stats is None:
+            return {'outstanding': 0, 'ewma_ms': None, 'requests': 0, 'failures': 0, 'ejected_for': 0}
+        return {
+            'outstanding': stats.outstanding,
+            'ewma_ms': stats.ewma_ms,
+            'requests': stats.requests,
+            'failures': stats.failures,
+            'ejected_for': max(0, int(stats.ejected_until - time.monotonic() + 0.999)),
+        }
+
+
+def pool_status(config, endpoints):
+    """
+    Linhas da tabela de endpoints do dashboard: o webhook principal e
+    ``endpoints`` (todos os ``WebhookEndpoint`` do chatbot, ativos ou não).
+    """
+    rows = [{'endpoint': None, 'url': config.webhook_url, 'weight': config.webhook_weight, 'enabled': True, 'health': config}]
+    rows += [
+        {'endpoint': endpoint, 'url': endpoint.url, 'weight': endpoint.weight, 'enabled': endpoint.enabled, 'health': endpoint}
+        for endpoint in endpoints
+    ]
+    total_weight = sum(row['weight'] for row in rows if row['enabled']) or 1
+    for row in rows:
+        row['share'] = row['weight'] / total_weight * 100 if row['enabled'] else 0
+        row['circuit'] = circuit_breaker.get_status(row['url'])
+        row['local'] = endpoint_stats(row['url'])
+    return rows
+
+
+def reset():
+    """Descarta os números do processo (testes)."""
+    with _lock:
+        _stats.clear()
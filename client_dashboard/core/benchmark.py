@@ -0,0 +1,340 @@
+"""
+Benchmark do proxy de chat, usado pelo comando ``benchmark_chat``.
+
+Tudo roda numa única máquina e sem rede externa:
+
+- ``StubWebhookServer`` sobe um webhook HTTP local com latência, taxa de erro
+  e streaming (SSE) configuráveis;
+- ``run_benchmark`` dispara requisições contra ``/api/v1/chat/`` ou
+  ``/api/chat/`` com concorrência fixa e mede cada uma.
+
+Por padrão as requisições passam pelo ``django.test.Client`` (pilha completa
+de middlewares e views, sem servidor HTTP), o que permite contar as queries
+por requisição. Com ``base_url`` elas vão por HTTP a um servidor já rodando
+(gunicorn/uvicorn) e as queries não são contadas.
+
+``run_pipeline_benchmark`` mede só a CPU gasta por mensagem para decodificar
+o pedido e montar a resposta a partir do corpo do webhook, sem rede.
+"""
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from django.db import connection
+from django.http import JsonResponse
+from django.test import Client, RequestFactory, override_settings
+
+from . import codec, proxy
+
+ENDPOINTS = {
+    'proxy': '/api/v1/chat/',
+    'legacy': '/api/chat/',
+}
+
+STUB_REPLY = 'Olá! Esta é uma resposta do webhook de benchmark.'
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        options = self.server.options
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+
+        latency = options['latency'] + random.uniform(0, options['jitter'])
+        if latency:
+            time.sleep(latency)
+
+        if random.random() < options['error_rate']:
+            self._send(500, 'application/json', b'{"error": "erro simulado"}')
+            return
+
+        if options['stream'] and 'text/event-stream' in self.headers.get('Accept', ''):
+            self._send_stream(options)
+            return
+
+        self._send(200, 'application/json', json.dumps({'reply': STUB_REPLY}).encode('utf-8'))
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, options):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for token in STUB_REPLY.split(' '):
+            event = f'data: {json.dumps({"token": token + " "})}\n\n'.encode('utf-8')
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(event), event))
+            self.wfile.flush()
+            if options['token_delay']:
+                time.sleep(options['token_delay'])
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, format, *args):
+        # Sem log por requisição: atrapalharia a medição
+        pass
+
+
+class StubWebhookServer:
+    """Webhook local para o benchmark; use como context manager."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, stream=False, token_delay=0.0):
+        self.options = {
+            'latency': latency,
+            'jitter': jitter,
+            'error_rate': error_rate,
+            'stream': stream,
+            'token_delay': token_delay,
+        }
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/webhook'
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.options = self.options
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-webhook', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def percentile(values, pct):
+    """Percentil por posição mais próxima (``values`` já ordenados)."""
+    if not values:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(values)) - 1)
+    return values[index]
+
+
+@dataclass
+class BenchmarkResult:
+    endpoint: str
+    requests: int
+    concurrency: int
+    elapsed: float
+    latencies: list = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    queries: list = field(default_factory=list)
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def latency(self, pct):
+        return percentile(sorted(self.latencies), pct)
+
+    @property
+    def queries_per_request(self):
+        return sum(self.queries) / len(self.queries) if self.queries else None
+
+    def as_dict(self):
+        return {
+            'endpoint': self.endpoint,
+            'requests': self.requests,
+            'concurrency': self.concurrency,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 1),
+            'latency_ms': {
+                'p50': round(self.latency(50) * 1000, 2),
+                'p95': round(self.latency(95) * 1000, 2),
+                'p99': round(self.latency(99) * 1000, 2),
+                'max': round(max(self.latencies, default=0) * 1000, 2),
+            },
+            'queries_per_request': (
+                None if self.queries_per_request is None else round(self.queries_per_request, 2)
+            ),
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+        }
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _payload(endpoint, chatbot_id, session_id, stream):
+    payload = {'message': 'Olá, qual o horário de atendimento?', 'session_id': session_id}
+    if endpoint == 'proxy':
+        payload['chatbot_id'] = str(chatbot_id)
+        payload['stream'] = stream
+    return json.dumps(payload)
+
+
+def _headers(endpoint, chatbot_id, stream):
+    headers = {}
+    if endpoint == 'legacy':
+        headers['X-Client-ID'] = str(chatbot_id)
+    if stream:
+        headers['Accept'] = 'application/x-ndjson, application/json'
+    return headers
+
+
+def _local_sender(endpoint):
+    client = Client()
+    path = ENDPOINTS[endpoint]
+
+    def send(body, headers):
+        counter = _QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = client.post(path, body, content_type='application/json', headers=headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            else:
+                response.content
+        return response.status_code, counter.count
+
+    return send, connection.close
+
+
+def _http_sender(endpoint, base_url):
+    client = httpx.Client(base_url=base_url, timeout=60.0)
+    path = ENDPOINTS[endpoint]
+
+    def send(body, headers):
+        response = client.post(path, content=body, headers={'Content-Type': 'application/json', **headers})
+        return response.status_code, None
+
+    return send, client.close
+
+
+def run_benchmark(endpoint, chatbot_ids, requests=1000, concurrency=10, stream=False, base_url=None, warmup=0):
+    """
+    Envia ``requests`` mensagens com ``concurrency`` threads, distribuídas
+    entre ``chatbot_ids``, e retorna um ``BenchmarkResult``.
+
+    ``warmup`` requisições por thread são enviadas antes e não entram na medição.
+    """
+    result = BenchmarkResult(endpoint=endpoint, requests=requests, concurrency=concurrency, elapsed=0.0)
+    lock = threading.Lock()
+    remaining = iter(range(requests))
+    start_barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        send, close = _http_sender(endpoint, base_url) if base_url else _local_sender(endpoint)
+        session_id = f'benchmark-{index}-{uuid.uuid4().hex[:8]}'
+        try:
+            for i in range(warmup):
+                chatbot_id = chatbot_ids[(index + i) % len(chatbot_ids)]
+                send(_payload(endpoint, chatbot_id, session_id, stream), _headers(endpoint, chatbot_id, stream))
+            start_barrier.wait()
+            while True:
+                with lock:
+                    number = next(remaining, None)
+                if number is None:
+                    return
+                chatbot_id = chatbot_ids[number % len(chatbot_ids)]
+                body = _payload(endpoint, chatbot_id, session_id, stream)
+                headers = _headers(endpoint, chatbot_id, stream)
+                started = time.perf_counter()
+                status, queries = send(body, headers)
+                latency = time.perf_counter() - started
+                with lock:
+                    result.latencies.append(latency)
+                    result.statuses[status] += 1
+                    if queries is not None:
+                        result.queries.append(queries)
+        except Exception:
+            # Libera as demais threads presas na barreira
+            start_barrier.abort()
+            raise
+        finally:
+            close()
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+# Resposta típica de um webhook com LLM: texto longo e alguns metadados
+PIPELINE_REPLY = (
+    'Nosso horário de atendimento é de segunda a sexta, das 8h às 18h, e aos sábados das 9h às 13h. '
+    'Fora desse horário você pode deixar sua mensagem que retornamos no próximo dia útil. '
+) * 3
+
+PIPELINE_BODIES = {
+    'reply': {'reply': PIPELINE_REPLY, 'session_id': 'abc123', 'sources': [{'title': 'FAQ', 'score': 0.92}] * 3},
+    'mensagem': {'mensagem': PIPELINE_REPLY, 'session_id': 'abc123', 'sources': [{'title': 'FAQ', 'score': 0.92}] * 3},
+}
+
+
+def _baseline_message(request, webhook_response):
+    """Caminho anterior: json da biblioteca padrão, normalização e nova serialização."""
+    data = json.loads(request.body)
+    proxy.build_webhook_payload(data)
+    webhook_data = proxy.normalize_reply(json.loads(webhook_response.content))
+    return JsonResponse(webhook_data).content
+
+
+def _pipeline_message(request, webhook_response):
+    data = proxy.parse_proxy_request(request)
+    proxy.build_webhook_payload(data)
+    return proxy.webhook_reply_response(webhook_response, webhook_response.content).content
+
+
+def _cpu_per_call(func, iterations):
+    for _ in range(min(200, iterations)):
+        func()
+    started = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def run_pipeline_benchmark(iterations=20000):
+    """
+    Microssegundos de CPU por mensagem, por formato de resposta do webhook:
+    o caminho anterior contra o pipeline atual com cada codec disponível.
+    """
+    body = json.dumps({'chatbot_id': str(uuid.uuid4()), 'message': 'Qual o horário de atendimento?', 'stream': False})
+    request = RequestFactory().post(ENDPOINTS['proxy'], body, content_type='application/json')
+    results = {}
+    for name, webhook_body in PIPELINE_BODIES.items():
+        webhook_response = httpx.Response(200, json=webhook_body)
+        variants = {'anterior': _cpu_per_call(lambda: _baseline_message(request, webhook_response), iterations)}
+        for codec_name in codec.CODECS:
+            with override_settings(JSON_CODEC=codec_name):
+                variants[f'pipeline ({codec_name})'] = _cpu_per_call(
+                    lambda: _pipeline_message(request, webhook_response), iterations
+                )
+        results[name] = variants
+    return results
@@ -0,0 +1,244 @@
+"""
+Circuit breaker por ``webhook_url``.
+
+Quando o webhook de um cliente começa a falhar (timeouts, erros de conexão ou
+respostas 5xx), o circuito abre e as mensagens recebem a resposta de fallback
+na hora, sem prender um worker até o timeout. Estados:
+
+- **closed**: as chamadas passam normalmente e os resultados são contados;
+- **open**: as chamadas são recusadas por ``COOLDOWN`` segundos;
+- **half_open**: terminado o cooldown, uma única chamada de teste passa; se
+  ela funcionar o circuito fecha, se falhar ele abre de novo.
+
+O estado e os contadores ficam no cache do Django (Redis em produção), então
+todos os workers enxergam o mesmo circuito. Os contadores usam baldes de
+``BUCKET`` segundos somados sobre a janela ``WINDOW``.
+"""
+import hashlib
+import time
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULT_OPTIONS = {
+    # Janela (segundos) considerada no cálculo da taxa de falhas
+    'WINDOW': 60,
+    'BUCKET': 10,
+    # Mínimo de chamadas na janela antes de o circuito poder abrir
+    'MIN_REQUESTS': 5,
+    # Fração de falhas na janela que abre o circuito
+    'FAILURE_RATE': 0.5,
+    # Segundos com o circuito aberto antes da chamada de teste
+    'COOLDOWN': 30,
+    # Tempo máximo reservado para a chamada de teste
+    'PROBE_TIMEOUT': 35,
+}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'CIRCUIT_BREAKER', {}))
+    return options
+
+
+def _prefix(webhook_url):
+    digest = hashlib.sha1(webhook_url.encode('utf-8')).hexdigest()
+    return f'circuit:{digest}'
+
+
+def _bucket_keys(prefix, options, now):
+    current = int(now // options['BUCKET'])
+    count = max(1, options['WINDOW'] // options['BUCKET'])
+    return [(f'{prefix}:total:{b}', f'{prefix}:fail:{b}') for b in range(current - count + 1, current + 1)]
+
+
+def _incr(key, timeout):
+    # add() é atômico: cria o contador se não existir, sem sobrescrever outro worker
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # A chave expirou entre o add e o incr
+        cache.set(key, 1, timeout)
+        return 1
+
+
+def _window_counts(prefix, options, now):
+    keys = _bucket_keys(prefix, options, now)
+    values = cache.get_many([key for pair in keys for key in pair])
+    total = sum(values.get(total_key, 0) for total_key, _ in keys)
+    failures = sum(values.get(fail_key, 0) for _, fail_key in keys)
+    return total, failures
+
+
+def _open(prefix, options, now):
+    cache.set(f'{prefix}:state', {'state': OPEN, 'opened_at': now}, options['COOLDOWN'] + options['WINDOW'])
+    cache.delete(f'{prefix}:probe')
+
+
+def allow_request(webhook_url):
+    """
+    Indica se a chamada ao webhook pode ser feita agora.
+
+    Com o circuito aberto e o cooldown encerrado, apenas o primeiro worker a
+    pedir recebe ``True`` (chamada de teste, estado half-open).
+    """
+    options = _options()
+    prefix = _prefix(webhook_url)
+    state = cache.get(f'{prefix}:state')
+    if not state:
+        return True
+    if time.time() - state['opened_at'] < options['COOLDOWN']:
+        return False
+    return cache.add(f'{prefix}:probe', 1, options['PROBE_TIMEOUT'])
+
+
+def available(webhook_urls):
+    """
+    Versão de ``allow_request`` para um conjunto de endpoints do mesmo chatbot.
+
+    Lê todos os circuitos numa única ida ao cache e retorna as URLs com o
+    circuito fechado. Só se todas estiverem abertas uma delas (com o cooldown
+    encerrado) recebe a chamada de teste. Lista vazia: nenhuma pode ser chamada.
+    """
+    options = _options()
+    keys = {f'{_prefix(url)}:state': url for url in webhook_urls}
+    states = cache.get_many(list(keys))
+    closed = [url for key, url in keys.items() if key not in states]
+    if closed:
+        return closed
+    now = time.time()
+    for key, url in keys.items():
+        if now - states[key]['opened_at'] >= options['COOLDOWN'] and cache.add(f'{_prefix(url)}:probe', 1, options['PROBE_TIMEOUT']):
+            return [url]
+    return []
+
+
+def open_urls(webhook_urls):
+    """URLs de ``webhook_urls`` com o circuito não fechado, numa única ida ao cache."""
+    keys = {f'{_prefix(url)}:state': url for url in webhook_urls}
+    return {keys[key] for key in cache.get_many(list(keys))}
+
+
+def is_open(webhook_url):
+    """Se o circuito não está fechado; não consome a chamada de teste."""
+    return cache.get(f'{_prefix(webhook_url)}:state') is not None
+
+
+def retry_after(webhook_url):
+    """Segundos até o circuito aceitar uma nova chamada de teste."""
+    state = cache.get(f'{_prefix(webhook_url)}:state')
+    if not state:
+        return 0
+    remaining = _options()['COOLDOWN'] - (time.time() - state['opened_at'])
+    return max(1, int(remaining + 0.999))
+
+
+def record_success(webhook_url):
+    options = _options()
+    prefix = _prefix(webhook_url)
+    total_key, _ = _bucket_keys(prefix, options, time.time())[-1]
+    _incr(total_key, options['WINDOW'] + options['BUCKET'])
+    if cache.get(f'{prefix}:probe'):
+        # Chamada de teste bem-sucedida: fecha o circuito
+        cache.delete_many([f'{prefix}:state', f'{prefix}:probe'])
+
+
+def record_failure(webhook_url):
+    options = _options()
+    prefix = _prefix(webhook_url)
+    now = time.time()
+    total_key, fail_key = _bucket_keys(prefix, options, now)[-1]
+    timeout = options['WINDOW'] + options['BUCKET']
+    _incr(total_key, timeout)
+    _incr(fail_key, timeout)
+
+    state = cache.get(f'{prefix}:state')
+    if state:
+        # Falha da chamada de teste: volta a abrir por mais um cooldown
+        if cache.get(f'{prefix}:probe'):
+            _open(prefix, options, now)
+        return
+
+    total, failures = _window_counts(prefix, options, now)
+    if total >= options['MIN_REQUESTS'] and failures / total >= options['FAILURE_RATE']:
+        _open(prefix, options, now)
+
+
+def is_failure(exc=None, status_code=None):
+    """Timeouts, erros de conexão e respostas 5xx contam como falha."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status_code = exc.response.status_code
+    elif exc is not None:
+        return True
+    return status_code is not None and status_code >= 500
+
+
+def record_result(webhook_url, exc=None, status_code=None):
+    """Registra o resultado de uma chamada ao webhook."""
+    if is_failure(exc, status_code):
+        record_failure(webhook_url)
+    else:
+        record_success(webhook_url)
+
+
+def get_status(webhook_url):
+    """Resumo do circuito para exibição no dashboard."""
+    options = _options()
+    result = {'state': CLOSED, 'requests': 0, 'failures': 0, 'failure_rate': 0.0, 'retry_after': 0}
+    if not webhook_url:
+        return result
+    prefix = _prefix(webhook_url)
+    now = time.time()
+    total, failures = _window_counts(prefix, options, now)
+    result.update(requests=total, failures=failures, failure_rate=(failures / total if total else 0.0))
+    state = cache.get(f'{prefix}:state')
+    if state:
+        if now - state['opened_at'] < options['COOLDOWN']:
+            result['state'] = OPEN
+            result['retry_after'] = retry_after(webhook_url)
+        else:
+            result['state'] = HALF_OPEN
+    return result
+
+
+def trip(webhook_url):
+    """
+    Abre o circuito sem esperar falhas de mensagens reais (ex.: o webhook
+    deixou de responder às sondas de ``core.health``).
+    """
+    options = _options()
+    cache.set(
+        f'{_prefix(webhook_url)}:state',
+        {'state': OPEN, 'opened_at': time.time(), 'tripped': True},
+        options['COOLDOWN'] + options['WINDOW'],
+    )
+
+
+def release(webhook_url):
+    """Fecha o circuito se ele foi aberto por ``trip``."""
+    state = cache.get(f'{_prefix(webhook_url)}:state')
+    if state and state.get('tripped'):
+        reset(webhook_url)
+
+
+def reset(webhook_url):
+    """Fecha o circuito manualmente (ex.: após o cliente trocar o webhook)."""
+    prefix = _prefix(webhook_url)
+    cache.delete_many([f'{prefix}:state', f'{prefix}:probe'])
+
+
+# Variantes para as views assíncronas (o cache do Django é síncrono). Só usam
+# o cache: podem rodar em qualquer thread, sem esperar a thread do contexto
+aallow_request = sync_to_async(allow_request, thread_sensitive=False)
+aavailable = sync_to_async(available, thread_sensitive=False)
+aopen_urls = sync_to_async(open_urls, thread_sensitive=False)
+ais_open = sync_to_async(is_open, thread_sensitive=False)
+aretry_after = sync_to_async(retry_after, thread_sensitive=False)
+arecord_result = sync_to_async(record_result, thread_sensitive=False)
@@ -0,0 +1,84 @@
+"""
+Codec JSON do caminho quente do chat.
+
+Usa ``orjson`` quando o pacote está instalado (decodifica e gera bytes várias
+vezes mais rápido que o ``json`` da biblioteca padrão) e o ``json`` caso
+contrário. ``settings.JSON_CODEC`` (``'auto'``, ``'orjson'`` ou ``'json'``)
+força um dos dois.
+
+``dumps`` sempre devolve bytes UTF-8, prontos para o corpo da resposta;
+``FastJsonResponse`` é o ``JsonResponse`` equivalente.
+"""
+import json
+
+from django.conf import settings
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+# orjson.JSONDecodeError é subclasse de json.JSONDecodeError
+DecodeError = json.JSONDecodeError
+
+
+class StdlibCodec:
+    name = 'json'
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        # Sem argumentos o json usa o encoder padrão já instanciado (mais rápido)
+        return json.dumps(obj).encode('utf-8')
+
+
+class OrjsonCodec:
+    name = 'orjson'
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # Tipos que o orjson recusa (ex.: inteiros acima de 64 bits)
+            return StdlibCodec.dumps(obj)
+
+
+CODECS = {'json': StdlibCodec}
+if orjson is not None:
+    CODECS['orjson'] = OrjsonCodec
+
+
+def get_codec():
+    name = getattr(settings, 'JSON_CODEC', 'auto')
+    if name == 'auto':
+        return OrjsonCodec if orjson is not None else StdlibCodec
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f'JSON_CODEC inválido ou indisponível: {name!r}') from None
+
+
+def loads(data):
+    """Decodifica ``str`` ou ``bytes``; levanta ``DecodeError`` se inválido."""
+    return get_codec().loads(data)
+
+
+def dumps(obj):
+    return get_codec().dumps(obj)
+
+
+class FastJsonResponse(HttpResponse):
+    """``JsonResponse`` serializado pelo codec configurado."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
@@ -0,0 +1,155 @@
+"""
+Cache em duas camadas do ``ChatbotConfig`` para o caminho quente do chat.
+
+1. LRU em memória do processo (``TTLLRUCache``), com TTL curto;
+2. cache compartilhado do Django (``settings.CACHES``, Redis em produção).
+
+Só em falta nas duas camadas o banco é consultado. IDs inexistentes ou
+inválidos também são guardados (entrada negativa), para que uma enxurrada de
+UUIDs falsos não chegue ao Postgres.
+
+A invalidação é feita pelos sinais ``post_save``/``post_delete`` do modelo e
+dos seus ``WebhookEndpoint`` (ver ``core.signals``). Ela limpa o cache
+compartilhado e o LRU do processo que gravou; os demais processos enxergam a
+alteração em até ``LOCAL_TTL`` segundos.
+
+Nas views de chat e do embed a consulta pode ir para uma réplica
+(``core.replicas``), exceto logo depois de uma alteração do chatbot: aí ela
+vai para o primário, para que o cache não guarde a versão anterior.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from . import replicas
+from .lru import TTLLRUCache
+from .models import ChatbotConfig, WebhookEndpoint
+
+DEFAULT_OPTIONS = {
+    'LOCAL_TTL': 5.0,
+    'LOCAL_MAX_ENTRIES': 1000,
+    'SHARED_TTL': 300,
+    'NEGATIVE_TTL': 30,
+}
+
+# Marcador de "chatbot inexistente" gravado no cache compartilhado
+_NOT_FOUND = 'chatbot-config:not-found'
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'CHATBOT_CONFIG_CACHE', {}))
+    return options
+
+
+_local = TTLLRUCache(
+    max_entries=_options()['LOCAL_MAX_ENTRIES'],
+    ttl=_options()['LOCAL_TTL'],
+)
+
+
+def _normalize_id(chatbot_id):
+    try:
+        return str(uuid.UUID(str(chatbot_id)))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def cache_key(chatbot_id):
+    return f'chatbot-config:{chatbot_id}'
+
+
+def _queryset():
+    # Os endpoints adicionais vão junto para o cache (ChatbotConfig.active_webhook_endpoints)
+    return ChatbotConfig.objects.prefetch_related(
+        Prefetch('webhook_endpoints', queryset=WebhookEndpoint.objects.filter(enabled=True), to_attr='active_endpoints')
+    )
+
+
+def _fetch(chatbot_id):
+    with replicas.primary(replicas.written_recently(chatbot_id)):
+        try:
+            return _queryset().get(id=chatbot_id)
+        except ChatbotConfig.DoesNotExist:
+            return None
+
+
+async def _afetch(chatbot_id):
+    with replicas.primary(await replicas.awritten_recently(chatbot_id)):
+        try:
+            return await _queryset().aget(id=chatbot_id)
+        except ChatbotConfig.DoesNotExist:
+            return None
+
+
+def _remember(key, config):
+    options = _options()
+    if config is None:
+        _local.set(key, _NOT_FOUND, ttl=min(options['LOCAL_TTL'], options['NEGATIVE_TTL']))
+        return _NOT_FOUND, options['NEGATIVE_TTL']
+    _local.set(key, config)
+    return config, options['SHARED_TTL']
+
+
+def get_chatbot_config(chatbot_id):
+    """
+    Retorna o ``ChatbotConfig`` de ``chatbot_id`` ou ``None`` se não existir.
+
+    A instância devolvida é compartilhada entre requisições: trate-a como
+    somente leitura. Para alterar um chatbot, busque-o no ORM.
+    """
+    normalized = _normalize_id(chatbot_id)
+    if normalized is None:
+        return None
+    key = cache_key(normalized)
+
+    value = _local.get(key)
+    if value is None:
+        value = cache.get(key)
+        if value is None:
+            config = _fetch(normalized)
+            value, timeout = _remember(key, config)
+            cache.set(key, value, timeout)
+        else:
+            _remember(key, None if value == _NOT_FOUND else value)
+    return None if value == _NOT_FOUND else value
+
+
+async def aget_chatbot_config(chatbot_id):
+    """Versão assíncrona de ``get_chatbot_config``."""
+    normalized = _normalize_id(chatbot_id)
+    if normalized is None:
+        return None
+    key = cache_key(normalized)
+
+    value = _local.get(key)
+    if value is None:
+        value = await cache.aget(key)
+        if value is None:
+            config = await _afetch(normalized)
+            value, timeout = _remember(key, config)
+            await cache.aset(key, value, timeout)
+        else:
+            _remember(key, None if value == _NOT_FOUND else value)
+    return None if value == _NOT_FOUND else value
+
+
+def invalidate_chatbot_config(chatbot_id, written=True):
+    """
+    Remove o chatbot das duas camadas de cache.
+
+    ``written=False`` quando a alteração não precisa ser vista na hora (perfil
+    de saúde): a próxima leitura pode continuar numa réplica.
+    """
+    normalized = _normalize_id(chatbot_id)
+    key = cache_key(normalized)
+    _local.delete(key)
+    cache.delete(key)
+    if written:
+        replicas.mark_written(normalized)
+
+
+def clear_local_cache():
+    _local.clear()
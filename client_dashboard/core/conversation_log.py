@@ -0,0 +1,213 @@
+"""
+Registro das conversas de chat com gravação em lote, fora da requisição.
+
+As views só acrescentam as mensagens a um buffer em memória (``record``); uma
+thread de fundo por processo grava o buffer com ``bulk_create`` quando ele
+atinge ``BATCH_SIZE`` mensagens ou a cada ``FLUSH_INTERVAL`` segundos. Assim a
+latência do chat não inclui nenhuma escrita no banco.
+
+O buffer é limitado a ``MAX_BUFFERED`` mensagens: se o banco ficar fora do ar,
+as mais antigas são descartadas em vez de crescer a memória do worker. Ao
+encerrar o processo normalmente, o que restar no buffer é gravado.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import ChatbotConfig, Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 2.0,
+    'MAX_BUFFERED': 10000,
+}
+
+SESSION_ID_MAX_LENGTH = 64
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'CONVERSATION_LOG', {}))
+    return options
+
+
+def clean_session_id(value):
+    """Normaliza o session_id enviado pelo widget; ``None`` se ausente/inválido."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if not value or len(value) > SESSION_ID_MAX_LENGTH:
+        return None
+    return value
+
+
+class ConversationLogBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._pid = os.getpid()
+
+    def record(self, chatbot_id, session_id, role, content):
+        """Acrescenta uma mensagem ao buffer (não acessa o banco)."""
+        options = _options()
+        if not options['ENABLED'] or not session_id or not content:
+            return
+        item = (chatbot_id, session_id, role, str(content), timezone.now())
+        with self._lock:
+            if len(self._pending) >= options['MAX_BUFFERED']:
+                self._pending.popleft()
+                logger.warning('Buffer de conversas cheio; descartando a mensagem mais antiga.')
+            self._pending.append(item)
+            size = len(self._pending)
+        self._ensure_worker()
+        if size >= options['BATCH_SIZE']:
+            self._wakeup.set()
+
+    def reset_after_fork(self):
+        """No processo filho o buffer e a thread do pai não valem."""
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._pid = os.getpid()
+
+    def _ensure_worker(self):
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='conversation-log', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(_options()['FLUSH_INTERVAL'])
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Falha ao gravar o lote de conversas.')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Grava tudo que está no buffer. Retorna o número de mensagens gravadas."""
+        with self._lock:
+            batch, self._pending = list(self._pending), deque()
+        if not batch:
+            return 0
+        try:
+            with transaction.atomic():
+                _write_batch(batch, _options()['BATCH_SIZE'])
+        except Exception:
+            # Devolve o lote ao buffer para a próxima tentativa, respeitando o limite
+            with self._lock:
+                self._pending.extendleft(reversed(batch))
+                while len(self._pending) > _options()['MAX_BUFFERED']:
+                    self._pending.popleft()
+            raise
+        return len(batch)
+
+    def pending(self):
+        return len(self._pending)
+
+
+def _write_batch(batch, batch_size):
+    # Descarta mensagens de chatbots excluídos antes de gravar (violaria a FK)
+    existing = {
+        str(pk) for pk in ChatbotConfig.objects.filter(
+            pk__in={item[0] for item in batch}
+        ).values_list('pk', flat=True)
+    }
+    batch = [item for item in batch if str(item[0]) in existing]
+
+    sessions = {}
+    for chatbot_id, session_id, _, _, created_at in batch:
+        key = (str(chatbot_id), session_id)
+        first, last = sessions.get(key, (created_at, created_at))
+        sessions[key] = (min(first, created_at), max(last, created_at))
+
+    Conversation.objects.bulk_create(
+        [
+            Conversation(chatbot_id=chatbot_id, session_id=session_id, started_at=first, last_message_at=last)
+            for (chatbot_id, session_id), (first, last) in sessions.items()
+        ],
+        ignore_conflicts=True,
+        batch_size=batch_size,
+    )
+    conversations = {
+        (str(conversation.chatbot_id), conversation.session_id): conversation
+        for conversation in Conversation.objects.filter(
+            chatbot_id__in={chatbot_id for chatbot_id, _ in sessions},
+            session_id__in={session_id for _, session_id in sessions},
+        ).only('id', 'chatbot_id', 'session_id', 'last_message_at')
+    }
+
+    messages = []
+    for chatbot_id, session_id, role, content, created_at in batch:
+        conversation = conversations[(str(chatbot_id), session_id)]
+        messages.append(Message(
+            conversation=conversation,
+            chatbot_id=chatbot_id,
+            role=role,
+            content=content,
+            created_at=created_at,
+        ))
+    Message.objects.bulk_create(messages, batch_size=batch_size)
+
+    updated = []
+    for key, (_, last) in sessions.items():
+        conversation = conversations[key]
+        if conversation.last_message_at < last:
+            conversation.last_message_at = last
+            updated.append(conversation)
+    Conversation.objects.bulk_update(updated, ['last_message_at'], batch_size=batch_size)
+
+
+log_buffer = ConversationLogBuffer()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=log_buffer.reset_after_fork)
+
+
+def record(chatbot_id, session_id, role, content):
+    log_buffer.record(chatbot_id, session_id, role, content)
+
+
+def flush():
+    return log_buffer.flush()
+
+
+def start_exchange(chatbot_id, session_id, message):
+    """
+    Registra a mensagem do visitante e retorna o callback que registra a
+    resposta do chatbot (chamado pelas views quando a resposta é conhecida).
+    """
+    record(chatbot_id, session_id, Message.ROLE_USER, message)
+
+    def on_reply(reply):
+        record(chatbot_id, session_id, Message.ROLE_BOT, reply)
+
+    return on_reply
+
+
+@atexit.register
+def _flush_on_exit():
+    if log_buffer.pending() and log_buffer._pid == os.getpid():
+        try:
+            log_buffer.flush()
+        except Exception:
+            logger.exception('Falha ao gravar as conversas pendentes no encerramento.')
@@ -0,0 +1,454 @@
+"""
+Entrega em fila das mensagens ao webhook (``ChatbotConfig.delivery_mode = 'queue'``).
+
+Para webhooks que demoram mais do que uma requisição deveria ficar aberta:
+
+1. ``/api/v1/chat/`` grava a mensagem na fila e responde ``202`` na hora, com
+   o id do job e a URL de consulta;
+2. workers (``manage.py run_delivery_worker``) entregam a mensagem ao webhook,
+   com novas tentativas e backoff exponencial em timeouts, erros de conexão,
+   5xx, 408 e 429;
+3. o widget busca a resposta em ``/api/v1/chat/jobs/<id>/`` com long-poll.
+
+Assim nenhum worker web fica esperando o webhook. Há dois backends
+(``DELIVERY_QUEUE['BACKEND']``), nenhum precisa de broker externo:
+
+- ``database``: jobs no modelo ``DeliveryJob``, reservados pelos workers com
+  um UPDATE condicional (funciona em SQLite e Postgres);
+- ``inprocess``: fila em memória e threads no próprio processo web; só serve
+  para desenvolvimento com um único processo.
+
+O estado de cada job também é publicado no cache do Django, para o long-poll
+não consultar o banco a cada volta.
+"""
+import asyncio
+import functools
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import timedelta
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+
+from . import balancer, circuit_breaker, conversation_log, proxy, session_context
+from .config_cache import get_chatbot_config
+from .models import DeliveryJob, Message
+from .webhook_client import webhook_transport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'BACKEND': 'database',
+    'MAX_ATTEMPTS': 5,
+    # Espera antes da tentativa n: BACKOFF_BASE * 2**(n-1), limitada a BACKOFF_MAX
+    'BACKOFF_BASE': 2.0,
+    'BACKOFF_MAX': 300.0,
+    # Timeout de cada entrega ao webhook
+    'TIMEOUT': 120.0,
+    # Reserva de um job em entrega; após isso outro worker pode retomá-lo
+    'LEASE': 180,
+    # Tempo máximo que o long-poll segura a requisição
+    'LONG_POLL_TIMEOUT': 25.0,
+    # Intervalos de consulta do long-poll ao cache e ao banco
+    'POLL_INTERVAL': 0.25,
+    'DB_POLL_INTERVAL': 2.0,
+    # Pausa do worker quando a fila está vazia
+    'IDLE_SLEEP': 1.0,
+    'RESULT_TTL': 3600,
+    # Jobs finalizados são apagados do banco depois disso
+    'RETENTION': 86400,
+    'INPROCESS_THREADS': 4,
+}
+
+FINISHED = (DeliveryJob.STATUS_DONE, DeliveryJob.STATUS_FAILED)
+
+FAILED_REPLY = 'Desculpe, não consegui obter uma resposta agora. Tente novamente mais tarde.'
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'DELIVERY_QUEUE', {}))
+    return options
+
+
+class DeliveryFailed(Exception):
+    def __init__(self, message, retryable=True, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def backoff(attempts):
+    """Segundos até a próxima tentativa depois de ``attempts`` falhas (com jitter)."""
+    options = _options()
+    delay = min(options['BACKOFF_MAX'], options['BACKOFF_BASE'] * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def deliver(chatbot_id, payload):
+    """Entrega ``payload`` ao webhook do chatbot e retorna o texto da resposta."""
+    config = get_chatbot_config(chatbot_id)
+    if config is None or not config.webhook_url:
+        raise DeliveryFailed('Chatbot sem webhook configurado', retryable=False)
+
+    targets = balancer.available(config)
+    if not targets:
+        raise DeliveryFailed('Circuito do webhook aberto', retry_after=balancer.retry_after(config))
+    # Uma chamada por tentativa; a próxima tentativa do job pode ir para outro endpoint
+    url = balancer.choose(targets).url
+    started = balancer.start(url)
+    failed = True
+    try:
+        response = webhook_transport.post_stream(url, json=payload, headers=proxy.WEBHOOK_HEADERS, timeout=_options()['TIMEOUT'])
+        try:
+            failed = circuit_breaker.is_failure(status_code=response.status_code)
+            response.raise_for_status()
+            # Mesmo limite de tamanho das respostas lidas nas requisições
+            body = proxy.read_webhook_body(response)
+        finally:
+            response.close()
+    except proxy.WebhookBodyTooLarge as exc:
+        circuit_breaker.record_result(url, status_code=response.status_code)
+        raise DeliveryFailed(str(exc), retryable=False)
+    except httpx.HTTPError as exc:
+        circuit_breaker.record_result(url, exc=exc)
+        status = exc.response.status_code if isinstance(exc, httpx.HTTPStatusError) else None
+        if status is None:
+            raise DeliveryFailed(f'{type(exc).__name__}: {exc}')
+        raise DeliveryFailed(f'Webhook respondeu HTTP {status}', retryable=status >= 500 or status in (408, 429))
+    finally:
+        balancer.finish(url, started, failed)
+    circuit_breaker.record_result(url, status_code=response.status_code)
+    return proxy.reply_data(response, body)['reply']
+
+
+def result_key(job_id):
+    return f'delivery:job:{job_id}'
+
+
+def _publish(job_id, status, reply='', error=''):
+    cache.set(result_key(job_id), {'status': status, 'reply': reply, 'error': error}, _options()['RESULT_TTL'])
+
+
+def process(backend, job):
+    """Tenta entregar ``job`` (já reservado) e registra o resultado."""
+    _publish(job.pk, DeliveryJob.STATUS_RUNNING)
+    try:
+        reply = deliver(job.chatbot_id, job.payload)
+    except DeliveryFailed as exc:
+        if exc.retryable and job.attempts < _options()['MAX_ATTEMPTS']:
+            delay = exc.retry_after or backoff(job.attempts)
+            backend.retry(job, str(exc), delay)
+            _publish(job.pk, DeliveryJob.STATUS_QUEUED)
+            logger.info('Entrega adiada', extra={'job_id': str(job.pk), 'attempts': job.attempts, 'delay': round(delay, 1)})
+        else:
+            backend.fail(job, str(exc))
+            _publish(job.pk, DeliveryJob.STATUS_FAILED, reply=FAILED_REPLY, error=str(exc))
+            logger.warning('Entrega falhou', extra={'job_id': str(job.pk), 'attempts': job.attempts, 'error': str(exc)})
+        return
+    backend.complete(job, reply)
+    _publish(job.pk, DeliveryJob.STATUS_DONE, reply=reply)
+    conversation_log.record(job.chatbot_id, job.session_id, Message.ROLE_BOT, reply)
+    session_context.remember(get_chatbot_config(job.chatbot_id), job.session_id, job.payload['message'], reply)
+
+
+class DatabaseBackend:
+    """Fila no modelo ``DeliveryJob``; os workers podem estar em outros processos."""
+
+    def enqueue(self, chatbot_id, session_id, payload):
+        job = DeliveryJob.objects.create(chatbot_id=chatbot_id, session_id=session_id or '', payload=payload)
+        return job.pk
+
+    def status(self, job_id):
+        return DeliveryJob.objects.filter(pk=job_id).values('status', 'reply', 'error').first()
+
+    def _claimable(self, now):
+        return Q(status=DeliveryJob.STATUS_QUEUED, available_at__lte=now) | Q(
+            status=DeliveryJob.STATUS_RUNNING, locked_until__lt=now
+        )
+
+    def claim(self):
+        """Reserva o próximo job disponível; ``None`` se a fila estiver vazia."""
+        now = timezone.now()
+        candidates = list(
+            DeliveryJob.objects.filter(self._claimable(now)).order_by('available_at').values_list('pk', flat=True)[:10]
+        )
+        for pk in candidates:
+            # UPDATE condicional: se outro worker reservou antes, nenhuma linha muda
+            claimed = DeliveryJob.objects.filter(self._claimable(now), pk=pk).update(
+                status=DeliveryJob.STATUS_RUNNING,
+                attempts=F('attempts') + 1,
+                locked_until=now + timedelta(seconds=_options()['LEASE']),
+                updated_at=now,
+            )
+            if claimed:
+                return DeliveryJob.objects.get(pk=pk)
+        return None
+
+    def complete(self, job, reply):
+        DeliveryJob.objects.filter(pk=job.pk).update(
+            status=DeliveryJob.STATUS_DONE, reply=reply, error='', locked_until=None, updated_at=timezone.now()
+        )
+
+    def retry(self, job, error, delay):
+        now = timezone.now()
+        DeliveryJob.objects.filter(pk=job.pk).update(
+            status=DeliveryJob.STATUS_QUEUED,
+            error=error,
+            available_at=now + timedelta(seconds=delay),
+            locked_until=None,
+            updated_at=now,
+        )
+
+    def fail(self, job, error):
+        DeliveryJob.objects.filter(pk=job.pk).update(
+            status=DeliveryJob.STATUS_FAILED, error=error, locked_until=None, updated_at=timezone.now()
+        )
+
+    def purge(self):
+        """Apaga os jobs finalizados há mais de ``RETENTION`` segundos."""
+        cutoff = timezone.now() - timedelta(seconds=_options()['RETENTION'])
+        deleted, _ = DeliveryJob.objects.filter(status__in=FINISHED, updated_at__lt=cutoff).delete()
+        return deleted
+
+
+class InProcessBackend:
+    """Fila em memória atendida por threads do próprio processo (desenvolvimento)."""
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._threads = []
+        self._pid = os.getpid()
+
+    def enqueue(self, chatbot_id, session_id, payload):
+        job = DeliveryJob(chatbot_id=chatbot_id, session_id=session_id or '', payload=payload)
+        with self._lock:
+            self._jobs[job.pk] = job
+        self._queue.put(job)
+        self._ensure_threads()
+        return job.pk
+
+    def status(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return {'status': job.status, 'reply': job.reply, 'error': job.error}
+
+    def claim(self, timeout=None):
+        try:
+            job = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        job.status = DeliveryJob.STATUS_RUNNING
+        job.attempts += 1
+        return job
+
+    def complete(self, job, reply):
+        job.status, job.reply = DeliveryJob.STATUS_DONE, reply
+        self._forget(job)
+
+    def retry(self, job, error, delay):
+        job.status, job.error = DeliveryJob.STATUS_QUEUED, error
+        timer = threading.Timer(delay, self._queue.put, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def fail(self, job, error):
+        job.status, job.error = DeliveryJob.STATUS_FAILED, error
+        self._forget(job)
+
+    def _forget(self, job):
+        # O resultado fica no cache por RESULT_TTL; a memória não cresce
+        with self._lock:
+            self._jobs.pop(job.pk, None)
+
+    def purge(self):
+        return 0
+
+    def _ensure_threads(self):
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for index in range(len(self._threads), _options()['INPROCESS_THREADS']):
+                thread = threading.Thread(target=self._run, name=f'delivery-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job = self.claim()
+            try:
+                process(self, job)
+            except Exception:
+                logger.exception('Erro ao processar a entrega', extra={'job_id': str(job.pk)})
+            finally:
+                close_old_connections()
+
+
+_BACKENDS = {
+    'database': DatabaseBackend,
+    'inprocess': InProcessBackend,
+}
+
+
+@functools.cache
+def _backend(name):
+    try:
+        return _BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f'Backend de fila desconhecido: {name}')
+
+
+def get_backend():
+    return _backend(_options()['BACKEND'])
+
+
+# --- API usada pelas views -----------------------------------------------
+
+def enqueue(config, data, session_id, context=()):
+    """Coloca a mensagem do widget na fila e retorna o id do job."""
+    job_id = get_backend().enqueue(config.pk, session_id, proxy.build_webhook_payload(data, session_id, context))
+    _publish(job_id, DeliveryJob.STATUS_QUEUED)
+    return job_id
+
+
+def queued_response(job_id):
+    return JsonResponse({
+        'job_id': str(job_id),
+        'status': DeliveryJob.STATUS_QUEUED,
+        'poll_url': reverse('chat_job_result', args=[job_id]),
+    }, status=202)
+
+
+def get_result(job_id, check_backend=True):
+    """Estado do job (``status``, ``reply``, ``error``) ou ``None`` se não existir."""
+    result = cache.get(result_key(job_id))
+    if (result is None or result['status'] not in FINISHED) and check_backend:
+        # O banco é a fonte da verdade: sem Redis o cache dos workers não é o nosso
+        result = get_backend().status(job_id) or result
+    if result is not None and result['status'] == DeliveryJob.STATUS_FAILED and not result['reply']:
+        result = {**result, 'reply': FAILED_REPLY}
+    return result
+
+
+def wait_for_result(job_id, timeout):
+    """Long-poll: espera até ``timeout`` segundos o job terminar."""
+    options = _options()
+    deadline = time.monotonic() + timeout
+    next_db_check = 0.0
+    while True:
+        now = time.monotonic()
+        check_backend = now >= next_db_check
+        if check_backend:
+            next_db_check = now + options['DB_POLL_INTERVAL']
+        result = get_result(job_id, check_backend=check_backend)
+        remaining = deadline - time.monotonic()
+        if result is None or result['status'] in FINISHED or remaining <= 0:
+            return result
+        time.sleep(min(options['POLL_INTERVAL'], remaining))
+
+
+async def await_result(job_id, timeout):
+    """Versão assíncrona de ``wait_for_result``: não ocupa uma thread enquanto espera."""
+    options = _options()
+    deadline = time.monotonic() + timeout
+    next_db_check = 0.0
+    while True:
+        now = time.monotonic()
+        check_backend = now >= next_db_check
+        if check_backend:
+            next_db_check = now + options['DB_POLL_INTERVAL']
+        result = await aget_result(job_id, check_backend=check_backend)
+        remaining = deadline - time.monotonic()
+        if result is None or result['status'] in FINISHED or remaining <= 0:
+            return result
+        await asyncio.sleep(min(options['POLL_INTERVAL'], remaining))
+
+
+def long_poll_timeout(request):
+    """Valor de ``?wait=`` limitado a ``LONG_POLL_TIMEOUT`` (padrão: o máximo)."""
+    limit = _options()['LONG_POLL_TIMEOUT']
+    try:
+        wait = float(request.GET.get('wait', limit))
+    except ValueError:
+        wait = limit
+    return max(0.0, min(wait, limit))
+
+
+def result_response(job_id, result):
+    if result is None:
+        return JsonResponse({'error': 'Job não encontrado'}, status=404)
+    body = {'job_id': str(job_id), 'status': result['status']}
+    if result['status'] in FINISHED:
+        body['reply'] = result['reply']
+    if result['status'] == DeliveryJob.STATUS_FAILED:
+        body['error'] = result['error']
+    return JsonResponse(body)
+
+
+aenqueue = sync_to_async(enqueue)
+aget_result = sync_to_async(get_result)
+
+
+# --- Workers ---------------------------------------------------------------
+
+def process_next(backend=None):
+    """Reserva e entrega um job; retorna ``False`` se a fila estava vazia."""
+    backend = backend or get_backend()
+    job = backend.claim()
+    if job is None:
+        return False
+    try:
+        process(backend, job)
+    except Exception:
+        # O job volta para a fila quando a reserva (LEASE) expirar
+        logger.exception('Erro ao processar a entrega', extra={'job_id': str(job.pk)})
+    return True
+
+
+def run_worker(stop, threads=1, purge_interval=600):
+    """Atende a fila do banco com ``threads`` threads até ``stop`` ser sinalizado."""
+    backend = DatabaseBackend()
+    options = _options()
+
+    def loop(purge):
+        next_purge = time.monotonic()
+        while not stop.is_set():
+            try:
+                if purge and time.monotonic() >= next_purge:
+                    backend.purge()
+                    next_purge = time.monotonic() + purge_interval
+                if not process_next(backend):
+                    stop.wait(options['IDLE_SLEEP'])
+            except Exception:
+                logger.exception('Erro no worker de entregas')
+                stop.wait(options['IDLE_SLEEP'])
+            finally:
+                close_old_connections()
+
+    workers = [
+        threading.Thread(target=loop, args=(index == 0,), name=f'delivery-{index}', daemon=True)
+        for index in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    conversation_log.flush()
@@ -0,0 +1,126 @@
+"""
+Cache HTTP e de renderização do widget embutido (``/embed/<id>/``).
+
+O HTML do embed só muda quando o chatbot é editado, então:
+
+- a resposta leva ``ETag`` e ``Last-Modified`` derivados de
+  ``ChatbotConfig.updated_at``; GETs condicionais recebem ``304`` sem
+  renderizar nada (``django.views.decorators.http.condition``);
+- o HTML renderizado fica no cache do Django, com a versão do chatbot na
+  entrada; o sinal ``post_save`` do modelo o descarta (ver ``core.signals``).
+
+Pré-visualizações do dashboard (``?primary_color=...``/``?welcome_message=...``)
+não usam nenhum dos dois caches.
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template, render_to_string
+from django.templatetags.static import static
+from django.utils.cache import patch_cache_control
+
+from .config_cache import get_chatbot_config
+
+TEMPLATE_NAME = 'chat_embed.html'
+
+# Parâmetros de pré-visualização aceitos pela view
+PREVIEW_PARAMS = ('primary_color', 'welcome_message')
+
+DEFAULT_OPTIONS = {
+    # Validade do HTML renderizado no cache compartilhado
+    'TTL': 3600,
+    # max-age enviado ao navegador; 0 faz o navegador revalidar (e receber 304)
+    'MAX_AGE': 0,
+}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'EMBED_CACHE', {}))
+    return options
+
+
+def is_preview(request):
+    return any(param in request.GET for param in PREVIEW_PARAMS)
+
+
+@functools.cache
+def _build_version():
+    """
+    Versão do template e dos arquivos estáticos que ele referencia.
+
+    Muda a cada deploy que altera o template ou o chat.js/chat.css, para que
+    ETags e HTML em cache de uma versão antiga não sejam reaproveitados.
+    """
+    source = get_template(TEMPLATE_NAME).template.source
+    fingerprint = '\n'.join([source, static('chat.js'), static('chat.css')])
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:12]
+
+
+def _version(config):
+    return f'{config.updated_at.timestamp():.6f}-{_build_version()}'
+
+
+def cache_key(chatbot_id):
+    return f'chat-embed:{chatbot_id}'
+
+
+def _cacheable_config(request, chatbot_id):
+    if is_preview(request):
+        return None
+    return get_chatbot_config(chatbot_id)
+
+
+def embed_etag(request, chatbot_id):
+    config = _cacheable_config(request, chatbot_id)
+    if config is None:
+        return None
+    digest = hashlib.sha1(f'{config.pk}:{_version(config)}'.encode('utf-8')).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def embed_last_modified(request, chatbot_id):
+    config = _cacheable_config(request, chatbot_id)
+    return config.updated_at if config is not None else None
+
+
+def _context(config, overrides):
+    return {
+        'config': {
+            'primary_color': overrides.get('primary_color', config.primary_color),
+            'welcome_message': overrides.get('welcome_message', config.welcome_message),
+            'name': config.name,
+            'id': config.id,
+        },
+        'chatbot_id': config.id,
+    }
+
+
+def render_embed(request, config):
+    """HTML do embed; fora da pré-visualização vem do cache quando possível."""
+    if is_preview(request):
+        return render_to_string(TEMPLATE_NAME, _context(config, request.GET), request=request)
+
+    key = cache_key(config.pk)
+    version = _version(config)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    html = render_to_string(TEMPLATE_NAME, _context(config, {}))
+    cache.set(key, (version, html), _options()['TTL'])
+    return html
+
+
+def patch_embed_headers(request, response):
+    """Permite ao navegador guardar o embed, revalidando pelo ETag."""
+    if not is_preview(request):
+        patch_cache_control(response, public=True, max_age=_options()['MAX_AGE'])
+    else:
+        patch_cache_control(response, no_store=True)
+    return response
+
+
+def invalidate_embed(chatbot_id):
+    cache.delete(cache_key(chatbot_id))
@@ -0,0 +1,195 @@
+"""
+Exportação do histórico de conversas de um chatbot, em CSV ou NDJSON.
+
+As mensagens são lidas com ``.iterator(chunk_size=...)`` (cursor no servidor
+no PostgreSQL) e escritas direto na resposta em blocos de ``BUFFER_BYTES``,
+opcionalmente comprimidos com gzip: a memória usada não depende do tamanho
+do histórico. Sob ASGI os blocos são gerados um a um na thread do banco (o
+Django leria um iterador síncrono inteiro para a memória antes de enviar).
+
+Cada linha traz o ``id`` da mensagem, em ordem crescente. Para retomar uma
+exportação interrompida, peça de novo com ``after=<último id recebido>``.
+"""
+import csv
+import zlib
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import codec
+from .models import Message
+
+DEFAULT_OPTIONS = {
+    # Linhas buscadas do banco por vez
+    'CHUNK_SIZE': 2000,
+    # Tamanho aproximado de cada bloco enviado ao cliente
+    'BUFFER_BYTES': 65536,
+}
+
+FIELDS = ('id', 'session_id', 'role', 'content', 'created_at')
+
+# formato -> (Content-Type, extensão)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+ExportParams = namedtuple('ExportParams', 'format since until after gzip')
+
+
+class ExportError(ValueError):
+    """Parâmetro de exportação inválido (a mensagem vai para o usuário)."""
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'EXPORT', {}))
+    return options
+
+
+def _parse_moment(value, name, end_of_day=False):
+    """Data (``2024-05-01``) ou data e hora ISO 8601; datas sem fuso usam o do projeto."""
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+        if day is not None:
+            # Uma data em "until" inclui o dia inteiro
+            moment = datetime.combine(day + timedelta(days=1) if end_of_day else day, time.min)
+        else:
+            moment = parse_datetime(value)
+            if moment is None:
+                raise ValueError
+    except ValueError:
+        raise ExportError(f'{name} deve ser uma data (AAAA-MM-DD) ou data e hora ISO 8601.') from None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_params(params):
+    """Valida os parâmetros (query string ou opções do comando)."""
+    export_format = params.get('format') or 'csv'
+    if export_format not in FORMATS:
+        raise ExportError(f"format deve ser um de: {', '.join(FORMATS)}.")
+    after = params.get('after') or None
+    if after is not None:
+        try:
+            after = int(after)
+        except (TypeError, ValueError):
+            raise ExportError('after deve ser o id (inteiro) da última mensagem recebida.') from None
+    since = _parse_moment(params.get('since'), 'since')
+    until = _parse_moment(params.get('until'), 'until', end_of_day=True)
+    if since and until and since >= until:
+        raise ExportError('since deve ser anterior a until.')
+    return ExportParams(
+        format=export_format,
+        since=since,
+        until=until,
+        after=after,
+        gzip=str(params.get('gzip', '')).lower() in ('1', 'true', 'yes'),
+    )
+
+
+def rows(chatbot, params):
+    """Tuplas ``FIELDS`` das mensagens, em ordem de id, sem carregar todas."""
+    queryset = Message.objects.filter(chatbot=chatbot)
+    if params.since:
+        queryset = queryset.filter(created_at__gte=params.since)
+    if params.until:
+        queryset = queryset.filter(created_at__lt=params.until)
+    if params.after is not None:
+        queryset = queryset.filter(id__gt=params.after)
+    return (
+        queryset.order_by('id')
+        .values_list('id', 'conversation__session_id', 'role', 'content', 'created_at')
+        .iterator(chunk_size=_options()['CHUNK_SIZE'])
+    )
+
+
+class _Echo:
+    """Arquivo falso: ``csv.writer.writerow`` devolve a linha formatada."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(records):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS).encode('utf-8')
+    for message_id, session_id, role, content, created_at in records:
+        yield writer.writerow((message_id, session_id, role, content, created_at.isoformat())).encode('utf-8')
+
+
+def _ndjson_lines(records):
+    for message_id, session_id, role, content, created_at in records:
+        yield codec.dumps({
+            'id': message_id,
+            'session_id': session_id,
+            'role': role,
+            'content': content,
+            'created_at': created_at.isoformat(),
+        }) + b'\n'
+
+
+def generate(chatbot, params):
+    """Blocos de bytes do arquivo exportado."""
+    lines = (_csv_lines if params.format == 'csv' else _ndjson_lines)(rows(chatbot, params))
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if params.gzip else None
+    limit = _options()['BUFFER_BYTES']
+    pending = []
+    size = 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size < limit:
+            continue
+        block = b''.join(pending)
+        pending, size = [], 0
+        if compressor is not None:
+            block = compressor.compress(block)
+            if not block:
+                continue
+        yield block
+    block = b''.join(pending)
+    if compressor is not None:
+        block = compressor.compress(block) + compressor.flush()
+    if block:
+        yield block
+
+
+async def _agenerate(blocks):
+    # Cada bloco é gerado na thread do banco, onde está o cursor
+    next_block = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            block = await next_block(blocks, None)
+            if block is None:
+                return
+            yield block
+    finally:
+        await sync_to_async(blocks.close, thread_sensitive=True)()
+
+
+def filename(chatbot, params):
+    name = f'conversas-{chatbot.pk}.{FORMATS[params.format][1]}'
+    return f'{name}.gz' if params.gzip else name
+
+
+def export_response(request, chatbot, params):
+    """``StreamingHttpResponse`` com o arquivo para download."""
+    blocks = generate(chatbot, params)
+    if hasattr(request, 'scope'):
+        blocks = _agenerate(blocks)
+    content_type = 'application/gzip' if params.gzip else FORMATS[params.format][0]
+    response = StreamingHttpResponse(blocks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename(chatbot, params)}"'
+    response['Cache-Control'] = 'no-store'
+    # Impede proxies reversos (nginx) de acumular a resposta
+    response['X-Accel-Buffering'] = 'no'
+    return response
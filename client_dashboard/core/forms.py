@@ -1,5 +1,5 @@
 from django import forms
-from .models import ChatbotConfig
+from .models import ChatbotConfig, WebhookEndpoint
 
 class ChatbotConfigForm(forms.ModelForm):
     class Meta:
@@ -10,4 +10,14 @@ class ChatbotConfigForm(forms.ModelForm):
             'webhook_url': forms.URLInput(attrs={'placeholder': 'https://sua-api.com/webhook'}),
             'primary_color': forms.TextInput(attrs={'type': 'color'}),
             'welcome_message': forms.TextInput(attrs={'placeholder': 'Olá! Como posso ajudar?'}),
-        }
\ No newline at end of file
+        }
+
+
+class WebhookEndpointForm(forms.ModelForm):
+    class Meta:
+        model = WebhookEndpoint
+        fields = ['url', 'weight']
+        widgets = {
+            'url': forms.URLInput(attrs={'class': 'form-control', 'placeholder': 'https://replica.sua-api.com/webhook'}),
+            'weight': forms.NumberInput(attrs={'class': 'form-control'}),
+        }
@@ -0,0 +1,187 @@
+"""
+Verificação de saúde dos webhooks em segundo plano.
+
+O comando ``run_health_checker`` sonda a cada ``INTERVAL`` segundos todos os
+``webhook_url`` configurados e os endpoints adicionais ativos (cada URL uma
+vez, mesmo se usada por vários chatbots), em paralelo com asyncio e no máximo
+``CONCURRENCY`` sondas ao mesmo tempo. A sonda é um POST ``{"type": "health_check"}`` com o header
+``X-Health-Check: 1``, para que o webhook possa responder sem processar uma
+mensagem; qualquer resposta abaixo de 500 conta como disponível.
+
+Os últimos ``WINDOW`` resultados de cada URL ficam no cache do Django e dão a
+disponibilidade e os percentis de latência gravados nos campos ``health_*`` do
+chatbot (ou do ``WebhookEndpoint``). O proxy usa esse perfil de duas formas:
+
+- o timeout de conexão de cada chamada cai para ``CONNECT_FACTOR`` vezes o
+  p99 das sondas (no mínimo ``MIN_CONNECT_TIMEOUT``), enquanto o perfil tiver
+  menos de ``STALE_AFTER`` segundos;
+- após ``DEAD_AFTER`` sondas seguidas sem resposta o circuito do webhook é
+  aberto (``circuit_breaker.trip``) antes que um visitante espere pelo
+  timeout; a primeira sonda respondida o fecha de novo.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from datetime import timedelta
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import circuit_breaker
+from .config_cache import invalidate_chatbot_config
+from .models import ChatbotConfig, WebhookEndpoint
+from .webhook_client import webhook_transport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    # Segundos entre duas rodadas de sondas
+    'INTERVAL': 30.0,
+    'CONCURRENCY': 20,
+    # Timeout de cada sonda
+    'TIMEOUT': 5.0,
+    # Sondas consideradas nos percentis e na disponibilidade
+    'WINDOW': 60,
+    # Sondas seguidas sem resposta que abrem o circuito
+    'DEAD_AFTER': 3,
+    'CONNECT_FACTOR': 3.0,
+    'MIN_CONNECT_TIMEOUT': 1.0,
+    # Perfil mais antigo que isso não é usado pelo proxy
+    'STALE_AFTER': 600,
+}
+
+HEADER = 'X-Health-Check'
+PROBE_PAYLOAD = {'type': 'health_check', 'health_check': True}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'WEBHOOK_HEALTH', {}))
+    return options
+
+
+def _samples_key(webhook_url):
+    return f"health:{hashlib.sha1(webhook_url.encode('utf-8')).hexdigest()}"
+
+
+def percentile(values, pct):
+    """Percentil pelo método nearest-rank (``values`` ordenados)."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def profile(samples):
+    """Campos ``health_*`` a partir das sondas (latência em ms, ``None`` = falha)."""
+    latencies = sorted(sample for sample in samples if sample is not None)
+    failing = 0
+    for sample in reversed(samples):
+        if sample is not None:
+            break
+        failing += 1
+
+    def rounded(value):
+        return None if value is None else round(value)
+
+    return {
+        'health_availability': len(latencies) / len(samples) if samples else None,
+        'health_latency_p50_ms': rounded(percentile(latencies, 50)),
+        'health_latency_p95_ms': rounded(percentile(latencies, 95)),
+        'health_latency_p99_ms': rounded(percentile(latencies, 99)),
+        'health_failing': failing >= _options()['DEAD_AFTER'],
+    }
+
+
+def connect_timeout(config):
+    """Timeout de conexão derivado do perfil do webhook; ``None`` sem perfil recente."""
+    if config.health_latency_p99_ms is None or config.health_checked_at is None:
+        return None
+    options = _options()
+    if timezone.now() - config.health_checked_at > timedelta(seconds=options['STALE_AFTER']):
+        return None
+    return max(options['MIN_CONNECT_TIMEOUT'], config.health_latency_p99_ms / 1000 * options['CONNECT_FACTOR'])
+
+
+async def probe(webhook_url, timeout):
+    """Latência (ms) da resposta à sonda, ou ``None`` se o webhook não respondeu."""
+    started = time.perf_counter()
+    try:
+        response = await webhook_transport.apost(
+            webhook_url, json=PROBE_PAYLOAD, headers={HEADER: '1'}, timeout=timeout
+        )
+    except httpx.HTTPError:
+        return None
+    if response.status_code >= 500:
+        return None
+    return (time.perf_counter() - started) * 1000
+
+
+def record_probe(webhook_url, latency_ms):
+    """Guarda o resultado da sonda e atualiza os chatbots e o circuito da URL."""
+    options = _options()
+    key = _samples_key(webhook_url)
+    samples = [*cache.get(key, []), latency_ms][-options['WINDOW']:]
+    cache.set(key, samples, int(options['WINDOW'] * options['INTERVAL'] * 2))
+
+    fields = profile(samples)
+    checked_at = timezone.now()
+    chatbots = ChatbotConfig.objects.filter(webhook_url=webhook_url)
+    endpoints = WebhookEndpoint.objects.filter(url=webhook_url)
+    # .update() não altera updated_at: o embed e o cache de respostas continuam válidos
+    chatbot_ids = {*chatbots.values_list('pk', flat=True), *endpoints.values_list('chatbot_id', flat=True)}
+    chatbots.update(health_checked_at=checked_at, **fields)
+    endpoints.update(health_checked_at=checked_at, **fields)
+    for chatbot_id in chatbot_ids:
+        # A cada sonda: prender as leituras no primário anularia as réplicas
+        invalidate_chatbot_config(chatbot_id, written=False)
+
+    if fields['health_failing']:
+        circuit_breaker.trip(webhook_url)
+    elif latency_ms is not None:
+        circuit_breaker.release(webhook_url)
+    return fields
+
+
+def webhook_urls():
+    """URLs a sondar: os webhooks principais e os endpoints adicionais ativos."""
+    primary = ChatbotConfig.objects.exclude(webhook_url='').values_list('webhook_url', flat=True).order_by()
+    extra = WebhookEndpoint.objects.filter(enabled=True).values_list('url', flat=True).order_by()
+    return list(dict.fromkeys([*primary.distinct(), *extra.distinct()]))
+
+
+async def check_all():
+    """Uma rodada de sondas; retorna ``{webhook_url: latência em ms ou None}``."""
+    options = _options()
+    semaphore = asyncio.Semaphore(options['CONCURRENCY'])
+    results = {}
+
+    async def check(webhook_url):
+        async with semaphore:
+            results[webhook_url] = await probe(webhook_url, options['TIMEOUT'])
+        await sync_to_async(record_probe)(webhook_url, results[webhook_url])
+
+    await asyncio.gather(*(check(url) for url in await sync_to_async(webhook_urls)()))
+    return results
+
+
+async def serve(stop):
+    """Rodadas de sondas até ``stop`` (``threading.Event``) ser acionado."""
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            results = await check_all()
+            down = sum(1 for latency in results.values() if latency is None)
+            logger.info('Sondas de webhooks concluídas', extra={'webhooks': len(results), 'down': down})
+        except Exception:
+            logger.exception('Falha na rodada de sondas dos webhooks.')
+        finally:
+            await sync_to_async(close_old_connections)()
+        delay = max(0.0, _options()['INTERVAL'] - (time.monotonic() - started))
+        await asyncio.to_thread(stop.wait, delay)
+    await webhook_transport.aclose()
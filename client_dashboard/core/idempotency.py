@@ -0,0 +1,262 @@
+"""
+Mensagens reenviadas ao ``/api/v1/chat/`` com a mesma chave de idempotência.
+
+O widget envia um id por mensagem, no header ``Idempotency-Key`` (ou em
+``client_message_id`` no corpo), e o reaproveita ao reenviar a mesma
+mensagem. Só a primeira requisição com a chave chama o webhook:
+
+- as repetidas que chegam enquanto ela está em andamento, em qualquer worker,
+  esperam e recebem a mesma resposta. Nas views síncronas a espera prende um
+  worker: passando de ``SYNC_MAX_WAIT`` segundos, a repetida recebe 409 com
+  ``Retry-After`` e o cliente tenta de novo;
+- as que chegam depois recebem a resposta guardada no cache compartilhado por
+  ``TTL`` segundos, com o header ``Idempotent-Replayed: true``.
+
+A chave vale para o chatbot, a sessão e o texto da mensagem: reutilizá-la com
+outra mensagem gera uma chamada nova. Só respostas 200 e 202 (fila) são
+guardadas. Se a primeira falhar, a próxima repetida faz a própria chamada.
+Respostas em streaming são guardadas quando o stream termina com
+``{"type": "done"}`` e repetidas como NDJSON.
+
+No WebSocket a chave vem em ``client_message_id`` no frame da mensagem. A
+resposta é guardada como o JSON do ``/api/v1/chat/``: o widget que cai para
+o POST com a mesma chave recebe a resposta já dada pelo WebSocket.
+"""
+import asyncio
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from . import codec
+
+DEFAULT_OPTIONS = {
+    # Segundos em que a resposta fica disponível para as repetidas
+    'TTL': 300,
+    # Intervalo com que uma repetida confere se a original terminou
+    'POLL_INTERVAL': 0.05,
+    # Espera máxima de uma repetida nas views síncronas, antes do 409
+    'SYNC_MAX_WAIT': 3.0,
+    'MAX_KEY_LENGTH': 255,
+}
+
+HEADER = 'Idempotency-Key'
+BODY_FIELD = 'client_message_id'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+STORED_STATUSES = (200, 202)
+
+# Valor da chave enquanto a primeira requisição está em andamento
+_PENDING = 'pending'
+# Folga sobre o prazo do webhook antes de uma repetida desistir de esperar
+_GRACE = 5
+
+IN_PROGRESS_BODY = {
+    'error': 'Mensagem ainda em processamento',
+    'reply': 'Sua mensagem ainda está sendo respondida. Aguarde um instante.',
+}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'IDEMPOTENCY', {}))
+    return options
+
+
+def client_key(request, data):
+    """Chave enviada pelo cliente, no header ou no corpo; ``None`` se ausente/inválida."""
+    return _clean_key(request.headers.get(HEADER) or data.get(BODY_FIELD))
+
+
+def _clean_key(value):
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if not value or len(value) > _options()['MAX_KEY_LENGTH']:
+        return None
+    return value
+
+
+def cache_key(config, session_id, key, message):
+    digest = hashlib.sha256('\x00'.join([session_id or '', key, str(message)]).encode('utf-8')).hexdigest()
+    return f'idempotency:{config.pk}:{digest}'
+
+
+class Submission:
+    """
+    Uma mensagem com chave de idempotência; inerte se a requisição não tem chave.
+
+    Quem obtém ``None`` de ``fetch``/``afetch`` deve responder normalmente e
+    passar a resposta a ``bind``/``abind`` (ou chamar ``release`` se não houver
+    resposta), liberando as repetidas que aguardam.
+    """
+
+    __slots__ = ('key', 'wait', 'claimed')
+
+    def __init__(self, key=None, wait=0):
+        self.key = key
+        self.wait = wait
+        self.claimed = False
+
+    @property
+    def enabled(self):
+        return self.key is not None
+
+    def _claim_timeout(self):
+        return self.wait + _GRACE
+
+    def fetch(self):
+        """
+        Resposta da primeira requisição com a chave, ou ``None`` se esta é a primeira.
+
+        Se a primeira não terminar em ``SYNC_MAX_WAIT`` segundos, retorna um
+        409 com ``Retry-After`` em vez de continuar prendendo o worker.
+        """
+        if not self.enabled:
+            return None
+        options = _options()
+        deadline = time.monotonic() + min(self._claim_timeout(), options['SYNC_MAX_WAIT'])
+        while True:
+            entry = cache.get(self.key)
+            if entry is None:
+                if cache.add(self.key, _PENDING, self._claim_timeout()):
+                    self.claimed = True
+                    return None
+                continue
+            if entry != _PENDING:
+                return replay_response(entry)
+            if time.monotonic() >= deadline:
+                return in_progress_response(options['SYNC_MAX_WAIT'])
+            time.sleep(options['POLL_INTERVAL'])
+
+    async def afetch(self):
+        """Versão assíncrona de ``fetch``."""
+        if not self.enabled:
+            return None
+        options = _options()
+        deadline = time.monotonic() + self._claim_timeout()
+        while True:
+            entry = await cache.aget(self.key)
+            if entry is None:
+                if await cache.aadd(self.key, _PENDING, self._claim_timeout()):
+                    self.claimed = True
+                    return None
+                continue
+            if entry != _PENDING:
+                return replay_response(entry)
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(options['POLL_INTERVAL'])
+
+    def store(self, status, content, content_type):
+        if self.claimed:
+            self.claimed = False
+            cache.set(self.key, (status, bytes(content), content_type), _options()['TTL'])
+
+    async def astore(self, status, content, content_type):
+        if self.claimed:
+            self.claimed = False
+            await cache.aset(self.key, (status, bytes(content), content_type), _options()['TTL'])
+
+    def release(self):
+        """Desiste da chave sem resposta guardada: a próxima repetida chama o webhook."""
+        if self.claimed:
+            self.claimed = False
+            cache.delete(self.key)
+
+    async def arelease(self):
+        if self.claimed:
+            self.claimed = False
+            await cache.adelete(self.key)
+
+    def bind(self, response):
+        """Guarda ``response`` para as repetidas (em streaming, ao fim do stream)."""
+        if not self.claimed:
+            return response
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self._astore_after(response, response.streaming_content)
+            else:
+                response.streaming_content = self._store_after(response, response.streaming_content)
+        elif response.status_code in STORED_STATUSES:
+            self.store(response.status_code, response.content, response['Content-Type'])
+        else:
+            self.release()
+        return response
+
+    async def abind(self, response):
+        """Versão assíncrona de ``bind``."""
+        if self.claimed and not response.streaming:
+            if response.status_code in STORED_STATUSES:
+                await self.astore(response.status_code, response.content, response['Content-Type'])
+            else:
+                await self.arelease()
+            return response
+        return self.bind(response)
+
+    def _store_after(self, response, content):
+        chunks = []
+        try:
+            for chunk in content:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            if response.status_code in STORED_STATUSES and _completed(chunks):
+                self.store(response.status_code, b''.join(chunks), response['Content-Type'])
+            else:
+                self.release()
+
+    async def _astore_after(self, response, content):
+        chunks = []
+        try:
+            async for chunk in content:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            if response.status_code in STORED_STATUSES and _completed(chunks):
+                await self.astore(response.status_code, b''.join(chunks), response['Content-Type'])
+            else:
+                await self.arelease()
+
+
+def _completed(chunks):
+    """``True`` se o stream NDJSON terminou com o evento ``done``."""
+    if not chunks:
+        return False
+    try:
+        event = codec.loads(chunks[-1])
+    except codec.DecodeError:
+        return False
+    return isinstance(event, dict) and event.get('type') == 'done'
+
+
+def submission(config, request, data, session_id):
+    """``Submission`` da mensagem de ``/api/v1/chat/``."""
+    return _submission(config, client_key(request, data), data, session_id)
+
+
+def frame_submission(config, data, session_id):
+    """``Submission`` de um frame de mensagem do WebSocket."""
+    return _submission(config, _clean_key(data.get(BODY_FIELD)), data, session_id)
+
+
+def _submission(config, key, data, session_id):
+    if key is None:
+        return Submission()
+    return Submission(cache_key(config, session_id, key, data['message']), config.webhook_timeout)
+
+
+def in_progress_response(retry_after):
+    """409 para a repetida que desistiu de esperar a primeira requisição."""
+    response = JsonResponse(IN_PROGRESS_BODY, status=409)
+    response['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def replay_response(entry):
+    status, content, content_type = entry
+    response = HttpResponse(content, status=status, content_type=content_type)
+    response[REPLAYED_HEADER] = 'true'
+    return response
@@ -0,0 +1,118 @@
+"""
+Gravação das alterações feitas em tempo real no dashboard (cor, mensagem de
+boas-vindas e webhook).
+
+O dashboard acumula as edições no navegador e só as envia depois de
+``DEBOUNCE_MS`` sem novas mudanças (ou ``MAX_WAIT_MS`` após a primeira), num
+único ``PATCH /chatbots/<id>/settings/`` com todos os campos alterados e a
+versão do chatbot que o navegador conhece::
+
+    {"version": 3, "changes": {"primary_color": "#112233", "welcome_message": "Oi!"}}
+
+A gravação é um único UPDATE condicionado a ``settings_version``. Se outra
+aba, o formulário completo ou o admin salvaram o chatbot nesse meio-tempo, a
+resposta é 409 com a versão e os valores atuais, e nada é sobrescrito.
+"""
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.utils import timezone
+
+from . import codec
+from .config_cache import invalidate_chatbot_config
+from .embed_cache import invalidate_embed
+from .models import ChatbotConfig
+
+DEFAULT_OPTIONS = {
+    # Espera sem novas edições antes de gravar
+    'DEBOUNCE_MS': 800,
+    # Espera máxima desde a primeira edição não gravada
+    'MAX_WAIT_MS': 5000,
+}
+
+# Campos que o dashboard grava em tempo real
+FIELDS = ('primary_color', 'welcome_message', 'webhook_url')
+
+_COLOR = re.compile(r'^#[0-9A-Fa-f]{6}$')
+
+
+class SettingsError(ValueError):
+    """Alteração inválida (a mensagem vai para o usuário)."""
+
+
+class StaleVersion(Exception):
+    """O chatbot mudou desde a versão enviada; ``current`` traz o estado atual."""
+
+    def __init__(self, current):
+        super().__init__('Versão desatualizada')
+        self.current = current
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'LIVE_SETTINGS', {}))
+    return options
+
+
+def client_options():
+    """Intervalos usados pelo JavaScript do dashboard."""
+    options = _options()
+    return {'debounce_ms': options['DEBOUNCE_MS'], 'max_wait_ms': options['MAX_WAIT_MS']}
+
+
+def _clean(field, value):
+    if not isinstance(value, str):
+        raise SettingsError(f'{field} deve ser um texto.')
+    value = value.strip()
+    if field == 'primary_color' and not _COLOR.match(value):
+        raise SettingsError('primary_color deve estar no formato #RRGGBB.')
+    try:
+        return ChatbotConfig._meta.get_field(field).clean(value, None)
+    except ValidationError as e:
+        raise SettingsError(f"{field}: {' '.join(e.messages)}") from None
+
+
+def parse(body):
+    """Valida o corpo do PATCH; retorna ``(versão, {campo: valor})``."""
+    try:
+        data = codec.loads(body)
+    except codec.DecodeError:
+        raise SettingsError('JSON inválido.') from None
+    if not isinstance(data, dict):
+        raise SettingsError('O corpo deve ser um objeto JSON.')
+    version = data.get('version')
+    if not isinstance(version, int) or isinstance(version, bool) or version < 0:
+        raise SettingsError('version deve ser a versão (inteiro) recebida do dashboard.')
+    changes = data.get('changes')
+    if not isinstance(changes, dict) or not changes:
+        raise SettingsError('changes deve ter ao menos um campo.')
+    unknown = set(changes) - set(FIELDS)
+    if unknown:
+        raise SettingsError(f"Campos não editáveis: {', '.join(sorted(unknown))}.")
+    return version, {field: _clean(field, value) for field, value in changes.items()}
+
+
+def apply(chatbot_id, user, version, changes):
+    """
+    Grava ``changes`` se o chatbot ainda estiver em ``version``.
+
+    Retorna a nova versão; levanta ``StaleVersion`` se ele mudou e
+    ``ChatbotConfig.DoesNotExist`` se não for do usuário.
+    """
+    chatbots = ChatbotConfig.objects.filter(pk=chatbot_id, user=user)
+    updated = chatbots.filter(settings_version=version).update(
+        **changes,
+        settings_version=F('settings_version') + 1,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        current = chatbots.values('settings_version', *FIELDS).first()
+        if current is None:
+            raise ChatbotConfig.DoesNotExist
+        raise StaleVersion(current)
+    # .update() não dispara os sinais de core.signals
+    invalidate_chatbot_config(chatbot_id)
+    invalidate_embed(chatbot_id)
+    return version + 1
@@ -0,0 +1,29 @@
+"""
+Formatação dos logs da aplicação em JSON (uma linha por evento).
+
+Os campos passados em ``extra`` viram chaves do JSON, o que facilita filtrar
+os logs no Railway::
+
+    logger.info('Webhook respondeu', extra={'chatbot_id': config.pk, 'status': 200})
+"""
+import json
+import logging
+
+# Atributos que todo LogRecord tem; o que sobrar veio de ``extra``
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                event[key] = value
+        if record.exc_info:
+            event['exception'] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
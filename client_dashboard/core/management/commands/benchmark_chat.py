@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from core import conversation_log
+from core.benchmark import ENDPOINTS, StubWebhookServer, run_benchmark, run_pipeline_benchmark
+from core.models import ChatbotConfig
+
+BENCHMARK_USERNAME = 'benchmark-chat'
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede vazão, latência (p50/p95/p99) e queries por requisição dos endpoints '
+        'de chat contra um webhook local simulado.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=[*ENDPOINTS, 'all'], default='all')
+        parser.add_argument('--requests', type=int, default=1000, help='Requisições medidas por endpoint.')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--warmup', type=int, default=5, help='Requisições de aquecimento por thread.')
+        parser.add_argument('--chatbots', type=int, default=10, help='Quantidade de chatbots criados para o teste.')
+        parser.add_argument('--latency', type=float, default=50.0, help='Latência do webhook simulado (ms).')
+        parser.add_argument('--jitter', type=float, default=0.0, help='Variação aleatória somada à latência (ms).')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fração de respostas 500 do webhook.')
+        parser.add_argument('--stream', action='store_true', help='Webhook responde em SSE e o cliente pede streaming.')
+        parser.add_argument('--token-delay', type=float, default=0.0, help='Intervalo entre tokens do stream (ms).')
+        parser.add_argument(
+            '--url',
+            help='Servidor já rodando (ex.: http://127.0.0.1:8000). Sem ele, as views são chamadas no próprio processo.',
+        )
+        parser.add_argument('--keep', action='store_true', help='Com --url, não apaga os chatbots de teste ao final.')
+        parser.add_argument(
+            '--pipeline',
+            action='store_true',
+            help='Mede só a CPU por mensagem do parse do pedido e da resposta do webhook (sem rede nem banco).',
+        )
+        parser.add_argument('--iterations', type=int, default=20000, help='Mensagens por variante em --pipeline.')
+
+    def handle(self, *args, **options):
+        if options['pipeline']:
+            if options['iterations'] < 1:
+                raise CommandError('--iterations deve ser maior que zero.')
+            self._report_pipeline(run_pipeline_benchmark(options['iterations']))
+            return
+
+        if options['requests'] < 1 or options['concurrency'] < 1 or options['chatbots'] < 1:
+            raise CommandError('--requests, --concurrency e --chatbots devem ser maiores que zero.')
+        if not 0 <= options['error_rate'] <= 1:
+            raise CommandError('--error-rate deve estar entre 0 e 1.')
+
+        endpoints = list(ENDPOINTS) if options['endpoint'] == 'all' else [options['endpoint']]
+        stub = StubWebhookServer(
+            latency=options['latency'] / 1000,
+            jitter=options['jitter'] / 1000,
+            error_rate=options['error_rate'],
+            stream=options['stream'],
+            token_delay=options['token_delay'] / 1000,
+        )
+        with stub, self._database(options['url']):
+            user, chatbot_ids = self._seed(options['chatbots'], stub.url)
+            try:
+                for endpoint in endpoints:
+                    result = run_benchmark(
+                        endpoint,
+                        chatbot_ids,
+                        requests=options['requests'],
+                        concurrency=options['concurrency'],
+                        stream=options['stream'],
+                        base_url=options['url'],
+                        warmup=options['warmup'],
+                    )
+                    self._report(result)
+            finally:
+                if not options['keep']:
+                    conversation_log.flush()
+                    user.delete()
+
+    @contextmanager
+    def _database(self, base_url):
+        """
+        Sem ``--url``, roda num banco de teste descartável, como o ``manage.py test``.
+
+        Com ``--url`` os chatbots precisam estar no banco do servidor medido.
+        """
+        if base_url:
+            yield
+            return
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            yield
+        finally:
+            conversation_log.flush()
+            teardown_databases(old_config, verbosity=0)
+
+    def _seed(self, count, webhook_url):
+        user, _ = User.objects.get_or_create(username=BENCHMARK_USERNAME)
+        user.chatbots.all().delete()
+        # Sem limites de taxa: o benchmark mede o proxy, não o rate limit
+        chatbots = ChatbotConfig.objects.bulk_create([
+            ChatbotConfig(
+                user=user,
+                name=f'Benchmark {index + 1}',
+                webhook_url=webhook_url,
+                rate_limit_per_minute=0,
+                rate_limit_per_ip_per_minute=0,
+                max_concurrent_requests=0,
+            )
+            for index in range(count)
+        ])
+        return user, [chatbot.pk for chatbot in chatbots]
+
+    def _report(self, result):
+        data = result.as_dict()
+        latency = data['latency_ms']
+        queries = data['queries_per_request']
+        statuses = ', '.join(f'{status}: {count}' for status, count in data['statuses'].items())
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{ENDPOINTS[result.endpoint]} ({result.endpoint})"))
+        self.stdout.write(f"  requisições:   {data['requests']} (concorrência {data['concurrency']}, {data['elapsed']}s)")
+        self.stdout.write(f"  vazão:         {data['throughput']} req/s")
+        self.stdout.write(
+            f"  latência (ms): p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  máx {latency['max']}"
+        )
+        self.stdout.write(f"  queries/req:   {'n/d' if queries is None else queries}")
+        self.stdout.write(f"  status HTTP:   {statuses}")
+
+    def _report_pipeline(self, results):
+        for name, variants in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'Webhook respondendo com "{name}"'))
+            baseline = variants['anterior']
+            for variant, micros in variants.items():
+                change = '' if variant == 'anterior' else f'  ({(micros / baseline - 1) * 100:+.0f}% de CPU)'
+                self.stdout.write(f'  {variant:<20} {micros:8.1f} µs/mensagem{change}')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import usage
+
+
+class Command(BaseCommand):
+    help = (
+        'Apaga os buckets de uso agregado além da retenção de cada granularidade '
+        '(minuto, hora, dia). Rode periodicamente, por exemplo uma vez por dia.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Linhas apagadas por comando DELETE.')
+        parser.add_argument('--dry-run', action='store_true', help='Só conta as linhas que seriam apagadas.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size deve ser maior que zero.')
+        deleted = usage.compact(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        verb = 'seriam apagados' if options['dry_run'] else 'apagados'
+        for period, count in deleted.items():
+            self.stdout.write(f'{period}: {count} buckets {verb}')
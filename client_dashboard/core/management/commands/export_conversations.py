@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import export
+from core.models import ChatbotConfig
+
+
+class Command(BaseCommand):
+    help = 'Exporta o histórico de conversas de um chatbot em CSV ou NDJSON, sem carregá-lo na memória.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('chatbot_id')
+        parser.add_argument('--format', choices=list(export.FORMATS), default='csv')
+        parser.add_argument('--since', help='Data (AAAA-MM-DD) ou data e hora ISO 8601 inicial.')
+        parser.add_argument('--until', help='Data (inclusive) ou data e hora final.')
+        parser.add_argument('--after', help='Retoma a partir do id da última mensagem já exportada.')
+        parser.add_argument('--gzip', action='store_true', help='Comprime a saída com gzip.')
+        parser.add_argument('--output', '-o', default='-', help='Arquivo de saída (padrão: saída padrão).')
+
+    def handle(self, *args, **options):
+        try:
+            chatbot = ChatbotConfig.objects.get(pk=options['chatbot_id'])
+        except (ChatbotConfig.DoesNotExist, ValueError):
+            raise CommandError(f"Chatbot {options['chatbot_id']} não encontrado.") from None
+        try:
+            params = export.parse_params({
+                'format': options['format'],
+                'since': options['since'],
+                'until': options['until'],
+                'after': options['after'],
+                'gzip': options['gzip'],
+            })
+        except export.ExportError as exc:
+            raise CommandError(str(exc)) from None
+
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            written = 0
+            for block in export.generate(chatbot, params):
+                output.write(block)
+                written += len(block)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        if options['output'] != '-':
+            self.stdout.write(f"{written} bytes gravados em {options['output']}")
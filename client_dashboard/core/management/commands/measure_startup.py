@@ -0,0 +1,67 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Roda num interpretador novo: carrega a aplicação ASGI e responde a um GET
+CHILD_SCRIPT = '''
+import asyncio, json, sys
+from core import startup
+from client_dashboard.asgi import application
+ready = startup.elapsed_ms()
+status = asyncio.run(startup.first_request(application, sys.argv[1]))
+print(json.dumps({"phases": startup.phases(), "ready_ms": ready, "first_response_ms": startup.elapsed_ms(), "status": status}))
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede, em processos novos, o tempo de inicialização da aplicação web e até '
+        'a primeira resposta, com e sem o aquecimento de core.startup.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Processos medidos em cada modo.')
+        parser.add_argument('--path', default='/', help='Caminho da primeira requisição.')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs deve ser maior que zero.')
+        self.stdout.write(f"{'Aquecimento':<12} {'pronto':>10} {'1ª requisição':>15} {'até 1ª resposta':>17} {'processo':>10}")
+        for warmup in (False, True):
+            results = [self._run(options['path'], warmup) for _ in range(options['runs'])]
+
+            def median(key):
+                return statistics.median(result[key] for result in results)
+
+            first_request = statistics.median(result['first_response_ms'] - result['ready_ms'] for result in results)
+            self.stdout.write(
+                f"{'ligado' if warmup else 'desligado':<12} {median('ready_ms'):>7.0f} ms {first_request:>12.0f} ms "
+                f"{median('first_response_ms'):>14.0f} ms {median('process_ms'):>7.0f} ms"
+            )
+        phases = {name: statistics.median(result['phases'][name] for result in results) for name in results[0]['phases']}
+        self.stdout.write('Etapas (mediana, com aquecimento): ' + ', '.join(f'{name} {ms:.0f} ms' for name, ms in phases.items()))
+
+    def _run(self, path, warmup):
+        env = {**os.environ, 'STARTUP_WARMUP': str(warmup), 'CHAT_LOG_ENABLED': 'False'}
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT, path],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        process_ms = (time.perf_counter() - started) * 1000
+        if completed.returncode != 0:
+            raise CommandError(f'Falha ao iniciar a aplicação:\n{completed.stderr}')
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        if result['status'] >= 500:
+            raise CommandError(f"{path} respondeu {result['status']}.")
+        result['process_ms'] = process_ms
+        return result
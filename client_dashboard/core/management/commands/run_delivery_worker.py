@@ -0,0 +1,54 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import delivery_queue
+
+
+def _serve(threads):
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    delivery_queue.run_worker(stop, threads=threads)
+
+
+class Command(BaseCommand):
+    help = 'Entrega ao webhook as mensagens dos chatbots em modo fila (backend "database").'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='Processos de entrega.')
+        parser.add_argument('--threads', type=int, default=4, help='Entregas simultâneas por processo.')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1 or options['threads'] < 1:
+            raise CommandError('--processes e --threads devem ser maiores que zero.')
+
+        self.stdout.write(
+            f"Worker de entregas: {options['processes']} processo(s) x {options['threads']} thread(s)"
+        )
+        if options['processes'] == 1:
+            _serve(options['threads'])
+            return
+
+        # Conexões abertas no pai não podem ser herdadas pelos filhos
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        children = [
+            context.Process(target=_serve, args=(options['threads'],), name=f'delivery-worker-{index}')
+            for index in range(options['processes'])
+        ]
+        for child in children:
+            child.start()
+
+        def forward(signum, frame):
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+        for child in children:
+            child.join()
@@ -0,0 +1,37 @@
+import asyncio
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from core import health
+
+
+class Command(BaseCommand):
+    help = (
+        'Sonda periodicamente os webhooks configurados e grava disponibilidade e '
+        'percentis de latência nos chatbots (usados pelo proxy).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Faz uma única rodada de sondas e sai.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            results = asyncio.run(self._once())
+            for url, latency in sorted(results.items()):
+                status = 'sem resposta' if latency is None else f'{latency:.0f} ms'
+                self.stdout.write(f'{url}: {status}')
+            return
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        signal.signal(signal.SIGINT, lambda *args: stop.set())
+        self.stdout.write('Verificação de saúde dos webhooks iniciada.')
+        asyncio.run(health.serve(stop))
+
+    async def _once(self):
+        try:
+            return await health.check_all()
+        finally:
+            await health.webhook_transport.aclose()
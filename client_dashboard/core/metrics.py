@@ -0,0 +1,362 @@
+"""
+Métricas de desempenho por requisição, expostas em ``/metrics`` (Prometheus).
+
+O ``MetricsMiddleware`` mede cada requisição e acumula, no processo:
+
+- latência por view (histograma) e contagem por view/método/status;
+- queries ao banco e o tempo gasto nelas, por view;
+- tempo de espera pelo webhook do cliente, separado do overhead do proxy;
+- status das respostas de chat por chatbot.
+
+Cada worker do gunicorn publica a cada ``FLUSH_INTERVAL`` segundos seu
+snapshot cumulativo no cache do Django (Redis em produção), numa chave por
+processo. A view ``/metrics`` soma os snapshots de todos os workers vivos;
+um worker que para de publicar some após ``WORKER_TTL`` segundos (para o
+Prometheus isso aparece como um reset de contador, que ``rate()`` já trata).
+Sem Redis o cache é local e ``/metrics`` mostra só o worker que respondeu.
+
+As respostas de chat também alimentam o uso por chatbot do dashboard
+(``core.usage``), que continua ativo com ``METRICS['ENABLED']`` desligado.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from . import usage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'ENABLED': True,
+    # Intervalo (segundos) de publicação do snapshot do worker no cache
+    'FLUSH_INTERVAL': 10,
+    # Tempo até o snapshot de um worker que parou de publicar ser descartado
+    'WORKER_TTL': 300,
+    # /metrics exige "Authorization: Bearer <TOKEN>"; sem token, fica desligado
+    'TOKEN': '',
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+WORKERS_KEY = 'metrics:workers'
+
+# Nome -> (tipo, descrição)
+METRICS = {
+    'chat_http_requests_total': ('counter', 'Requisições HTTP por view, método e status.'),
+    'chat_http_request_duration_seconds': ('histogram', 'Latência das requisições por view (até o início da resposta).'),
+    'chat_db_queries_total': ('counter', 'Queries executadas no banco por view.'),
+    'chat_db_query_duration_seconds_total': ('counter', 'Tempo gasto em queries no banco por view.'),
+    'chat_webhook_duration_seconds': ('histogram', 'Tempo esperando o webhook do cliente por requisição.'),
+    'chat_proxy_overhead_seconds': ('histogram', 'Latência da requisição descontada a espera pelo webhook.'),
+    'chat_chatbot_responses_total': ('counter', 'Respostas dos endpoints de chat por chatbot e status.'),
+}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'METRICS', {}))
+    return options
+
+
+class _RequestStats:
+    __slots__ = ('queries', 'query_time', 'upstream', 'chatbot_id')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.upstream = 0.0
+        self.chatbot_id = None
+
+
+_current = ContextVar('metrics_request_stats', default=None)
+
+
+class MetricsRegistry:
+    """Contadores e histogramas do processo; seguro entre threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._publisher = None
+        self._pid = os.getpid()
+        self._registered = False
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {key: [list(buckets), total, count] for key, (buckets, total, count) in self._histograms.items()},
+            }
+
+    def reset_after_fork(self):
+        """O processo filho começa do zero e publica com o próprio pid."""
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._publisher = None
+        self._pid = os.getpid()
+        self._registered = False
+
+    def worker_key(self):
+        return f'metrics:worker:{socket.gethostname()}:{self._pid}'
+
+    def publish(self):
+        """Grava o snapshot deste worker no cache compartilhado."""
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+        key = self.worker_key()
+        cache.set(key, self.snapshot(), _options()['WORKER_TTL'])
+        if not self._registered:
+            _update_workers(lambda workers: workers if key in workers else [*workers, key])
+            self._registered = True
+
+    def ensure_publisher(self):
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+        if self._publisher is not None and self._publisher.is_alive():
+            return
+        with self._lock:
+            if self._publisher is None or not self._publisher.is_alive():
+                self._publisher = threading.Thread(target=self._run, name='metrics-publisher', daemon=True)
+                self._publisher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(_options()['FLUSH_INTERVAL'])
+            try:
+                self.publish()
+            except Exception:
+                logger.exception('Falha ao publicar as métricas do worker.')
+
+
+def _update_workers(change):
+    """Altera a lista de workers sob um lock curto no cache."""
+    for _ in range(50):
+        if cache.add(f'{WORKERS_KEY}:lock', 1, 5):
+            try:
+                workers = cache.get(WORKERS_KEY, [])
+                cache.set(WORKERS_KEY, change(workers), None)
+            finally:
+                cache.delete(f'{WORKERS_KEY}:lock')
+            return
+        time.sleep(0.01)
+    logger.warning('Não foi possível atualizar a lista de workers das métricas.')
+
+
+registry = MetricsRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.reset_after_fork)
+
+
+# --- Instrumentação -------------------------------------------------------
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+def _install_query_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_install_query_counter, dispatch_uid='core.metrics.query_counter')
+
+
+def record_upstream(elapsed):
+    """Soma ``elapsed`` segundos de espera pelo webhook à requisição atual."""
+    stats = _current.get()
+    if stats is not None:
+        stats.upstream += elapsed
+
+
+def tag_chatbot(chatbot_id):
+    """Associa a requisição atual a um chatbot (para o status por chatbot)."""
+    stats = _current.get()
+    if stats is not None:
+        stats.chatbot_id = str(chatbot_id)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+def _record(request, response, stats, elapsed, metrics_enabled=True):
+    if stats.chatbot_id:
+        usage.record(stats.chatbot_id, response.status_code, elapsed)
+    if not metrics_enabled:
+        return
+    view = _view_name(request)
+    status = str(response.status_code)
+    registry.inc('chat_http_requests_total', {'view': view, 'method': request.method, 'status': status})
+    registry.observe('chat_http_request_duration_seconds', {'view': view}, elapsed)
+    if stats.queries:
+        registry.inc('chat_db_queries_total', {'view': view}, stats.queries)
+        registry.inc('chat_db_query_duration_seconds_total', {'view': view}, stats.query_time)
+    if stats.upstream:
+        registry.observe('chat_webhook_duration_seconds', {'view': view}, stats.upstream)
+        registry.observe('chat_proxy_overhead_seconds', {'view': view}, max(0.0, elapsed - stats.upstream))
+    if stats.chatbot_id:
+        registry.inc('chat_chatbot_responses_total', {'chatbot_id': stats.chatbot_id, 'status': status})
+    registry.ensure_publisher()
+
+
+class MetricsMiddleware:
+    """
+    Mede cada requisição. Em respostas em streaming a latência vai até o
+    início da resposta (o restante do stream não entra na medição).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.metrics_enabled = _options()['ENABLED']
+        self.enabled = self.metrics_enabled or usage.is_enabled()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        stats = _RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        _record(request, response, stats, time.perf_counter() - started, self.metrics_enabled)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        stats = _RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        _record(request, response, stats, time.perf_counter() - started, self.metrics_enabled)
+        return response
+
+
+# --- Exposição --------------------------------------------------------------
+
+def collect():
+    """Soma os snapshots publicados por todos os workers (inclui este)."""
+    registry.publish()
+    workers = cache.get(WORKERS_KEY, [])
+    snapshots = cache.get_many(workers)
+    missing = [key for key in workers if key not in snapshots]
+    if missing:
+        _update_workers(lambda current: [key for key in current if key not in missing])
+
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots.values():
+        for key, value in snapshot['counters'].items():
+            counters[key] = counters.get(key, 0) + value
+        for key, (buckets, total, count) in snapshot['histograms'].items():
+            merged = histograms.setdefault(key, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, histograms):
+    """Formato de texto do Prometheus (versão 0.0.4)."""
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+            continue
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{_labels(labels, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+@require_GET
+def metrics_view(request):
+    token = _options()['TOKEN']
+    if not token:
+        # Os rótulos expõem o tráfego de todos os chatbots: nada sem token
+        return HttpResponseNotFound()
+    if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden('Token de métricas inválido')
+    return HttpResponse(render(*collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
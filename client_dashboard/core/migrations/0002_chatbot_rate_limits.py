@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='max_concurrent_requests',
+            field=models.PositiveIntegerField(default=20, help_text='Máximo de chamadas simultâneas ao webhook (0 = sem limite).'),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='rate_limit_per_ip_per_minute',
+            field=models.PositiveIntegerField(default=20, help_text='Máximo de mensagens por minuto de um mesmo visitante (IP) (0 = sem limite).'),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='rate_limit_per_minute',
+            field=models.PositiveIntegerField(default=120, help_text='Máximo de mensagens por minuto para este chatbot (0 = sem limite).'),
+        ),
+    ]
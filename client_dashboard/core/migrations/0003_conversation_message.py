@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_chatbot_rate_limits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(help_text='Identificador da sessão enviado pelo widget.', max_length=64)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_message_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('chatbot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='core.chatbotconfig')),
+            ],
+            options={
+                'verbose_name': 'Conversa',
+                'verbose_name_plural': 'Conversas',
+                'ordering': ['-last_message_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('user', 'Visitante'), ('bot', 'Chatbot')], max_length=10)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('chatbot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='core.chatbotconfig')),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='core.conversation')),
+            ],
+            options={
+                'verbose_name': 'Mensagem',
+                'verbose_name_plural': 'Mensagens',
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('chatbot', 'session_id'), name='unique_conversation_per_session'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chatbot', 'created_at'], name='message_chatbot_created_idx'),
+        ),
+    ]
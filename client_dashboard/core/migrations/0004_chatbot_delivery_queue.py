@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:35
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_conversation_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='delivery_mode',
+            field=models.CharField(choices=[('sync', 'Direta (aguarda o webhook na requisição)'), ('queue', 'Fila (resposta buscada pelo widget depois)')], default='sync', help_text="Use 'Fila' para webhooks que demoram a responder.", max_length=10),
+        ),
+        migrations.CreateModel(
+            name='DeliveryJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('session_id', models.CharField(blank=True, max_length=64)),
+                ('payload', models.JSONField(help_text='Payload enviado ao webhook.')),
+                ('status', models.CharField(choices=[('queued', 'Na fila'), ('running', 'Em entrega'), ('done', 'Entregue'), ('failed', 'Falhou')], default='queued', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Próxima tentativa de entrega.')),
+                ('locked_until', models.DateTimeField(blank=True, help_text='Fim da reserva do worker que está entregando.', null=True)),
+                ('reply', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chatbot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_jobs', to='core.chatbotconfig')),
+            ],
+            options={
+                'verbose_name': 'Entrega ao webhook',
+                'verbose_name_plural': 'Entregas ao webhook',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='deliveryjob_status_avail_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:46
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_chatbot_delivery_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='hedge_after_ms',
+            field=models.PositiveIntegerField(default=0, help_text='Se o webhook não responder nesse tempo (ms), dispara uma segunda chamada em paralelo; use o p95 de latência do webhook (0 = desativado).'),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='webhook_max_attempts',
+            field=models.PositiveSmallIntegerField(default=2, help_text='Tentativas quando a mensagem não chega ao webhook (erro de conexão, 429, 502, 503, 504).', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='webhook_timeout',
+            field=models.PositiveIntegerField(default=30, help_text='Prazo total (segundos) para o webhook responder, somando todas as tentativas.', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
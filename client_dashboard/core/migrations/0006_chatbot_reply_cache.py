@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_chatbot_webhook_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='reply_cache_enabled',
+            field=models.BooleanField(default=False, help_text='Reaproveita a resposta do webhook para mensagens repetidas (ex.: perguntas frequentes).'),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='reply_cache_ttl',
+            field=models.PositiveIntegerField(default=3600, help_text='Por quantos segundos uma resposta guardada é reaproveitada.'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_chatbot_reply_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('minute', 'Minuto'), ('hour', 'Hora'), ('day', 'Dia')], max_length=6)),
+                ('bucket_start', models.DateTimeField(help_text='Início do minuto, hora ou dia agregado.')),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0, help_text='Respostas 4xx/5xx, exceto as de limite de taxa.')),
+                ('rate_limited', models.PositiveIntegerField(default=0, help_text='Respostas 429 (limite de taxa ou de concorrência).')),
+                ('latency_total_ms', models.FloatField(default=0)),
+                ('latency_max_ms', models.FloatField(default=0)),
+                ('chatbot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rollups', to='core.chatbotconfig')),
+            ],
+            options={
+                'verbose_name': 'Uso agregado',
+                'verbose_name_plural': 'Uso agregado',
+                'ordering': ['bucket_start'],
+                'indexes': [models.Index(fields=['period', 'bucket_start'], name='usage_period_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('chatbot', 'period', 'bucket_start'), name='unique_usage_bucket')],
+            },
+        ),
+    ]
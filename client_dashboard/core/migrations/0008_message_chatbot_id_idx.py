@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_usage_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chatbot', 'id'], name='message_chatbot_id_idx'),
+        ),
+    ]
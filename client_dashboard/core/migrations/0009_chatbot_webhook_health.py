@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_message_chatbot_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='health_availability',
+            field=models.FloatField(blank=True, editable=False, help_text='Fração das últimas sondas respondidas pelo webhook.', null=True),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='health_checked_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='health_failing',
+            field=models.BooleanField(default=False, editable=False, help_text='As últimas sondas seguidas falharam; o circuito foi aberto.'),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='health_latency_p50_ms',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='health_latency_p95_ms',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='health_latency_p99_ms',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
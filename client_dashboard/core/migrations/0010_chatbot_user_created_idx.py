@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_chatbot_webhook_health'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatbotconfig',
+            index=models.Index(fields=['user', '-created_at'], name='chatbot_user_created_idx'),
+        ),
+    ]
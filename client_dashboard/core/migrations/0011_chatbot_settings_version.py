@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_chatbot_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='settings_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_chatbot_settings_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='webhook_weight',
+            field=models.PositiveSmallIntegerField(default=100, help_text='Peso do webhook principal na distribuição das mensagens entre os endpoints.', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(1000)]),
+        ),
+        migrations.CreateModel(
+            name='WebhookEndpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('health_checked_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('health_availability', models.FloatField(blank=True, editable=False, help_text='Fração das últimas sondas respondidas pelo webhook.', null=True)),
+                ('health_latency_p50_ms', models.PositiveIntegerField(blank=True, editable=False, null=True)),
+                ('health_latency_p95_ms', models.PositiveIntegerField(blank=True, editable=False, null=True)),
+                ('health_latency_p99_ms', models.PositiveIntegerField(blank=True, editable=False, null=True)),
+                ('health_failing', models.BooleanField(default=False, editable=False, help_text='As últimas sondas seguidas falharam; o circuito foi aberto.')),
+                ('url', models.URLField(help_text='URL de outra instância do webhook.')),
+                ('weight', models.PositiveSmallIntegerField(default=100, help_text='Peso relativo na distribuição das mensagens.', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(1000)])),
+                ('enabled', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('chatbot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='webhook_endpoints', to='core.chatbotconfig')),
+            ],
+            options={
+                'verbose_name': 'Endpoint do webhook',
+                'verbose_name_plural': 'Endpoints do webhook',
+                'ordering': ['created_at', 'id'],
+                'constraints': [models.UniqueConstraint(fields=('chatbot', 'url'), name='unique_webhook_endpoint')],
+            },
+        ),
+    ]
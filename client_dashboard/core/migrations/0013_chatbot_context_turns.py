@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:40
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_webhook_endpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotconfig',
+            name='context_turns',
+            field=models.PositiveSmallIntegerField(default=10, help_text='Trocas anteriores da sessão enviadas ao webhook junto com cada mensagem (0 = desativado).', validators=[django.core.validators.MaxValueValidator(50)]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_chatbot_context_turns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatbotconfig',
+            name='delivery_mode',
+            field=models.CharField(choices=[('sync', 'Direta (aguarda o webhook na requisição)'), ('queue', 'Fila (resposta buscada pelo widget depois)')], default='sync', help_text="Use 'Fila' para webhooks que demoram a responder. O /api/chat/ legado sempre aguarda o webhook.", max_length=10),
+        ),
+    ]
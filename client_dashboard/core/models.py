@@ -1,19 +1,53 @@
 import uuid
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
-class ChatbotConfig(models.Model):
+class WebhookHealth(models.Model):
+    """Perfil de um webhook medido pelas sondas de core.health (gravado com .update())."""
+    health_checked_at = models.DateTimeField(null=True, blank=True, editable=False)
+    health_availability = models.FloatField(null=True, blank=True, editable=False, help_text="Fração das últimas sondas respondidas pelo webhook.")
+    health_latency_p50_ms = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    health_latency_p95_ms = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    health_latency_p99_ms = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    health_failing = models.BooleanField(default=False, editable=False, help_text="As últimas sondas seguidas falharam; o circuito foi aberto.")
+
+    class Meta:
+        abstract = True
+
+
+class ChatbotConfig(WebhookHealth):
     """
     Modelo para armazenar as configurações personalizadas dos chatbots para cada usuário.
     Cada usuário pode ter múltiplos chatbots.
     """
+    DELIVERY_SYNC = 'sync'
+    DELIVERY_QUEUE = 'queue'
+    DELIVERY_CHOICES = [
+        (DELIVERY_SYNC, 'Direta (aguarda o webhook na requisição)'),
+        (DELIVERY_QUEUE, 'Fila (resposta buscada pelo widget depois)'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chatbots')
     name = models.CharField(max_length=100, default='Meu Chatbot', help_text="Nome do chatbot para identificação")
     webhook_url = models.URLField(max_length=200, blank=True, help_text="A URL para a qual enviaremos os eventos de chat.")
+    webhook_weight = models.PositiveSmallIntegerField(default=100, validators=[MinValueValidator(1), MaxValueValidator(1000)], help_text="Peso do webhook principal na distribuição das mensagens entre os endpoints.")
     primary_color = models.CharField(max_length=7, default='#007BFF', help_text="Cor principal do chat em hexadecimal (ex: #007BFF).")
     welcome_message = models.CharField(max_length=255, default='Olá! Como posso ajudar?', help_text="A primeira mensagem que o bot envia.")
+    rate_limit_per_minute = models.PositiveIntegerField(default=120, help_text="Máximo de mensagens por minuto para este chatbot (0 = sem limite).")
+    rate_limit_per_ip_per_minute = models.PositiveIntegerField(default=20, help_text="Máximo de mensagens por minuto de um mesmo visitante (IP) (0 = sem limite).")
+    max_concurrent_requests = models.PositiveIntegerField(default=20, help_text="Máximo de chamadas simultâneas ao webhook (0 = sem limite).")
+    webhook_timeout = models.PositiveIntegerField(default=30, validators=[MinValueValidator(1)], help_text="Prazo total (segundos) para o webhook responder, somando todas as tentativas.")
+    webhook_max_attempts = models.PositiveSmallIntegerField(default=2, validators=[MinValueValidator(1), MaxValueValidator(5)], help_text="Tentativas quando a mensagem não chega ao webhook (erro de conexão, 429, 502, 503, 504).")
+    hedge_after_ms = models.PositiveIntegerField(default=0, help_text="Se o webhook não responder nesse tempo (ms), dispara uma segunda chamada em paralelo; use o p95 de latência do webhook (0 = desativado).")
+    reply_cache_enabled = models.BooleanField(default=False, help_text="Reaproveita a resposta do webhook para mensagens repetidas (ex.: perguntas frequentes).")
+    reply_cache_ttl = models.PositiveIntegerField(default=3600, help_text="Por quantos segundos uma resposta guardada é reaproveitada.")
+    context_turns = models.PositiveSmallIntegerField(default=10, validators=[MaxValueValidator(50)], help_text="Trocas anteriores da sessão enviadas ao webhook junto com cada mensagem (0 = desativado).")
+    delivery_mode = models.CharField(max_length=10, choices=DELIVERY_CHOICES, default=DELIVERY_SYNC, help_text="Use 'Fila' para webhooks que demoram a responder. O /api/chat/ legado sempre aguarda o webhook.")
+    # Incrementada a cada gravação; o dashboard a envia para rejeitar alterações obsoletas (core.live_settings)
+    settings_version = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -21,6 +55,188 @@ class ChatbotConfig(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Configuração do Chatbot'
         verbose_name_plural = 'Configurações dos Chatbots'
+        indexes = [
+            # Lista de chatbots do usuário, na ordem padrão
+            models.Index(fields=['user', '-created_at'], name='chatbot_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.user.username}"
+
+    def active_webhook_endpoints(self):
+        """Endpoints adicionais ativos; nas instâncias de ``core.config_cache`` já vêm carregados."""
+        try:
+            return self.active_endpoints
+        except AttributeError:
+            return list(self.webhook_endpoints.filter(enabled=True))
+
+    def save(self, *args, **kwargs):
+        self.settings_version += 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'settings_version'}
+        super().save(*args, **kwargs)
+
+
+class WebhookEndpoint(WebhookHealth):
+    """
+    Endpoint adicional do webhook de um chatbot. As mensagens são distribuídas
+    entre o ``webhook_url`` principal e os endpoints ativos por
+    ``core.balancer``, conforme o peso e a latência de cada um.
+    """
+    chatbot = models.ForeignKey(ChatbotConfig, on_delete=models.CASCADE, related_name='webhook_endpoints')
+    url = models.URLField(max_length=200, help_text="URL de outra instância do webhook.")
+    weight = models.PositiveSmallIntegerField(default=100, validators=[MinValueValidator(1), MaxValueValidator(1000)], help_text="Peso relativo na distribuição das mensagens.")
+    enabled = models.BooleanField(default=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        verbose_name = 'Endpoint do webhook'
+        verbose_name_plural = 'Endpoints do webhook'
+        constraints = [
+            models.UniqueConstraint(fields=['chatbot', 'url'], name='unique_webhook_endpoint'),
+        ]
+
+    def __str__(self):
+        return self.url
+
+
+class Conversation(models.Model):
+    """
+    Conversa de um visitante com um chatbot, identificada pelo session_id
+    gerado pelo widget.
+    """
+    chatbot = models.ForeignKey(ChatbotConfig, on_delete=models.CASCADE, related_name='conversations')
+    session_id = models.CharField(max_length=64, help_text="Identificador da sessão enviado pelo widget.")
+    started_at = models.DateTimeField(default=timezone.now)
+    last_message_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-last_message_at']
+        verbose_name = 'Conversa'
+        verbose_name_plural = 'Conversas'
+        constraints = [
+            models.UniqueConstraint(fields=['chatbot', 'session_id'], name='unique_conversation_per_session'),
+        ]
+
+    def __str__(self):
+        return f"{self.session_id} ({self.chatbot_id})"
+
+
+class Message(models.Model):
+    """
+    Mensagem de uma conversa. Gravada em lote por core.conversation_log,
+    fora do ciclo da requisição de chat.
+    """
+    ROLE_USER = 'user'
+    ROLE_BOT = 'bot'
+    ROLE_CHOICES = [
+        (ROLE_USER, 'Visitante'),
+        (ROLE_BOT, 'Chatbot'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
+    chatbot = models.ForeignKey(ChatbotConfig, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    content = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        verbose_name = 'Mensagem'
+        verbose_name_plural = 'Mensagens'
+        indexes = [
+            models.Index(fields=['chatbot', 'created_at'], name='message_chatbot_created_idx'),
+            # Exportação em ordem de id, retomada a partir do último id (core.export)
+            models.Index(fields=['chatbot', 'id'], name='message_chatbot_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_role_display()}: {self.content[:50]}"
+
+
+class DeliveryJob(models.Model):
+    """
+    Mensagem aguardando entrega ao webhook no modo de entrega em fila.
+
+    Criada pelo endpoint de chat e processada pelos workers de
+    ``core.delivery_queue``; o widget busca o resultado pelo id.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Na fila'),
+        (STATUS_RUNNING, 'Em entrega'),
+        (STATUS_DONE, 'Entregue'),
+        (STATUS_FAILED, 'Falhou'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    chatbot = models.ForeignKey(ChatbotConfig, on_delete=models.CASCADE, related_name='delivery_jobs')
+    session_id = models.CharField(max_length=64, blank=True)
+    payload = models.JSONField(help_text="Payload enviado ao webhook.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, help_text="Próxima tentativa de entrega.")
+    locked_until = models.DateTimeField(null=True, blank=True, help_text="Fim da reserva do worker que está entregando.")
+    reply = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['created_at']
+        verbose_name = 'Entrega ao webhook'
+        verbose_name_plural = 'Entregas ao webhook'
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='deliveryjob_status_avail_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id} ({self.get_status_display()})"
+
+
+class UsageRollup(models.Model):
+    """
+    Contadores de uso de um chatbot agregados por minuto, hora ou dia.
+
+    Acumulados em memória no caminho do chat e somados aqui em lote por
+    ``core.usage``; o painel do dashboard lê só esta tabela.
+    """
+    PERIOD_MINUTE = 'minute'
+    PERIOD_HOUR = 'hour'
+    PERIOD_DAY = 'day'
+    PERIOD_CHOICES = [
+        (PERIOD_MINUTE, 'Minuto'),
+        (PERIOD_HOUR, 'Hora'),
+        (PERIOD_DAY, 'Dia'),
+    ]
+
+    chatbot = models.ForeignKey(ChatbotConfig, on_delete=models.CASCADE, related_name='usage_rollups')
+    period = models.CharField(max_length=6, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField(help_text="Início do minuto, hora ou dia agregado.")
+    requests = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0, help_text="Respostas 4xx/5xx, exceto as de limite de taxa.")
+    rate_limited = models.PositiveIntegerField(default=0, help_text="Respostas 429 (limite de taxa ou de concorrência).")
+    latency_total_ms = models.FloatField(default=0)
+    latency_max_ms = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['bucket_start']
+        verbose_name = 'Uso agregado'
+        verbose_name_plural = 'Uso agregado'
+        constraints = [
+            models.UniqueConstraint(fields=['chatbot', 'period', 'bucket_start'], name='unique_usage_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'bucket_start'], name='usage_period_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.chatbot_id} {self.period} {self.bucket_start:%Y-%m-%d %H:%M}"
+
+    @property
+    def latency_avg_ms(self):
+        return self.latency_total_ms / self.requests if self.requests else 0.0
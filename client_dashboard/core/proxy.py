@@ -0,0 +1,352 @@
+"""
+Lógica compartilhada pelas views do proxy de chat.
+
+As views síncronas (``core.views``) e assíncronas (``core.async_views``) só
+diferem na forma de buscar o chatbot e de chamar o webhook; a validação da
+requisição, o payload enviado e o tratamento da resposta ficam aqui.
+"""
+import httpx
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+from . import codec, conversation_log, streaming
+
+# O prazo de cada mensagem vem de ChatbotConfig.webhook_timeout (ver
+# core.webhook_retry); /api/chat/ nunca espera mais que LEGACY_TIMEOUT segundos.
+LEGACY_TIMEOUT = 10
+
+WEBHOOK_HEADERS = {'Content-Type': 'application/json'}
+
+LEGACY_FALLBACK_REPLY = 'Desculpe, não consegui me conectar ao serviço de chat no momento. Tente novamente mais tarde.'
+
+DEFAULT_OPTIONS = {
+    # Tamanho máximo do corpo enviado pelo widget
+    'MAX_REQUEST_BYTES': 16384,
+    # Tamanho máximo da resposta (não streaming) lida do webhook
+    'MAX_WEBHOOK_BYTES': 1048576,
+}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'CHAT_PROXY', {}))
+    return options
+
+
+class ChatRequestError(Exception):
+    """Erro de validação que já carrega a resposta a ser devolvida ao widget."""
+
+    def __init__(self, payload, status=400):
+        super().__init__(payload.get('error'))
+        self.response = JsonResponse(payload, status=status)
+
+
+class WebhookBodyTooLarge(httpx.HTTPError):
+    """A resposta do webhook passou de ``MAX_WEBHOOK_BYTES``."""
+
+
+def _load_body(request, invalid_error):
+    """Corpo JSON (objeto) da requisição do widget, limitado a ``MAX_REQUEST_BYTES``."""
+    limit = _options()['MAX_REQUEST_BYTES']
+    try:
+        declared = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        declared = 0
+    if declared > limit or len(request.body) > limit:
+        raise ChatRequestError({'error': f'Corpo da requisição excede {limit} bytes'}, status=413)
+    try:
+        data = codec.loads(request.body)
+    except codec.DecodeError:
+        raise ChatRequestError({'error': invalid_error})
+    if not isinstance(data, dict):
+        raise ChatRequestError({'error': invalid_error})
+    return data
+
+
+def parse_proxy_request(request):
+    """Valida o corpo JSON de ``/api/v1/chat/`` e retorna o dicionário."""
+    if request.content_type != 'application/json':
+        raise ChatRequestError({'error': 'Content-Type deve ser application/json'})
+
+    data = _load_body(request, 'Dados JSON inválidos no corpo da requisição')
+
+    if not data.get('chatbot_id'):
+        raise ChatRequestError({'error': 'chatbot_id é obrigatório no corpo da requisição'})
+
+    if not data.get('message'):
+        raise ChatRequestError({'error': 'message é obrigatória no corpo da requisição'})
+
+    return data
+
+
+def build_webhook_payload(data, session_id=None, context=()):
+    """
+    Monta o payload repassado ao webhook do cliente.
+
+    Com ``session_id`` inclui também a sessão e as trocas anteriores
+    (``context``, janela de ``core.session_context``).
+    """
+    payload = {
+        'message': data['message'],
+        'chatbot_id': data['chatbot_id'],
+        'timestamp': data.get('timestamp'),
+    }
+    if session_id:
+        payload['session_id'] = session_id
+        payload['context'] = [{'role': role, 'content': content} for role, content in context]
+    return payload
+
+
+def legacy_deadline(config):
+    """Prazo total de ``/api/chat/``: o do chatbot, limitado a ``LEGACY_TIMEOUT``."""
+    return min(config.webhook_timeout, LEGACY_TIMEOUT)
+
+
+def webhook_headers(wants_stream=False):
+    """Headers enviados ao webhook; anuncia SSE/NDJSON se o widget aceitar stream."""
+    if not wants_stream:
+        return WEBHOOK_HEADERS
+    return {**WEBHOOK_HEADERS, 'Accept': streaming.STREAM_ACCEPT}
+
+
+def chatbot_not_found(chatbot_id):
+    return JsonResponse({
+        'error': f'Chatbot com ID {chatbot_id} não encontrado'
+    }, status=404)
+
+
+def webhook_not_configured(chatbot_id):
+    return JsonResponse({
+        'error': 'Webhook URL não configurada para este chatbot',
+        'chatbot_id': chatbot_id
+    }, status=400)
+
+
+def normalize_reply(webhook_data):
+    """Garante que sempre há um campo 'reply' na resposta do webhook."""
+    if 'reply' not in webhook_data:
+        if 'mensagem' in webhook_data:
+            webhook_data['reply'] = webhook_data['mensagem']
+        elif 'message' in webhook_data:
+            webhook_data['reply'] = webhook_data['message']
+        elif 'response' in webhook_data:
+            webhook_data['reply'] = webhook_data['response']
+        else:
+            # Se não encontrar nenhum campo conhecido, usar o primeiro valor string
+            for key, value in webhook_data.items():
+                if isinstance(value, str) and value.strip():
+                    webhook_data['reply'] = value
+                    break
+            else:
+                webhook_data['reply'] = 'Resposta recebida mas formato não reconhecido.'
+    return webhook_data
+
+
+def _check_webhook_length(webhook_response, limit):
+    try:
+        declared = int(webhook_response.headers.get('content-length') or 0)
+    except ValueError:
+        declared = 0
+    if declared > limit:
+        raise WebhookBodyTooLarge(f'Resposta do webhook excede {limit} bytes')
+
+
+def read_webhook_body(webhook_response):
+    """Lê o corpo de uma resposta aberta em stream, até ``MAX_WEBHOOK_BYTES``."""
+    limit = _options()['MAX_WEBHOOK_BYTES']
+    _check_webhook_length(webhook_response, limit)
+    chunks = []
+    size = 0
+    for chunk in webhook_response.iter_bytes():
+        size += len(chunk)
+        if size > limit:
+            raise WebhookBodyTooLarge(f'Resposta do webhook excede {limit} bytes')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+async def aread_webhook_body(webhook_response):
+    """Versão assíncrona de ``read_webhook_body``."""
+    limit = _options()['MAX_WEBHOOK_BYTES']
+    _check_webhook_length(webhook_response, limit)
+    chunks = []
+    size = 0
+    async for chunk in webhook_response.aiter_bytes():
+        size += len(chunk)
+        if size > limit:
+            raise WebhookBodyTooLarge(f'Resposta do webhook excede {limit} bytes')
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def decode_webhook_body(body):
+    """Conteúdo JSON do corpo do webhook; ``None`` se não for JSON."""
+    try:
+        return codec.loads(body)
+    except codec.DecodeError:
+        return None
+
+
+def _reply_data(webhook_response, decoded, body):
+    if not isinstance(decoded, dict):
+        # Se não for um objeto JSON, retornar o texto como resposta
+        encoding = webhook_response.charset_encoding or 'utf-8'
+        return {
+            'reply': body.decode(encoding, errors='replace').strip() or 'Resposta vazia do webhook.',
+            'status': 'success'
+        }
+    return normalize_reply(decoded)
+
+
+def reply_data(webhook_response, body=None):
+    """Dicionário da resposta (já bem-sucedida) do webhook, sempre com 'reply'."""
+    body = webhook_response.content if body is None else body
+    return _reply_data(webhook_response, decode_webhook_body(body), body)
+
+
+def webhook_reply_response(webhook_response, body, on_reply=None, on_data=None):
+    """
+    Converte a resposta (já bem-sucedida) do webhook no JSON do widget.
+
+    Se o webhook já devolveu um objeto JSON com ``reply``, o corpo é repassado
+    como veio, sem ser serializado de novo. ``on_reply`` recebe o texto da
+    resposta, para quem precisa registrá-lo; ``on_data``, o dicionário
+    completo (ex.: para o cache de respostas).
+    """
+    webhook_data, response = _webhook_reply(webhook_response, body)
+    if on_data is not None:
+        on_data(webhook_data)
+    if on_reply is not None:
+        on_reply(webhook_data['reply'])
+    return response
+
+
+async def awebhook_reply_response(webhook_response, body, on_reply=None, on_data=None):
+    """Versão assíncrona de ``webhook_reply_response``; os callbacks são corrotinas."""
+    webhook_data, response = _webhook_reply(webhook_response, body)
+    if on_data is not None:
+        await on_data(webhook_data)
+    if on_reply is not None:
+        await on_reply(webhook_data['reply'])
+    return response
+
+
+def _webhook_reply(webhook_response, body):
+    decoded = decode_webhook_body(body)
+    # Conferido antes de _reply_data, que completa o dicionário
+    passthrough = isinstance(decoded, dict) and 'reply' in decoded
+    webhook_data = _reply_data(webhook_response, decoded, body)
+    if passthrough:
+        return webhook_data, HttpResponse(body, content_type='application/json', status=200)
+    return webhook_data, codec.FastJsonResponse(webhook_data, status=200)
+
+
+def legacy_reply_response(body, on_reply):
+    """
+    Resposta de ``/api/chat/``: o JSON do webhook repassado como veio.
+
+    Levanta ``ValueError`` se o corpo não for um objeto JSON (o widget antigo
+    recebe então o fallback).
+    """
+    webhook_data = decode_webhook_body(body)
+    if not isinstance(webhook_data, dict):
+        raise ValueError('Resposta do webhook não é um objeto JSON')
+    if webhook_data.get('reply'):
+        on_reply(webhook_data['reply'])
+    return HttpResponse(body, content_type='application/json', status=200)
+
+
+def webhook_error_body(exc):
+    """Corpo e status da resposta de fallback para falhas ao falar com o webhook."""
+    if isinstance(exc, WebhookBodyTooLarge):
+        return {
+            'error': str(exc),
+            'reply': 'Desculpe, houve um problema com o serviço de chat. Tente novamente mais tarde.'
+        }, 502
+
+    if isinstance(exc, httpx.TimeoutException):
+        return {
+            'error': 'Timeout ao conectar com o webhook',
+            'reply': 'Desculpe, o serviço está demorando para responder. Tente novamente.'
+        }, 408
+
+    if isinstance(exc, httpx.HTTPStatusError):
+        return {
+            'error': f'Erro HTTP do webhook: {exc.response.status_code}',
+            'reply': 'Desculpe, houve um problema com o serviço de chat. Tente novamente mais tarde.'
+        }, 502
+
+    return {
+        'error': f'Erro de conexão com webhook: {str(exc)}',
+        'reply': 'Desculpe, não consegui me conectar ao serviço de chat. Verifique sua conexão.'
+    }, 503
+
+
+def webhook_error_response(exc):
+    """Resposta de fallback para falhas ao falar com o webhook."""
+    body, status = webhook_error_body(exc)
+    return JsonResponse(body, status=status)
+
+
+CIRCUIT_OPEN_BODY = {
+    'error': 'Webhook indisponível no momento (circuito aberto)',
+    'reply': 'Desculpe, o serviço de chat está temporariamente indisponível. Tente novamente em instantes.'
+}
+
+RATE_LIMITED_BODY = {
+    'error': 'Limite de mensagens excedido',
+    'reply': 'Você está enviando mensagens rápido demais. Aguarde um instante e tente novamente.'
+}
+
+
+def circuit_open_response(retry_after):
+    """Fallback imediato enquanto o circuito do webhook está aberto."""
+    response = JsonResponse(CIRCUIT_OPEN_BODY, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limited_response(retry_after):
+    """Resposta 429 quando o chatbot ou o visitante excede os limites."""
+    response = JsonResponse(RATE_LIMITED_BODY, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+INTERNAL_ERROR_BODY = {
+    'error': 'Erro interno do servidor',
+    'reply': 'Desculpe, ocorreu um erro interno. Tente novamente mais tarde.'
+}
+
+
+def internal_error_response():
+    return JsonResponse(INTERNAL_ERROR_BODY, status=500)
+
+
+def legacy_chatbot_id(request):
+    """Obtém o chatbot_id do header X-Client-ID usado por ``/api/chat/``."""
+    chatbot_id = request.headers.get('X-Client-ID')
+    if not chatbot_id:
+        raise ChatRequestError({'error': 'Header X-Client-ID é obrigatório'})
+    return chatbot_id
+
+
+def parse_legacy_request(request):
+    """Valida o corpo de ``/api/chat/`` e retorna o dicionário."""
+    data = _load_body(request, 'Dados JSON inválidos')
+    if not data.get('message', ''):
+        raise ChatRequestError({'error': 'Mensagem é obrigatória'})
+    return data
+
+
+def session_id(request, data):
+    """session_id enviado pelo widget, no corpo ou no header X-Session-ID."""
+    return conversation_log.clean_session_id(data.get('session_id') or request.headers.get('X-Session-ID'))
+
+
+def legacy_missing_webhook_response():
+    return JsonResponse({'reply': 'Desculpe, o webhook não está configurado para este chatbot.'}, status=200)
+
+
+def legacy_fallback_response():
+    return JsonResponse({'reply': LEGACY_FALLBACK_REPLY}, status=200)
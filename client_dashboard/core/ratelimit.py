@@ -0,0 +1,194 @@
+"""
+Controle de admissão dos endpoints de chat.
+
+Dois mecanismos, configurados por ``ChatbotConfig``:
+
+- **Taxa**: balde de ``rate_limit_per_minute`` mensagens por chatbot e de
+  ``rate_limit_per_ip_per_minute`` por IP do visitante, reabastecido ao longo
+  do minuto. É calculado com contadores atômicos (``cache.incr``) em janelas
+  de 60s, ponderando a janela anterior pelo tempo restante — o que equivale a
+  um balde que se reenche continuamente sem precisar de leitura-e-escrita.
+- **Concorrência**: no máximo ``max_concurrent_requests`` chamadas ao webhook
+  do chatbot em andamento ao mesmo tempo, somando todos os workers.
+
+Os contadores ficam no cache do Django (Redis em produção). Zero desativa o
+respectivo limite. Requisições recusadas recebem ``429`` com ``Retry-After``.
+"""
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+WINDOW = 60
+
+DEFAULT_OPTIONS = {
+    # Quantos proxies reversos confiáveis acrescentam o IP em X-Forwarded-For
+    'TRUSTED_PROXY_COUNT': 0,
+    # Validade do contador de chamadas simultâneas (limpa vazamentos de workers mortos)
+    'CONCURRENCY_TTL': 120,
+}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'RATE_LIMIT', {}))
+    return options
+
+
+def client_ip(request):
+    """IP do visitante, considerando os proxies confiáveis da frente."""
+    proxies = _options()['TRUSTED_PROXY_COUNT']
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if proxies and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+        if len(hops) >= proxies:
+            return hops[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _incr(key, timeout):
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout)
+        return 1
+
+
+def _counter_key(scope, now):
+    return f'ratelimit:{scope}:{int(now // WINDOW)}'
+
+
+def _unhit(scope, now):
+    """Desconta uma requisição contada por ``_hit`` em ``scope``."""
+    try:
+        cache.decr(_counter_key(scope, now))
+    except ValueError:
+        pass
+
+
+def _hit(scope, limit, now):
+    """
+    Conta uma requisição em ``scope``; retorna os segundos de espera ou 0.
+
+    Uma requisição recusada não fica contada.
+    """
+    window = int(now // WINDOW)
+    elapsed = now - window * WINDOW
+    current = _incr(_counter_key(scope, now), WINDOW * 2)
+    previous = cache.get(f'ratelimit:{scope}:{window - 1}', 0)
+
+    weight = 1 - elapsed / WINDOW
+    if previous * weight + current <= limit:
+        return 0
+    _unhit(scope, now)
+
+    # Tempo até a parte restante da janela anterior liberar espaço suficiente
+    if previous and current <= limit:
+        wait = WINDOW * (1 - (limit - current) / previous) - elapsed
+    else:
+        wait = WINDOW - elapsed
+    return max(1, math.ceil(wait))
+
+
+def check_rate_limit(config, ip):
+    """
+    Retorna 0 se a mensagem pode seguir ou os segundos até a próxima vaga.
+
+    O limite por IP é conferido primeiro: um visitante acima dele não consome
+    o limite do chatbot, que é dividido entre todos os visitantes.
+    """
+    now = time.time()
+    ip_scope = f'ip:{config.pk}:{ip}' if config.rate_limit_per_ip_per_minute and ip else None
+    if ip_scope is not None:
+        wait = _hit(ip_scope, config.rate_limit_per_ip_per_minute, now)
+        if wait:
+            return wait
+    if config.rate_limit_per_minute:
+        wait = _hit(f'chatbot:{config.pk}', config.rate_limit_per_minute, now)
+        if wait:
+            if ip_scope is not None:
+                _unhit(ip_scope, now)
+            return wait
+    return 0
+
+
+class ConcurrencySlot:
+    """Vaga de chamada simultânea ao webhook; ``release`` pode ser chamado mais de uma vez."""
+
+    def __init__(self, key=None):
+        self.key = key
+        self.released = key is None
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        try:
+            if cache.decr(self.key) < 0:
+                cache.set(self.key, 0, _options()['CONCURRENCY_TTL'])
+        except ValueError:
+            # Contador expirou enquanto a chamada estava em andamento
+            pass
+
+    async def arelease(self):
+        if not self.released:
+            await sync_to_async(self.release, thread_sensitive=False)()
+
+    def bind(self, response):
+        """
+        Libera a vaga quando ``response`` terminar de ser enviada.
+
+        Respostas comuns liberam na hora; em streaming a vaga dura até o fim
+        do stream (a chamada ao webhook ainda está aberta).
+        """
+        if not response.streaming:
+            self.release()
+        elif response.is_async:
+            response.streaming_content = self._arelease_after(response.streaming_content)
+        else:
+            response.streaming_content = self._release_after(response.streaming_content)
+        return response
+
+    async def abind(self, response):
+        """Versão assíncrona de ``bind``."""
+        if not response.streaming:
+            await self.arelease()
+            return response
+        return self.bind(response)
+
+    def _release_after(self, content):
+        try:
+            yield from content
+        finally:
+            self.release()
+
+    async def _arelease_after(self, content):
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            await self.arelease()
+
+
+def acquire_slot(config):
+    """Reserva uma vaga de chamada ao webhook; ``None`` se o limite foi atingido."""
+    if not config.max_concurrent_requests:
+        return ConcurrencySlot()
+    key = f'ratelimit:inflight:{config.pk}'
+    ttl = _options()['CONCURRENCY_TTL']
+    count = _incr(key, ttl)
+    # incr mantém o TTL de quando a chave foi criada: renovar a cada chamada,
+    # senão o contador expira com chamadas ainda em andamento
+    cache.touch(key, ttl)
+    if count > config.max_concurrent_requests:
+        ConcurrencySlot(key).release()
+        return None
+    return ConcurrencySlot(key)
+
+
+# Só usam o cache: podem rodar em qualquer thread, sem esperar a do contexto
+acheck_rate_limit = sync_to_async(check_rate_limit, thread_sensitive=False)
+aacquire_slot = sync_to_async(acquire_slot, thread_sensitive=False)
@@ -0,0 +1,256 @@
+"""
+Leituras em réplicas do banco para o caminho quente do chat e do embed.
+
+Com ``DATABASE_REPLICA_URLS`` o ``settings`` cria os aliases ``replica1``,
+``replica2``... e instala ``ReplicaRouter``. Só vão para as réplicas as
+leituras feitas dentro das views marcadas com ``read_from_replica`` (chat e
+embed, que só leem o ``ChatbotConfig`` pelo ``core.config_cache``); todo o
+resto, e qualquer escrita, continua no primário.
+
+- As réplicas são usadas em rodízio. Cada processo confere uma réplica com
+  ``SELECT 1`` no máximo a cada ``HEALTH_INTERVAL`` segundos; a que falhar
+  fica fora do rodízio até a próxima verificação. Sem réplica saudável, a
+  leitura vai para o primário.
+- Depois de uma escrita numa requisição de usuário logado,
+  ``ReplicaPinMiddleware`` grava o cookie ``PIN_COOKIE`` por
+  ``STICKY_SECONDS``: as requisições seguintes daquele navegador (as
+  pré-visualizações do dashboard) leem do primário.
+- Um chatbot alterado é lido do primário por ``STICKY_SECONDS``, por qualquer
+  visitante, para que uma réplica atrasada não devolva ao cache a versão
+  anterior (ver ``core.config_cache``).
+"""
+import functools
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    # Aliases de DATABASES usados como réplicas (o settings os cria a partir das URLs)
+    'ALIASES': [],
+    # Intervalo entre verificações de cada réplica, por processo
+    'HEALTH_INTERVAL': 5.0,
+    # Tempo de leitura no primário depois de uma escrita (maior que o atraso da replicação)
+    'STICKY_SECONDS': 15,
+}
+
+PIN_COOKIE = 'db_primary'
+
+# True dentro das views marcadas com read_from_replica
+_replica_reads = ContextVar('replica_reads', default=False)
+# True quando a leitura precisa ver as escritas recentes
+_primary = ContextVar('replica_primary', default=False)
+# Estado da requisição atual (ReplicaPinMiddleware)
+_request = ContextVar('replica_request', default=None)
+
+# alias -> (saudável, instante da verificação)
+_checks = {}
+_rotation = itertools.count()
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'DATABASE_REPLICAS', {}))
+    return options
+
+
+def is_enabled():
+    return bool(_options()['ALIASES'])
+
+
+def _probe(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return True
+    except DatabaseError:
+        logger.warning('Réplica do banco indisponível', exc_info=True, extra={'alias': alias})
+        return False
+
+
+def _healthy(alias, now, interval):
+    checked = _checks.get(alias)
+    if checked is not None and now - checked[1] < interval:
+        return checked[0]
+    healthy = _probe(alias)
+    _checks[alias] = (healthy, now)
+    return healthy
+
+
+def read_alias():
+    """Próxima réplica saudável do rodízio; o primário se não houver nenhuma."""
+    options = _options()
+    aliases = options['ALIASES']
+    if not aliases:
+        return DEFAULT_DB_ALIAS
+    now = time.monotonic()
+    start = next(_rotation)
+    for offset in range(len(aliases)):
+        alias = aliases[(start + offset) % len(aliases)]
+        if _healthy(alias, now, options['HEALTH_INTERVAL']):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """Leituras das views ``read_from_replica`` nas réplicas; o resto no primário."""
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            # None: o Django usa o banco de onde veio a instância (hints) ou o primário
+            return None
+        state = _request.get()
+        if _primary.get() or (state is not None and state.pinned):
+            return DEFAULT_DB_ALIAS
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None:
+            state.wrote = True
+        # Explícito: uma instância lida de uma réplica também é gravada no primário
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primário e réplicas têm os mesmos dados
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def replica_reads():
+    """Permite que as leituras do bloco usem as réplicas."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def primary(active=True):
+    """Força as leituras do bloco para o primário (se ``active``)."""
+    token = _primary.set(active or _primary.get())
+    try:
+        yield
+    finally:
+        _primary.reset(token)
+
+
+def read_from_replica(view):
+    """Decorator das views que só leem: suas consultas podem ir para as réplicas."""
+    if iscoroutinefunction(view):
+        async def wrapper(*args, **kwargs):
+            with replica_reads():
+                return await view(*args, **kwargs)
+    else:
+        def wrapper(*args, **kwargs):
+            with replica_reads():
+                return view(*args, **kwargs)
+    return functools.wraps(view)(wrapper)
+
+
+def _written_key(chatbot_id):
+    return f'replica-written:{chatbot_id}'
+
+
+def mark_written(chatbot_id):
+    """Lê o chatbot do primário pelos próximos ``STICKY_SECONDS``."""
+    options = _options()
+    if options['ALIASES']:
+        cache.set(_written_key(chatbot_id), 1, options['STICKY_SECONDS'])
+
+
+def written_recently(chatbot_id):
+    """``True`` se o chatbot foi alterado há pouco e a leitura iria para uma réplica."""
+    if not _replica_reads.get() or not is_enabled():
+        return False
+    return cache.get(_written_key(chatbot_id)) is not None
+
+
+async def awritten_recently(chatbot_id):
+    if not _replica_reads.get() or not is_enabled():
+        return False
+    return await cache.aget(_written_key(chatbot_id)) is not None
+
+
+class _RequestState:
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+class ReplicaPinMiddleware:
+    """
+    Mantém no primário as leituras de quem acabou de gravar algo.
+
+    Fica depois do ``AuthenticationMiddleware``; sem réplicas configuradas
+    não faz nada.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = is_enabled()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        state = _RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        if state.wrote:
+            self._pin(request, response, getattr(request, 'user', None))
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        state = _RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _request.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        if state.wrote and hasattr(request, 'auser'):
+            self._pin(request, response, await request.auser())
+        return response
+
+    def _pin(self, request, response, user):
+        # O usuário (e a sessão) só é carregado depois de uma escrita
+        if user is None or not user.is_authenticated:
+            return
+        response.set_cookie(
+            PIN_COOKIE, '1',
+            max_age=_options()['STICKY_SECONDS'],
+            secure=request.is_secure(),
+            httponly=True,
+            samesite='Lax',
+        )
+
+
+def reset():
+    """Descarta as verificações de saúde do processo (testes)."""
+    _checks.clear()
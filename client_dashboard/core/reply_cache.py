@@ -0,0 +1,287 @@
+"""
+Cache de respostas por chatbot, para perguntas repetidas (opt-in).
+
+Com ``ChatbotConfig.reply_cache_enabled``, a resposta do webhook fica guardada
+por ``reply_cache_ttl`` segundos, indexada pelo chatbot e pela mensagem
+normalizada (sem diferença de maiúsculas, acentos e espaços). Duas camadas,
+como em ``core.config_cache``:
+
+1. LRU em memória do processo, limitado a ``LOCAL_MAX_ENTRIES`` respostas;
+2. cache compartilhado do Django (Redis em produção), só com TTL.
+
+A chave inclui ``updated_at`` do chatbot: editar o chatbot descarta as
+respostas guardadas. Também inclui um resumo do contexto da sessão
+(``core.session_context``) enviado ao webhook: a mesma pergunta com outro
+histórico é outra entrada. O webhook marca uma resposta como não cacheável com o
+header ``Cache-Control: no-store`` (ou ``no-cache``/``private``) ou com
+``"cacheable": false`` no JSON; ``max-age`` menor que o TTL do chatbot também
+é respeitado.
+
+Mensagens idênticas em andamento ao mesmo tempo no processo são agrupadas: só
+a primeira chama o webhook, as demais esperam a resposta dela. Se a resposta
+não puder ser guardada, cada uma faz a própria chamada.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import codec
+from .lru import TTLLRUCache
+
+DEFAULT_OPTIONS = {
+    'LOCAL_MAX_ENTRIES': 5000,
+    # Mensagens maiores dificilmente se repetem: não são guardadas
+    'MAX_MESSAGE_LENGTH': 500,
+}
+
+HEADER = 'X-Reply-Cache'
+
+_MAX_AGE = re.compile(r'max-age\s*=\s*(\d+)')
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'REPLY_CACHE', {}))
+    return options
+
+
+_local = TTLLRUCache(max_entries=_options()['LOCAL_MAX_ENTRIES'])
+
+
+def normalize_message(message):
+    """Mensagem sem acentos, em minúsculas e com os espaços colapsados."""
+    decomposed = unicodedata.normalize('NFKD', message)
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(folded.casefold().split())
+
+
+def cache_key(config, message, context=()):
+    digest = hashlib.sha1(normalize_message(message).encode('utf-8'))
+    for role, content in context:
+        digest.update(f'\x00{role}\x00{content}'.encode('utf-8'))
+    return f'reply-cache:{config.pk}:{config.updated_at.timestamp():.6f}:{digest.hexdigest()}'
+
+
+def cache_policy(webhook_response):
+    """TTL máximo permitido pelos headers do webhook; 0 se não cacheável."""
+    cache_control = webhook_response.headers.get('cache-control', '').lower()
+    if any(directive in cache_control for directive in ('no-store', 'no-cache', 'private')):
+        return 0
+    match = _MAX_AGE.search(cache_control)
+    return int(match.group(1)) if match else None
+
+
+class _Flight:
+    """Chamada ao webhook em andamento, aguardada pelas mensagens idênticas."""
+
+    __slots__ = ('done', 'result', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.waiters = []
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class ReplyLookup:
+    """
+    Consulta ao cache para uma mensagem; inerte se o chatbot não usa cache.
+
+    Quem obtém ``None`` de ``fetch``/``afetch`` deve chamar o webhook, passar
+    a resposta a ``observe`` e depois a ``store`` (ou ao callback de ``wrap``)
+    e sempre encerrar com ``finish`` ou ``bind``, liberando as mensagens que
+    aguardam.
+    """
+
+    __slots__ = ('key', 'ttl', 'max_age', 'flight', 'leader')
+
+    def __init__(self, key=None, ttl=0):
+        self.key = key
+        self.ttl = ttl
+        self.max_age = None
+        self.flight = None
+        self.leader = False
+
+    @property
+    def enabled(self):
+        return self.key is not None
+
+    def _cached(self):
+        data = _local.get(self.key)
+        if data is not None:
+            return data
+        entry = cache.get(self.key)
+        return self._remember(entry)
+
+    def _remember(self, entry):
+        if entry is None:
+            return None
+        expires_at, data = entry
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            return None
+        _local.set(self.key, data, ttl=remaining)
+        return data
+
+    def _join(self):
+        with _flights_lock:
+            flight = _flights.get(self.key)
+            if flight is None:
+                flight = _flights[self.key] = _Flight()
+                self.leader = True
+        self.flight = flight
+
+    def fetch(self, timeout):
+        """Resposta guardada, ou a de uma mensagem idêntica em andamento."""
+        if not self.enabled:
+            return None
+        data = self._cached()
+        if data is not None:
+            return data
+        self._join()
+        if self.leader:
+            return None
+        self.flight.done.wait(timeout)
+        return self.flight.result
+
+    async def afetch(self, timeout):
+        """Versão assíncrona de ``fetch``."""
+        if not self.enabled:
+            return None
+        data = _local.get(self.key)
+        if data is None:
+            data = self._remember(await cache.aget(self.key))
+        if data is not None:
+            return data
+        self._join()
+        if self.leader:
+            return None
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with _flights_lock:
+            if self.flight.done.is_set():
+                return self.flight.result
+            self.flight.waiters.append((loop, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def observe(self, webhook_response):
+        """Lê a política de cache dos headers da resposta do webhook."""
+        if self.enabled:
+            self.max_age = cache_policy(webhook_response)
+
+    def _store_local(self, data):
+        """Guarda ``data`` no processo; retorna o TTL, ou ``None`` se não guardou."""
+        if not self.enabled or data.get('cacheable') is False:
+            return None
+        ttl = self.ttl if self.max_age is None else min(self.ttl, self.max_age)
+        if ttl <= 0:
+            return None
+        _local.set(self.key, data, ttl=ttl)
+        if self.flight is not None:
+            self.flight.result = data
+        return ttl
+
+    def store(self, data):
+        """Guarda a resposta do webhook (dicionário com ``reply``), se permitido."""
+        ttl = self._store_local(data)
+        if ttl is not None:
+            cache.set(self.key, (time.time() + ttl, data), ttl)
+
+    async def astore(self, data):
+        """Versão assíncrona de ``store``."""
+        ttl = self._store_local(data)
+        if ttl is not None:
+            await cache.aset(self.key, (time.time() + ttl, data), ttl)
+
+    def wrap(self, on_reply):
+        """Callback de resposta em texto (streams) que também guarda a resposta."""
+        if not self.enabled:
+            return on_reply
+
+        def on_complete(reply):
+            self.store({'reply': reply, 'status': 'success'})
+            on_reply(reply)
+
+        return on_complete
+
+    def awrap(self, on_reply):
+        """Versão assíncrona de ``wrap``: ``on_reply`` e o callback retornado são corrotinas."""
+
+        async def on_complete(reply):
+            await self.astore({'reply': reply, 'status': 'success'})
+            await on_reply(reply)
+
+        return on_complete
+
+    def finish(self):
+        """Libera as mensagens que aguardam esta chamada."""
+        if not self.leader:
+            return
+        self.leader = False
+        with _flights_lock:
+            if _flights.get(self.key) is self.flight:
+                del _flights[self.key]
+            waiters, self.flight.waiters = self.flight.waiters, []
+            self.flight.done.set()
+        result = self.flight.result
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, result)
+
+    def bind(self, response):
+        """Encerra ao fim da resposta (em streaming, ao fim do stream)."""
+        if not response.streaming:
+            self.finish()
+        elif response.is_async:
+            response.streaming_content = self._afinish_after(response.streaming_content)
+        else:
+            response.streaming_content = self._finish_after(response.streaming_content)
+        return response
+
+    def _finish_after(self, content):
+        try:
+            yield from content
+        finally:
+            self.finish()
+
+    async def _afinish_after(self, content):
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            self.finish()
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def lookup(config, message, context=()):
+    """``ReplyLookup`` da mensagem para o chatbot, com a janela ``context`` da sessão."""
+    if not config.reply_cache_enabled or not config.reply_cache_ttl:
+        return ReplyLookup()
+    if not isinstance(message, str) or len(message) > _options()['MAX_MESSAGE_LENGTH']:
+        return ReplyLookup()
+    return ReplyLookup(cache_key(config, message, context), config.reply_cache_ttl)
+
+
+def hit_response(data):
+    response = codec.FastJsonResponse(data, status=200)
+    response[HEADER] = 'HIT'
+    return response
+
+
+def clear_local_cache():
+    _local.clear()
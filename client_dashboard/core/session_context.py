@@ -0,0 +1,163 @@
+"""
+Contexto da conversa por sessão do widget, enviado ao webhook com cada mensagem.
+
+Para cada ``session_id`` o proxy guarda as últimas ``context_turns`` trocas
+(mensagem do visitante e resposta do chatbot) e as envia no payload, da mais
+antiga para a mais recente, sem a mensagem atual::
+
+    {"message": "E para o Rio?", "chatbot_id": "...", "timestamp": null,
+     "session_id": "7f1c0c1e-...",
+     "context": [{"role": "user", "content": "Quanto custa o frete?"},
+                 {"role": "bot", "content": "Para São Paulo, R$ 20."}]}
+
+Nada disso passa pelo banco. Duas camadas, como em ``core.config_cache``:
+
+1. LRU em memória do processo, limitado a ``LOCAL_MAX_SESSIONS`` sessões e a
+   ``LOCAL_TTL`` segundos;
+2. cache compartilhado do Django (Redis em produção), que sobrevive ao
+   reinício dos workers e descarta a sessão após ``TTL`` segundos sem
+   mensagens.
+
+A memória de uma sessão é limitada: cada mensagem é cortada em
+``MAX_MESSAGE_CHARS`` caracteres e, passando de ``MAX_CHARS`` no total, as
+trocas mais antigas saem da janela.
+
+Um worker que atendeu a sessão há menos de ``LOCAL_TTL`` segundos usa a
+própria cópia, que pode não ter a troca atendida nesse meio tempo por outro
+worker. No WebSocket a sessão fica sempre no mesmo worker.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .lru import TTLLRUCache
+from .models import Message
+
+DEFAULT_OPTIONS = {
+    'ENABLED': True,
+    # Segundos sem mensagens até a sessão ser descartada do cache compartilhado
+    'TTL': 1800,
+    'LOCAL_TTL': 5.0,
+    'LOCAL_MAX_SESSIONS': 10000,
+    'MAX_MESSAGE_CHARS': 2000,
+    'MAX_CHARS': 8000,
+}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'SESSION_CONTEXT', {}))
+    return options
+
+
+_local = TTLLRUCache(max_entries=_options()['LOCAL_MAX_SESSIONS'])
+
+
+def _key(chatbot_id, session_id):
+    # session_id vem do navegador: o hash mantém a chave válida em qualquer backend
+    digest = hashlib.sha1(session_id.encode('utf-8')).hexdigest()
+    return f'session-context:{chatbot_id}:{digest}'
+
+
+def is_active(config, session_id):
+    return bool(session_id and config.context_turns and _options()['ENABLED'])
+
+
+def _clip(window, turns, max_chars):
+    """Últimas ``turns`` trocas de ``window`` que cabem em ``max_chars`` caracteres."""
+    window = window[-2 * turns:]
+    total = sum(len(content) for _, content in window)
+    while window and total > max_chars:
+        total -= len(window[0][1]) + len(window[1][1])
+        window = window[2:]
+    return window
+
+
+def load(config, session_id):
+    """Janela da sessão: tupla de ``(role, content)``, vazia sem sessão ou contexto."""
+    if not is_active(config, session_id):
+        return ()
+    key = _key(config.pk, session_id)
+    window = _local.get(key)
+    if window is None:
+        window = cache.get(key, ())
+        _local.set(key, window, ttl=_options()['LOCAL_TTL'])
+    # context_turns pode ter sido reduzido depois que a janela foi guardada
+    return window[-2 * config.context_turns:]
+
+
+async def aload(config, session_id):
+    """Versão assíncrona de ``load``."""
+    if not is_active(config, session_id):
+        return ()
+    key = _key(config.pk, session_id)
+    window = _local.get(key)
+    if window is None:
+        window = await cache.aget(key, ())
+        _local.set(key, window, ttl=_options()['LOCAL_TTL'])
+    return window[-2 * config.context_turns:]
+
+
+def _extended(config, session_id, message, reply, window):
+    """Janela com a troca acrescentada, já guardada na memória do processo."""
+    options = _options()
+    size = options['MAX_MESSAGE_CHARS']
+    window = _clip(
+        (*window, (Message.ROLE_USER, message[:size]), (Message.ROLE_BOT, reply[:size])),
+        config.context_turns,
+        options['MAX_CHARS'],
+    )
+    _local.set(_key(config.pk, session_id), window, ttl=options['LOCAL_TTL'])
+    return window
+
+
+def remember(config, session_id, message, reply, window=None):
+    """Acrescenta a troca à janela da sessão (lida de novo se ``window`` for ``None``)."""
+    if config is None or not is_active(config, session_id):
+        return
+    if window is None:
+        window = load(config, session_id)
+    window = _extended(config, session_id, message, reply, window)
+    cache.set(_key(config.pk, session_id), window, _options()['TTL'])
+
+
+async def aremember(config, session_id, message, reply, window=None):
+    """Versão assíncrona de ``remember``."""
+    if config is None or not is_active(config, session_id):
+        return
+    if window is None:
+        window = await aload(config, session_id)
+    window = _extended(config, session_id, message, reply, window)
+    await cache.aset(_key(config.pk, session_id), window, _options()['TTL'])
+
+
+def extend(config, session_id, message, window, on_reply):
+    """
+    Callback de resposta que também acrescenta a troca à janela ``window``.
+
+    ``on_reply`` é o callback de ``conversation_log.start_exchange``;
+    ``window``, a janela lida com ``load`` e enviada ao webhook.
+    """
+    if not is_active(config, session_id):
+        return on_reply
+
+    def on_complete(reply):
+        remember(config, session_id, message, reply, window)
+        on_reply(reply)
+
+    return on_complete
+
+
+def aextend(config, session_id, message, window, on_reply):
+    """Versão assíncrona de ``extend``: o callback retornado é uma corrotina."""
+
+    async def on_complete(reply):
+        await aremember(config, session_id, message, reply, window)
+        on_reply(reply)
+
+    return on_complete
+
+
+def clear_local_cache():
+    _local.clear()
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .config_cache import invalidate_chatbot_config
+from .embed_cache import invalidate_embed
+from .models import ChatbotConfig, WebhookEndpoint
+
+
+@receiver(post_save, sender=ChatbotConfig)
+@receiver(post_delete, sender=ChatbotConfig)
+def invalidate_cached_chatbot_config(sender, instance, **kwargs):
+    """Descarta o chatbot dos caches sempre que ele é salvo ou excluído."""
+    invalidate_chatbot_config(instance.pk)
+    invalidate_embed(instance.pk)
+
+
+@receiver(post_save, sender=WebhookEndpoint)
+@receiver(post_delete, sender=WebhookEndpoint)
+def invalidate_chatbot_endpoints(sender, instance, **kwargs):
+    """O pool de endpoints vai junto com o chatbot em ``core.config_cache``."""
+    invalidate_chatbot_config(instance.chatbot_id)
@@ -0,0 +1,124 @@
+"""
+Inicialização dos processos web: aquecimento e tempo de cada etapa.
+
+``client_dashboard.asgi`` (e ``wsgi``) importam este módulo antes de tudo,
+medem suas etapas com ``phase`` e terminam com ``finish``, que aquece o que a
+primeira requisição pagaria (URLconf e views, templates, contexto TLS dos
+webhooks) e registra no log o tempo de cada etapa::
+
+    {"message": "Aplicação pronta", "startup_ms": {"django": 212.4, "application": 38.1,
+     "urlconf": 9.6, "templates": 14.2, "http_client": 51.0}, "total_ms": 326.0}
+
+Com ``GUNICORN_PRELOAD=True`` isso acontece uma vez no processo mestre, antes
+do fork, e os workers já nascem prontos (ver ``gunicorn.conf.py``). O
+aquecimento não abre conexões com o banco nem com o cache, que não podem ser
+herdadas pelos workers.
+
+``python manage.py measure_startup`` mede, em processos novos, o tempo até a
+primeira resposta com e sem aquecimento.
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'WARMUP': True,
+    # Templates compilados no aquecimento
+    'TEMPLATES': ['chat_embed.html', 'landing.html', 'chatbot_list.html', 'dashboard.html'],
+}
+
+# Início da inicialização: a importação deste módulo, a primeira do asgi/wsgi
+_started = time.perf_counter()
+_phases = {}
+
+
+def _options():
+    from django.conf import settings
+
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'STARTUP', {}))
+    return options
+
+
+@contextmanager
+def phase(name):
+    """Mede uma etapa da inicialização."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] = (time.perf_counter() - started) * 1000
+
+
+def phases():
+    """``{etapa: ms}`` na ordem em que rodaram."""
+    return {name: round(ms, 1) for name, ms in _phases.items()}
+
+
+def elapsed_ms():
+    return (time.perf_counter() - _started) * 1000
+
+
+def warm_up(templates):
+    from django.template.loader import get_template
+    from django.urls import get_resolver
+
+    from . import embed_cache
+    from .webhook_client import ssl_context
+
+    with phase('urlconf'):
+        # Importa core.urls, as views e tudo o que elas importam
+        get_resolver().url_patterns
+    with phase('templates'):
+        for name in templates:
+            get_template(name)
+        embed_cache._build_version()
+    with phase('http_client'):
+        ssl_context()
+
+
+def finish():
+    """Aquece a aplicação (se ``WARMUP``) e registra o tempo de cada etapa."""
+    options = _options()
+    if options['WARMUP']:
+        warm_up(options['TEMPLATES'])
+    logger.info('Aplicação pronta', extra={'startup_ms': phases(), 'total_ms': round(elapsed_ms(), 1)})
+
+
+async def first_request(application, path):
+    """Envia um GET para ``application`` (ASGI) e retorna o status da resposta."""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('utf-8'),
+        'query_string': b'',
+        'headers': [(b'host', b'localhost')],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    sent = []
+    requested = False
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+        if message['type'] == 'http.response.body' and not message.get('more_body'):
+            done.set()
+
+    await application(scope, receive, send)
+    return next(message['status'] for message in sent if message['type'] == 'http.response.start')
@@ -0,0 +1,236 @@
+"""
+Repasse de respostas em streaming do webhook para o widget.
+
+Quando o webhook responde com ``text/event-stream`` (SSE) ou NDJSON, o proxy
+lê a resposta linha a linha e repassa cada trecho de texto ("token") ao
+navegador assim que ele chega, sem acumular o corpo inteiro.
+
+Para o navegador o formato é sempre NDJSON (``application/x-ndjson``), uma
+linha JSON por evento::
+
+    {"type": "token", "token": "Olá"}
+    {"type": "token", "token": ", tudo bem?"}
+    {"type": "done", "reply": "Olá, tudo bem?"}
+
+Em caso de falha no meio do stream, a última linha é
+``{"type": "error", "error": "...", "reply": "..."}``.
+
+Só recebe o stream o cliente que pedir (``"stream": true`` no corpo ou
+``Accept: application/x-ndjson``); para os demais os tokens são juntados e a
+resposta JSON de sempre é devolvida.
+"""
+import httpx
+from django.http import StreamingHttpResponse
+
+from . import codec
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+SSE_CONTENT_TYPE = 'text/event-stream'
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+# Header Accept enviado ao webhook quando o widget aceita streaming
+STREAM_ACCEPT = f'{SSE_CONTENT_TYPE}, {NDJSON_CONTENT_TYPE}, application/json;q=0.9'
+
+# Campos onde procuramos o texto de cada evento, em ordem de preferência
+TOKEN_FIELDS = ('token', 'delta', 'content', 'text', 'reply', 'mensagem', 'message', 'response')
+
+STREAM_ERROR_REPLY = 'Desculpe, a resposta foi interrompida. Tente novamente.'
+# Resposta de um stream que terminou sem tokens
+EMPTY_REPLY = 'Resposta vazia do webhook.'
+
+
+def client_accepts_stream(request, data):
+    """Indica se o widget pediu a resposta em streaming."""
+    return data.get('stream') is True or NDJSON_CONTENT_TYPE in request.headers.get('Accept', '')
+
+
+def _media_type(response):
+    return response.headers.get('content-type', '').split(';')[0].strip().lower()
+
+
+def is_stream_response(response):
+    """Indica se o webhook respondeu em SSE ou NDJSON."""
+    media_type = _media_type(response)
+    return media_type == SSE_CONTENT_TYPE or media_type in NDJSON_CONTENT_TYPES
+
+
+def extract_token(raw):
+    """Extrai o texto de um evento; eventos sem texto retornam ''."""
+    try:
+        payload = codec.loads(raw)
+    except codec.DecodeError:
+        return raw
+    if isinstance(payload, str):
+        return payload
+    if not isinstance(payload, dict):
+        return ''
+    for field in TOKEN_FIELDS:
+        value = payload.get(field)
+        if isinstance(value, str):
+            return value
+    # Formato estilo OpenAI: {"choices": [{"delta": {"content": "..."}}]}
+    try:
+        value = payload['choices'][0]['delta']['content']
+    except (KeyError, IndexError, TypeError):
+        return ''
+    return value if isinstance(value, str) else ''
+
+
+class _EventParser:
+    """
+    Converte linhas de SSE ou NDJSON em dados de evento.
+
+    ``feed`` recebe uma linha e retorna os dados de um evento completo (ou
+    ``None``); ``finish`` devolve o evento pendente ao fim do stream.
+    """
+
+    def __init__(self, sse):
+        self.sse = sse
+        self.data_lines = []
+        self.done = False
+
+    def feed(self, line):
+        if not self.sse:
+            line = line.strip()
+            return line or None
+        if line == '':
+            return self.finish()
+        if line.startswith('data:'):
+            value = line[5:]
+            self.data_lines.append(value[1:] if value.startswith(' ') else value)
+        # Demais campos SSE (event:, id:, retry:, comentários) não carregam texto
+        return None
+
+    def finish(self):
+        if not self.data_lines:
+            return None
+        data = '\n'.join(self.data_lines)
+        self.data_lines = []
+        if data.strip() == '[DONE]':
+            self.done = True
+            return None
+        return data
+
+
+def _tokens(lines, sse):
+    parser = _EventParser(sse)
+    for line in lines:
+        data = parser.feed(line)
+        if parser.done:
+            return
+        if data is not None:
+            token = extract_token(data)
+            if token:
+                yield token
+    data = parser.finish()
+    if data is not None:
+        token = extract_token(data)
+        if token:
+            yield token
+
+
+async def _atokens(lines, sse):
+    parser = _EventParser(sse)
+    async for line in lines:
+        data = parser.feed(line)
+        if parser.done:
+            return
+        if data is not None:
+            token = extract_token(data)
+            if token:
+                yield token
+    data = parser.finish()
+    if data is not None:
+        token = extract_token(data)
+        if token:
+            yield token
+
+
+def aiter_tokens(webhook_response):
+    """Tokens de texto de uma resposta SSE/NDJSON do webhook (assíncrono)."""
+    return _atokens(webhook_response.aiter_lines(), _media_type(webhook_response) == SSE_CONTENT_TYPE)
+
+
+def _line(event):
+    return codec.dumps(event) + b'\n'
+
+
+def _error_line(exc):
+    return _line({'type': 'error', 'error': f'Stream do webhook interrompido: {exc}', 'reply': STREAM_ERROR_REPLY})
+
+
+def _streaming_response(content):
+    response = StreamingHttpResponse(content, content_type=NDJSON_CONTENT_TYPE)
+    response['Cache-Control'] = 'no-cache'
+    # Impede proxies reversos (nginx) de acumular a resposta
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def relay_stream(webhook_response, on_complete=None):
+    """
+    ``StreamingHttpResponse`` que repassa os tokens do webhook ao widget.
+
+    ``on_complete`` recebe a resposta completa quando o stream termina bem.
+    """
+    sse = _media_type(webhook_response) == SSE_CONTENT_TYPE
+
+    def events():
+        reply = []
+        try:
+            for token in _tokens(webhook_response.iter_lines(), sse):
+                reply.append(token)
+                yield _line({'type': 'token', 'token': token})
+            if on_complete is not None:
+                on_complete(''.join(reply))
+            yield _line({'type': 'done', 'reply': ''.join(reply)})
+        except httpx.HTTPError as exc:
+            yield _error_line(exc)
+        finally:
+            webhook_response.close()
+
+    return _streaming_response(events())
+
+
+def arelay_stream(webhook_response, on_complete=None):
+    """Versão assíncrona de ``relay_stream`` (para as views ASGI); ``on_complete`` é uma corrotina."""
+    sse = _media_type(webhook_response) == SSE_CONTENT_TYPE
+
+    async def events():
+        reply = []
+        try:
+            async for token in _atokens(webhook_response.aiter_lines(), sse):
+                reply.append(token)
+                yield _line({'type': 'token', 'token': token})
+            if on_complete is not None:
+                await on_complete(''.join(reply))
+            yield _line({'type': 'done', 'reply': ''.join(reply)})
+        except httpx.HTTPError as exc:
+            yield _error_line(exc)
+        finally:
+            await webhook_response.aclose()
+
+    return _streaming_response(events())
+
+
+def _collected_response(reply):
+    return codec.FastJsonResponse({'reply': reply, 'status': 'success'}, status=200)
+
+
+def collect_reply(webhook_response, on_complete=None):
+    """Junta os tokens do stream numa resposta JSON comum (widget sem streaming)."""
+    sse = _media_type(webhook_response) == SSE_CONTENT_TYPE
+    reply = ''.join(_tokens(webhook_response.iter_lines(), sse)) or EMPTY_REPLY
+    if on_complete is not None:
+        on_complete(reply)
+    return _collected_response(reply)
+
+
+async def acollect_reply(webhook_response, on_complete=None):
+    """Versão assíncrona de ``collect_reply``; ``on_complete`` é uma corrotina."""
+    sse = _media_type(webhook_response) == SSE_CONTENT_TYPE
+    reply = ''.join([token async for token in _atokens(webhook_response.aiter_lines(), sse)]) or EMPTY_REPLY
+    if on_complete is not None:
+        await on_complete(reply)
+    return _collected_response(reply)
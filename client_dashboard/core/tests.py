@@ -1,3 +1,2178 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import async_views, balancer, circuit_breaker, codec, conversation_log, delivery_queue, embed_cache, export, health, idempotency, metrics, proxy, ratelimit, replicas, reply_cache, session_context, startup, streaming, usage, webhook_retry, websocket
+from .benchmark import StubWebhookServer, percentile, run_benchmark, run_pipeline_benchmark
+from .config_cache import clear_local_cache, get_chatbot_config
+from .models import ChatbotConfig, Conversation, DeliveryJob, Message, UsageRollup, WebhookEndpoint
+from .webhook_client import WebhookTransportManager, ssl_context, webhook_transport
+
+
+def mock_webhook(handler):
+    """Faz o transporte global de webhooks (sync e async) responder com ``handler``."""
+    webhook_transport.close()
+    return mock.patch.object(
+        webhook_transport,
+        '_client_kwargs',
+        lambda: {'transport': httpx.MockTransport(handler)},
+    )
+
+
+class ChatTestCase(TestCase):
+    def setUp(self):
+        webhook_transport.close()
+        cache.clear()
+        clear_local_cache()
+        reply_cache.clear_local_cache()
+        session_context.clear_local_cache()
+        # Sem thread de fundo nos testes: as conversas são gravadas com flush()
+        worker = mock.patch.object(conversation_log.log_buffer, '_ensure_worker')
+        worker.start()
+        self.addCleanup(worker.stop)
+        conversation_log.log_buffer._pending.clear()
+        usage_worker = mock.patch.object(usage.usage_buffer, '_ensure_worker')
+        usage_worker.start()
+        self.addCleanup(usage_worker.stop)
+        usage.usage_buffer._pending.clear()
+        publisher = mock.patch.object(metrics.registry, 'ensure_publisher')
+        publisher.start()
+        self.addCleanup(publisher.stop)
+        metrics.registry.reset_after_fork()
+        balancer.reset()
+        self.user = User.objects.create_user('cliente', password='senha-segura-123')
+        self.chatbot = ChatbotConfig.objects.create(
+            user=self.user,
+            name='Atendimento',
+            webhook_url='https://hooks.example.com/chat',
+        )
+
+    def tearDown(self):
+        webhook_transport.close()
+
+    def post_proxy(self, message='Olá', **extra):
+        payload = {'chatbot_id': str(self.chatbot.id), 'message': message}
+        payload.update(extra)
+        return self.client.post('/api/v1/chat/', json.dumps(payload), content_type='application/json')
+
+    def post_legacy(self, message='Olá'):
+        return self.client.post(
+            '/api/chat/',
+            json.dumps({'message': message}),
+            content_type='application/json',
+            headers={'X-Client-ID': str(self.chatbot.id)},
+        )
+
+    def blocking_cache_guard(self, *methods):
+        """Falha se ``cache.set`` (ou ``methods``) for chamado direto no event loop."""
+        stack = contextlib.ExitStack()
+        for name in methods or ('set',):
+            stack.enter_context(mock.patch.object(cache, name, self._guarded(name, getattr(cache, name))))
+        return stack
+
+    @staticmethod
+    def _guarded(name, method):
+        def guarded(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return method(*args, **kwargs)
+            raise AssertionError(f'cache.{name} síncrono no event loop')
+
+        return guarded
+
+
+class WebhookTransportManagerTests(TestCase):
+    def setUp(self):
+        self.manager = WebhookTransportManager()
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_reuses_client_per_host(self):
+        first = self.manager.get_client('https://a.example.com/hook')
+        self.assertIs(first, self.manager.get_client('https://a.example.com/other'))
+        self.assertIsNot(first, self.manager.get_client('https://b.example.com/hook'))
+
+    def test_discards_clients_inherited_from_parent_process(self):
+        client = self.manager.get_client('https://a.example.com/hook')
+        with mock.patch('core.webhook_client.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(client, self.manager.get_client('https://a.example.com/hook'))
+        client.close()
+
+    def test_applies_pool_limits_from_options(self):
+        manager = WebhookTransportManager({'MAX_KEEPALIVE_CONNECTIONS': 3, 'KEEPALIVE_EXPIRY': 5.0})
+        pool = manager.get_client('https://a.example.com/hook')._transport._pool
+        self.assertEqual(pool._max_keepalive_connections, 3)
+        self.assertEqual(pool._keepalive_expiry, 5.0)
+        manager.close()
+
+
+class ChatProxyTransportTests(ChatTestCase):
+    def test_proxy_and_legacy_share_the_pooled_client(self):
+        hosts = []
+
+        def handler(request):
+            hosts.append(request.url.host)
+            return httpx.Response(200, json={'reply': 'Oi!'})
+
+        with mock_webhook(handler), mock.patch.object(
+            webhook_transport, '_build_client', wraps=webhook_transport._build_client
+        ) as build:
+            self.assertEqual(self.post_proxy().json()['reply'], 'Oi!')
+            self.assertEqual(self.post_legacy().json()['reply'], 'Oi!')
+            self.assertEqual(self.post_proxy().json()['reply'], 'Oi!')
+        self.assertEqual(hosts, ['hooks.example.com'] * 3)
+        self.assertEqual(build.call_count, 1)
+
+    def test_legacy_endpoint_falls_back_on_connection_error(self):
+        def handler(request):
+            raise httpx.ConnectError('recusado')
+
+        with mock_webhook(handler):
+            response = self.post_legacy()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('não consegui me conectar', response.json()['reply'])
+
+
+class AsyncChatProxyTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+
+    async def test_async_proxy_normalizes_reply(self):
+        def handler(request):
+            return httpx.Response(200, json={'mensagem': 'Olá do webhook'})
+
+        request = self.factory.post(
+            '/api/v1/chat/',
+            json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi'}),
+            content_type='application/json',
+        )
+        with mock_webhook(handler):
+            response = await async_views.chat_proxy_api_async_view(request)
+            await webhook_transport.aclose()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['reply'], 'Olá do webhook')
+
+    async def test_async_proxy_maps_timeout_to_408(self):
+        def handler(request):
+            raise httpx.ReadTimeout('lento')
+
+        request = self.factory.post(
+            '/api/v1/chat/',
+            json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi'}),
+            content_type='application/json',
+        )
+        with mock_webhook(handler):
+            response = await async_views.chat_proxy_api_async_view(request)
+            await webhook_transport.aclose()
+        self.assertEqual(response.status_code, 408)
+
+    async def test_async_legacy_returns_404_for_unknown_chatbot(self):
+        request = self.factory.post(
+            '/api/chat/',
+            json.dumps({'message': 'Oi'}),
+            content_type='application/json',
+            headers={'X-Client-ID': '00000000-0000-0000-0000-000000000000'},
+        )
+        response = await async_views.chat_api_async(request)
+        self.assertEqual(response.status_code, 404)
+
+
+class ChatbotConfigCacheTests(ChatTestCase):
+    def test_hot_path_skips_database_after_first_lookup(self):
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi!'})):
+            self.post_proxy()
+            with self.assertNumQueries(0):
+                self.post_proxy()
+                self.post_legacy()
+                self.client.get(f'/embed/{self.chatbot.id}/')
+
+    def test_shared_cache_serves_other_processes(self):
+        get_chatbot_config(self.chatbot.id)
+        clear_local_cache()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_chatbot_config(self.chatbot.id).name, 'Atendimento')
+
+    def test_unknown_and_malformed_ids_are_cached_as_missing(self):
+        unknown = '00000000-0000-0000-0000-000000000000'
+        self.assertIsNone(get_chatbot_config(unknown))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_chatbot_config(unknown))
+            self.assertIsNone(get_chatbot_config('nao-e-um-uuid'))
+            self.assertEqual(self.post_proxy(chatbot_id='nao-e-um-uuid').status_code, 404)
+
+    def test_dashboard_ajax_update_invalidates_cache(self):
+        get_chatbot_config(self.chatbot.id)
+        self.client.force_login(self.user)
+        self.client.post(
+            f'/chatbots/{self.chatbot.id}/dashboard/',
+            {'primary_color': '#FF0000'},
+            headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+        self.assertEqual(get_chatbot_config(self.chatbot.id).primary_color, '#FF0000')
+
+    def test_delete_invalidates_cache(self):
+        get_chatbot_config(self.chatbot.id)
+        self.chatbot.delete()
+        self.assertIsNone(get_chatbot_config(self.chatbot.id))
+
+
+SSE_BODY = (
+    b'data: {"token": "Ol\xc3\xa1"}\n\n'
+    b'event: ping\n\n'
+    b'data: {"choices": [{"delta": {"content": ", tudo bem?"}}]}\n\n'
+    b'data: [DONE]\n\n'
+)
+
+
+def stream_lines(response):
+    return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+
+class StreamingProxyTests(ChatTestCase):
+    def test_relays_sse_tokens_as_ndjson(self):
+        accept = []
+
+        def handler(request):
+            accept.append(request.headers.get('accept', ''))
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=SSE_BODY)
+
+        with mock_webhook(handler):
+            response = self.post_proxy(stream=True)
+            events = stream_lines(response)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('text/event-stream', accept[0])
+        self.assertEqual(events, [
+            {'type': 'token', 'token': 'Olá'},
+            {'type': 'token', 'token': ', tudo bem?'},
+            {'type': 'done', 'reply': 'Olá, tudo bem?'},
+        ])
+
+    def test_joins_ndjson_stream_for_clients_without_streaming(self):
+        body = b'{"delta": "Bom "}\n{"delta": "dia"}\n'
+
+        def handler(request):
+            return httpx.Response(200, headers={'content-type': 'application/x-ndjson'}, content=body)
+
+        with mock_webhook(handler):
+            response = self.post_proxy()
+        self.assertEqual(response.json()['reply'], 'Bom dia')
+
+    def test_non_streaming_webhook_still_returns_json(self):
+        with mock_webhook(lambda request: httpx.Response(200, json={'response': 'Oi'})):
+            response = self.post_proxy(stream=True)
+        self.assertEqual(response.json()['reply'], 'Oi')
+
+    def test_streaming_webhook_http_error_uses_fallback(self):
+        def handler(request):
+            return httpx.Response(500, headers={'content-type': 'text/event-stream'}, content=b'')
+
+        with mock_webhook(handler):
+            response = self.post_proxy(stream=True)
+        self.assertEqual(response.status_code, 502)
+
+    async def test_async_view_relays_stream(self):
+        def handler(request):
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=SSE_BODY)
+
+        request = AsyncRequestFactory().post(
+            '/api/v1/chat/',
+            json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi', 'stream': True}),
+            content_type='application/json',
+        )
+        with mock_webhook(handler):
+            response = await async_views.chat_proxy_api_async_view(request)
+            chunks = [chunk async for chunk in response.streaming_content]
+            await webhook_transport.aclose()
+        self.assertEqual(json.loads(chunks[-1]), {'type': 'done', 'reply': 'Olá, tudo bem?'})
+
+
+class CircuitBreakerTests(ChatTestCase):
+    def test_opens_after_failures_and_fails_fast(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            raise httpx.ConnectError('recusado')
+
+        with mock_webhook(handler):
+            for _ in range(5):
+                self.assertEqual(self.post_proxy().status_code, 503)
+            response = self.post_proxy()
+            legacy = self.post_legacy()
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('circuito aberto', response.json()['error'])
+        self.assertTrue(int(response['Retry-After']) > 0)
+        self.assertIn('reply', legacy.json())
+        self.assertEqual(circuit_breaker.get_status(self.chatbot.webhook_url)['state'], circuit_breaker.OPEN)
+
+    def test_half_open_probe_closes_circuit_on_success(self):
+        with mock_webhook(lambda request: httpx.Response(500)):
+            for _ in range(5):
+                self.post_proxy()
+        self.assertFalse(circuit_breaker.allow_request(self.chatbot.webhook_url))
+
+        later = time.time() + 31
+        with mock.patch('core.circuit_breaker.time.time', return_value=later):
+            self.assertEqual(circuit_breaker.get_status(self.chatbot.webhook_url)['state'], circuit_breaker.HALF_OPEN)
+            with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Voltei'})):
+                self.assertEqual(self.post_proxy().json()['reply'], 'Voltei')
+            self.assertEqual(circuit_breaker.get_status(self.chatbot.webhook_url)['state'], circuit_breaker.CLOSED)
+
+    def test_only_one_probe_while_half_open(self):
+        for _ in range(5):
+            circuit_breaker.record_failure(self.chatbot.webhook_url)
+        with mock.patch('core.circuit_breaker.time.time', return_value=time.time() + 31):
+            self.assertTrue(circuit_breaker.allow_request(self.chatbot.webhook_url))
+            self.assertFalse(circuit_breaker.allow_request(self.chatbot.webhook_url))
+            circuit_breaker.record_failure(self.chatbot.webhook_url)
+            self.assertFalse(circuit_breaker.allow_request(self.chatbot.webhook_url))
+
+    def test_client_errors_do_not_open_circuit(self):
+        with mock_webhook(lambda request: httpx.Response(404)):
+            for _ in range(6):
+                self.assertEqual(self.post_proxy().status_code, 502)
+        self.assertEqual(circuit_breaker.get_status(self.chatbot.webhook_url)['state'], circuit_breaker.CLOSED)
+
+    def test_dashboard_shows_circuit_state(self):
+        for _ in range(5):
+            circuit_breaker.record_failure(self.chatbot.webhook_url)
+        self.client.force_login(self.user)
+        response = self.client.get(f'/chatbots/{self.chatbot.id}/dashboard/')
+        self.assertContains(response, 'Circuito aberto')
+
+
+class RateLimitTests(ChatTestCase):
+    def ok_webhook(self):
+        return mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'}))
+
+    def test_per_ip_limit_returns_429_with_retry_after(self):
+        ChatbotConfig.objects.filter(pk=self.chatbot.pk).update(rate_limit_per_ip_per_minute=2)
+        clear_local_cache()
+        cache.clear()
+        with self.ok_webhook():
+            self.assertEqual(self.post_proxy().status_code, 200)
+            self.assertEqual(self.post_legacy().status_code, 200)
+            response = self.post_proxy()
+            other_visitor = self.client.post(
+                '/api/v1/chat/',
+                json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi'}),
+                content_type='application/json',
+                REMOTE_ADDR='10.0.0.2',
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response['Retry-After']) >= 1)
+        self.assertEqual(other_visitor.status_code, 200)
+
+    def test_per_chatbot_limit_spans_visitors(self):
+        self.chatbot.rate_limit_per_minute = 1
+        self.chatbot.save()
+        with self.ok_webhook():
+            self.post_proxy()
+            response = self.client.post(
+                '/api/v1/chat/',
+                json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi'}),
+                content_type='application/json',
+                REMOTE_ADDR='10.0.0.2',
+            )
+        self.assertEqual(response.status_code, 429)
+
+    def test_flooding_visitor_does_not_exhaust_chatbot_limit(self):
+        self.chatbot.rate_limit_per_minute = 5
+        self.chatbot.rate_limit_per_ip_per_minute = 2
+        self.chatbot.save()
+        with self.ok_webhook():
+            statuses = [self.post_proxy().status_code for _ in range(10)]
+            other_visitor = self.client.post(
+                '/api/v1/chat/',
+                json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi'}),
+                content_type='application/json',
+                REMOTE_ADDR='10.0.0.2',
+            )
+        self.assertEqual(statuses.count(200), 2)
+        self.assertEqual(other_visitor.status_code, 200)
+
+    def test_inflight_counter_ttl_is_refreshed(self):
+        self.chatbot.max_concurrent_requests = 5
+        self.chatbot.save()
+        config = get_chatbot_config(self.chatbot.id)
+        with mock.patch.object(ratelimit.cache, 'touch', wraps=ratelimit.cache.touch) as touch:
+            ratelimit.acquire_slot(config)
+            ratelimit.acquire_slot(config)
+        self.assertEqual(touch.call_count, 2)
+        touch.assert_called_with(f'ratelimit:inflight:{config.pk}', ratelimit._options()['CONCURRENCY_TTL'])
+
+    def test_zero_disables_limits(self):
+        self.chatbot.rate_limit_per_minute = 0
+        self.chatbot.rate_limit_per_ip_per_minute = 0
+        self.chatbot.save()
+        with self.ok_webhook():
+            for _ in range(30):
+                self.assertEqual(self.post_proxy().status_code, 200)
+
+    def test_concurrency_cap(self):
+        self.chatbot.max_concurrent_requests = 1
+        self.chatbot.save()
+        config = get_chatbot_config(self.chatbot.id)
+        slot = ratelimit.acquire_slot(config)
+        self.assertIsNotNone(slot)
+        self.assertIsNone(ratelimit.acquire_slot(config))
+        with self.ok_webhook():
+            self.assertEqual(self.post_proxy().status_code, 429)
+        slot.release()
+        slot.release()
+        with self.ok_webhook():
+            self.assertEqual(self.post_proxy().status_code, 200)
+        self.assertIsNotNone(ratelimit.acquire_slot(config))
+
+    async def test_async_view_releases_slot_off_the_loop(self):
+        await ChatbotConfig.objects.filter(pk=self.chatbot.pk).aupdate(max_concurrent_requests=1)
+        factory = AsyncRequestFactory()
+
+        def request():
+            return factory.post(
+                '/api/v1/chat/',
+                json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Olá'}),
+                content_type='application/json',
+            )
+
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'})), \
+                self.blocking_cache_guard('set', 'decr'):
+            for _ in range(2):
+                response = await async_views.chat_proxy_api_async_view(request())
+                self.assertEqual(response.status_code, 200)
+            await webhook_transport.aclose()
+
+    def test_streaming_reply_holds_slot_until_stream_ends(self):
+        self.chatbot.max_concurrent_requests = 1
+        self.chatbot.save()
+
+        def handler(request):
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=SSE_BODY)
+
+        with mock_webhook(handler):
+            response = self.post_proxy(stream=True)
+            self.assertEqual(self.post_proxy().status_code, 429)
+            stream_lines(response)
+            self.assertEqual(self.post_proxy().status_code, 200)
+
+    def test_client_ip_uses_trusted_proxy_hop(self):
+        request = mock.Mock(META={'HTTP_X_FORWARDED_FOR': '1.1.1.1, 2.2.2.2', 'REMOTE_ADDR': '10.0.0.1'})
+        self.assertEqual(ratelimit.client_ip(request), '10.0.0.1')
+        with self.settings(RATE_LIMIT={'TRUSTED_PROXY_COUNT': 1}):
+            self.assertEqual(ratelimit.client_ip(request), '2.2.2.2')
+
+
+class ConversationLogTests(ChatTestCase):
+    def ok_webhook(self):
+        return mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi!'}))
+
+    def test_messages_are_written_only_on_flush(self):
+        with self.ok_webhook():
+            self.post_proxy('Olá', session_id='sessao-1')
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual(conversation_log.flush(), 2)
+        conversation = Conversation.objects.get(chatbot=self.chatbot, session_id='sessao-1')
+        self.assertEqual(
+            list(conversation.messages.values_list('role', 'content')),
+            [(Message.ROLE_USER, 'Olá'), (Message.ROLE_BOT, 'Oi!')],
+        )
+
+    def test_batch_groups_messages_by_session(self):
+        with self.ok_webhook():
+            self.post_proxy('Primeira', session_id='sessao-1')
+            conversation_log.flush()
+            first = Conversation.objects.get(session_id='sessao-1').last_message_at
+            self.post_proxy('Segunda', session_id='sessao-1')
+            self.post_proxy('Outra', session_id='sessao-2')
+        with self.assertNumQueries(7):
+            self.assertEqual(conversation_log.flush(), 4)
+        self.assertEqual(Conversation.objects.count(), 2)
+        conversation = Conversation.objects.get(session_id='sessao-1')
+        self.assertEqual(conversation.messages.count(), 4)
+        self.assertGreater(conversation.last_message_at, first)
+
+    def test_requests_without_session_are_not_logged(self):
+        with self.ok_webhook():
+            self.post_proxy('Olá')
+            self.post_legacy('Olá')
+        self.assertEqual(conversation_log.flush(), 0)
+
+    def test_streamed_reply_is_logged(self):
+        def handler(request):
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=SSE_BODY)
+
+        with mock_webhook(handler):
+            stream_lines(self.post_proxy(stream=True, session_id='sessao-1'))
+        conversation_log.flush()
+        self.assertEqual(Message.objects.get(role=Message.ROLE_BOT).content, 'Olá, tudo bem?')
+
+    def test_messages_of_deleted_chatbot_are_dropped(self):
+        conversation_log.record(self.chatbot.pk, 'sessao-1', Message.ROLE_USER, 'Olá')
+        self.chatbot.delete()
+        self.assertEqual(conversation_log.flush(), 1)
+        self.assertFalse(Message.objects.exists())
+
+
+class SessionContextTests(ChatTestCase):
+    def echo_webhook(self, payloads):
+        def handler(request):
+            payload = json.loads(request.content)
+            payloads.append(payload)
+            return httpx.Response(200, json={'reply': f"Resposta {payload['message']}"})
+
+        return mock_webhook(handler)
+
+    def test_previous_turns_are_sent_to_webhook(self):
+        payloads = []
+        with self.echo_webhook(payloads):
+            self.post_proxy('1', session_id='sessao-1')
+            self.post_proxy('2', session_id='sessao-1')
+            self.post_proxy('Outra', session_id='sessao-2')
+            self.post_proxy('Sem sessão')
+        self.assertEqual(payloads[0]['context'], [])
+        self.assertEqual(payloads[1]['session_id'], 'sessao-1')
+        self.assertEqual(payloads[1]['context'], [
+            {'role': Message.ROLE_USER, 'content': '1'},
+            {'role': Message.ROLE_BOT, 'content': 'Resposta 1'},
+        ])
+        self.assertEqual(payloads[2]['context'], [])
+        self.assertNotIn('context', payloads[3])
+        self.assertNotIn('session_id', payloads[3])
+
+    def test_window_is_bounded_by_turns_and_size(self):
+        self.chatbot.context_turns = 2
+        self.chatbot.save()
+        payloads = []
+        with self.echo_webhook(payloads):
+            for message in ('1', '2', '3', '4'):
+                self.post_proxy(message, session_id='sessao-1')
+        self.assertEqual([item['content'] for item in payloads[-1]['context']], ['2', 'Resposta 2', '3', 'Resposta 3'])
+
+        payloads.clear()
+        with override_settings(SESSION_CONTEXT={'MAX_MESSAGE_CHARS': 5, 'MAX_CHARS': 20}), self.echo_webhook(payloads):
+            self.post_proxy('x' * 50, session_id='sessao-2')
+            self.post_proxy('y' * 50, session_id='sessao-2')
+            self.post_proxy('z', session_id='sessao-2')
+        # Cada troca ocupa 10 caracteres: só as duas últimas cabem
+        self.assertEqual(payloads[1]['context'][0]['content'], 'xxxxx')
+        self.assertEqual(sum(len(item['content']) for item in payloads[2]['context']), 20)
+
+    def test_window_survives_worker_restart_without_queries(self):
+        with self.echo_webhook([]):
+            self.post_proxy('1', session_id='sessao-1')
+        session_context.clear_local_cache()
+        config = get_chatbot_config(self.chatbot.pk)
+        with self.assertNumQueries(0):
+            window = session_context.load(config, 'sessao-1')
+        self.assertEqual(window, ((Message.ROLE_USER, '1'), (Message.ROLE_BOT, 'Resposta 1')))
+
+        self.chatbot.context_turns = 0
+        self.chatbot.save()
+        payloads = []
+        with self.echo_webhook(payloads):
+            self.post_proxy('2', session_id='sessao-1')
+        self.assertEqual(payloads[0]['context'], [])
+
+    def test_queued_and_cached_replies_extend_window(self):
+        self.chatbot.reply_cache_enabled = True
+        self.chatbot.save()
+        payloads = []
+        with self.echo_webhook(payloads):
+            self.post_proxy('1', session_id='sessao-1')
+            self.assertEqual(self.post_proxy('1', session_id='sessao-2')[reply_cache.HEADER], 'HIT')
+
+            self.chatbot.delivery_mode = ChatbotConfig.DELIVERY_QUEUE
+            self.chatbot.save()
+            self.assertEqual(self.post_proxy('2', session_id='sessao-2').status_code, 202)
+            delivery_queue.process_next()
+        self.assertEqual(len(payloads[1]['context']), 2)
+        config = get_chatbot_config(self.chatbot.pk)
+        self.assertEqual([content for _, content in session_context.load(config, 'sessao-2')], ['1', 'Resposta 1', '2', 'Resposta 2'])
+
+    def test_reply_cache_is_keyed_by_context(self):
+        self.chatbot.reply_cache_enabled = True
+        self.chatbot.save()
+        payloads = []
+        with self.echo_webhook(payloads):
+            self.post_proxy('Frete?', session_id='sessao-1')
+            self.post_proxy('Frete?', session_id='sessao-2')
+            self.post_proxy('E para o Rio?', session_id='sessao-1')
+            second = self.post_proxy('E para o Rio?', session_id='sessao-2')
+            self.post_proxy('Oi', session_id='sessao-3')
+            other = self.post_proxy('E para o Rio?', session_id='sessao-3')
+        # Mesmo histórico: a segunda sessão recebe do cache
+        self.assertEqual(second[reply_cache.HEADER], 'HIT')
+        self.assertFalse(other.has_header(reply_cache.HEADER))
+        self.assertEqual([payload['message'] for payload in payloads], ['Frete?', 'E para o Rio?', 'Oi', 'E para o Rio?'])
+        self.assertEqual(payloads[-1]['context'][0], {'role': Message.ROLE_USER, 'content': 'Oi'})
+
+    async def test_async_view_sends_context(self):
+        payloads = []
+        factory = AsyncRequestFactory()
+        with self.echo_webhook(payloads), self.blocking_cache_guard():
+            for message in ('1', '2'):
+                request = factory.post(
+                    '/api/v1/chat/',
+                    json.dumps({'chatbot_id': str(self.chatbot.id), 'message': message, 'session_id': 'sessao-1'}),
+                    content_type='application/json',
+                )
+                response = await async_views.chat_proxy_api_async_view(request)
+                self.assertEqual(response.status_code, 200)
+            await webhook_transport.aclose()
+        self.assertEqual(payloads[1]['context'][1], {'role': Message.ROLE_BOT, 'content': 'Resposta 1'})
+
+
+class BenchmarkTests(ChatTestCase):
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_run_against_stub_webhook(self):
+        with StubWebhookServer(error_rate=0.0) as stub:
+            self.chatbot.webhook_url = stub.url
+            self.chatbot.rate_limit_per_ip_per_minute = 0
+            self.chatbot.save()
+            # Com o chatbot já no cache o caminho quente não deve tocar o banco
+            get_chatbot_config(self.chatbot.id)
+            result = run_benchmark('proxy', [self.chatbot.id], requests=20, concurrency=2)
+        self.assertEqual(result.statuses, {200: 20})
+        self.assertEqual(len(result.latencies), 20)
+        self.assertEqual(result.queries_per_request, 0)
+
+    def test_pipeline_benchmark_reports_every_codec(self):
+        results = run_pipeline_benchmark(iterations=5)
+        self.assertEqual(set(results), {'reply', 'mensagem'})
+        for variants in results.values():
+            self.assertEqual(set(variants), {'anterior', *(f'pipeline ({name})' for name in codec.CODECS)})
+
+
+class JsonPipelineTests(ChatTestCase):
+    def test_reply_body_is_passed_through_unchanged(self):
+        body = b'{"reply": "Ol\\u00e1!", "sources": [1, 2.50]}'
+        with mock_webhook(lambda request: httpx.Response(200, content=body, headers={'Content-Type': 'application/json'})):
+            response = self.post_proxy()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, body)
+
+    def test_reply_is_normalized_from_known_fields(self):
+        with mock_webhook(lambda request: httpx.Response(200, json={'mensagem': 'Olá!'})):
+            response = self.post_proxy()
+        self.assertEqual(response.json(), {'mensagem': 'Olá!', 'reply': 'Olá!'})
+
+    def test_plain_text_reply_is_wrapped(self):
+        with mock_webhook(lambda request: httpx.Response(200, text='Olá!')):
+            response = self.post_proxy()
+        self.assertEqual(response.json(), {'reply': 'Olá!', 'status': 'success'})
+
+    def test_legacy_body_is_passed_through_unchanged(self):
+        body = b'{"reply":"Oi!","extra":null}'
+        with mock_webhook(lambda request: httpx.Response(200, content=body)):
+            response = self.post_legacy()
+        self.assertEqual(response.content, body)
+
+    def test_request_body_must_be_an_object(self):
+        response = self.client.post('/api/v1/chat/', '["Olá"]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_oversized_request_body_is_rejected(self):
+        with override_settings(CHAT_PROXY={'MAX_REQUEST_BYTES': 64}):
+            response = self.post_proxy('x' * 100)
+        self.assertEqual(response.status_code, 413)
+
+    def test_oversized_webhook_body_is_a_bad_gateway(self):
+        with override_settings(CHAT_PROXY={'MAX_WEBHOOK_BYTES': 64}):
+            with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'x' * 100})):
+                response = self.post_proxy()
+        self.assertEqual(response.status_code, 502)
+        self.assertIn('reply', response.json())
+
+    def test_codec_can_be_forced(self):
+        with override_settings(JSON_CODEC='json'):
+            self.assertIs(codec.get_codec(), codec.StdlibCodec)
+            self.assertEqual(codec.loads(codec.dumps({'a': 'é'})), {'a': 'é'})
+        with override_settings(JSON_CODEC='inexistente'):
+            with self.assertRaises(ValueError):
+                codec.get_codec()
+
+    async def test_async_view_uses_the_same_pipeline(self):
+        body = b'{"reply":"Oi!","n":1}'
+        request = AsyncRequestFactory().post(
+            '/api/v1/chat/',
+            json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Olá'}),
+            content_type='application/json',
+        )
+        with mock_webhook(lambda request: httpx.Response(200, content=body)):
+            response = await async_views.chat_proxy_api_async_view(request)
+            await webhook_transport.aclose()
+        self.assertEqual(response.content, body)
+
+
+class UsageTests(ChatTestCase):
+    def rollup(self, period):
+        return UsageRollup.objects.get(chatbot=self.chatbot, period=period)
+
+    def test_flush_rolls_up_minute_hour_and_day(self):
+        usage.record(self.chatbot.id, 200, 0.1)
+        usage.record(self.chatbot.id, 502, 0.3)
+        usage.record(self.chatbot.id, 429, 0.001)
+        self.assertEqual(UsageRollup.objects.count(), 0)
+        usage.flush()
+        for period in (UsageRollup.PERIOD_MINUTE, UsageRollup.PERIOD_HOUR, UsageRollup.PERIOD_DAY):
+            rollup = self.rollup(period)
+            self.assertEqual((rollup.requests, rollup.errors, rollup.rate_limited), (3, 1, 1))
+            self.assertAlmostEqual(rollup.latency_max_ms, 300.0)
+        self.assertAlmostEqual(self.rollup(UsageRollup.PERIOD_HOUR).latency_avg_ms, 401 / 3)
+
+    def test_later_flushes_increment_the_same_buckets(self):
+        usage.record(self.chatbot.id, 200, 0.5)
+        usage.flush()
+        usage.record(self.chatbot.id, 200, 0.1)
+        usage.flush()
+        rollup = self.rollup(UsageRollup.PERIOD_DAY)
+        self.assertEqual(rollup.requests, 2)
+        self.assertAlmostEqual(rollup.latency_max_ms, 500.0)
+
+    def test_deleted_chatbots_are_dropped(self):
+        usage.record('00000000-0000-0000-0000-000000000000', 200, 0.1)
+        usage.flush()
+        self.assertEqual(UsageRollup.objects.count(), 0)
+
+    def test_chat_requests_are_counted_by_status(self):
+        responses = iter([httpx.Response(200, json={'reply': 'Oi'}), httpx.Response(500)])
+        with mock_webhook(lambda request: next(responses)):
+            self.post_proxy()
+            self.post_proxy()
+        self.client.post('/api/v1/chat/', json.dumps({'chatbot_id': str(self.chatbot.id)}), content_type='application/json')
+        usage.flush()
+        rollup = self.rollup(UsageRollup.PERIOD_MINUTE)
+        self.assertEqual((rollup.requests, rollup.errors), (2, 1))
+
+    def test_dashboard_panel_reads_only_rollups(self):
+        now = timezone.now()
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        UsageRollup.objects.bulk_create([
+            UsageRollup(chatbot=self.chatbot, period=UsageRollup.PERIOD_MINUTE, bucket_start=hour,
+                        requests=4, errors=1, latency_total_ms=400, latency_max_ms=150),
+            UsageRollup(chatbot=self.chatbot, period=UsageRollup.PERIOD_HOUR, bucket_start=hour,
+                        requests=10, errors=1, latency_total_ms=1000, latency_max_ms=150),
+            UsageRollup(chatbot=self.chatbot, period=UsageRollup.PERIOD_HOUR, bucket_start=hour - timedelta(days=2),
+                        requests=99),
+            UsageRollup(chatbot=self.chatbot, period=UsageRollup.PERIOD_DAY, bucket_start=hour - timedelta(days=2),
+                        requests=109, errors=1),
+        ])
+        self.client.force_login(self.user)
+        response = self.client.get(f'/chatbots/{self.chatbot.id}/dashboard/')
+        summary = response.context['usage']
+        self.assertEqual(summary['last_day'].requests, 10)
+        self.assertEqual(summary['last_day'].error_rate, 10.0)
+        self.assertEqual(summary['last_day'].latency_avg_ms, 100.0)
+        self.assertEqual(summary['last_month'].requests, 109)
+        self.assertEqual(summary['hourly'][-1], {'start': hour, 'requests': 10, 'height': 100})
+        self.assertContains(response, 'Uso do Chatbot')
+
+    def test_compaction_keeps_coarser_buckets(self):
+        now = timezone.now()
+        old = now - timedelta(days=10)
+        for period in (UsageRollup.PERIOD_MINUTE, UsageRollup.PERIOD_HOUR, UsageRollup.PERIOD_DAY):
+            UsageRollup.objects.create(chatbot=self.chatbot, period=period, bucket_start=old, requests=1)
+        UsageRollup.objects.create(chatbot=self.chatbot, period=UsageRollup.PERIOD_MINUTE, bucket_start=now, requests=1)
+        self.assertEqual(usage.compact(now=now, dry_run=True)[UsageRollup.PERIOD_MINUTE], 1)
+        self.assertEqual(UsageRollup.objects.count(), 4)
+        deleted = usage.compact(now=now, batch_size=1)
+        self.assertEqual(deleted, {'minute': 1, 'hour': 0, 'day': 0})
+        self.assertEqual(
+            sorted(UsageRollup.objects.values_list('period', flat=True)),
+            ['day', 'hour', 'minute'],
+        )
+
+
+class ExportTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        conversation = Conversation.objects.create(chatbot=self.chatbot, session_id='sessao-1')
+        day = timezone.now().replace(year=2024, month=5, day=1, hour=12)
+        self.messages = Message.objects.bulk_create([
+            Message(
+                conversation=conversation,
+                chatbot=self.chatbot,
+                role=Message.ROLE_USER if index % 2 == 0 else Message.ROLE_BOT,
+                content=f'Mensagem {index}, com "aspas"',
+                created_at=day + timedelta(days=index),
+            )
+            for index in range(6)
+        ])
+        self.client.force_login(self.user)
+
+    def url(self, **params):
+        query = '&'.join(f'{name}={value}' for name, value in params.items())
+        return f'/chatbots/{self.chatbot.id}/export/?{query}'
+
+    def test_csv_is_streamed_as_attachment(self):
+        response = self.client.get(self.url())
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn(f'conversas-{self.chatbot.id}.csv', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,session_id,role,content,created_at')
+        self.assertEqual(len(lines), 7)
+        self.assertIn('"Mensagem 0, com ""aspas"""', lines[1])
+
+    def test_ndjson_resumes_after_cursor_and_filters_dates(self):
+        response = self.client.get(self.url(format='ndjson', after=self.messages[1].id, until='2024-05-05'))
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([record['id'] for record in records], [message.id for message in self.messages[2:5]])
+        self.assertEqual(records[0]['session_id'], 'sessao-1')
+
+        response = self.client.get(self.url(format='ndjson', since='2024-05-05T00:00:00'))
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+
+    def test_gzip_output(self):
+        plain = b''.join(self.client.get(self.url(format='ndjson')).streaming_content)
+        response = self.client.get(self.url(format='ndjson', gzip=1))
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+
+    def test_output_is_sent_in_blocks(self):
+        with override_settings(EXPORT={'CHUNK_SIZE': 2, 'BUFFER_BYTES': 100}):
+            blocks = list(self.client.get(self.url()).streaming_content)
+        self.assertGreater(len(blocks), 2)
+        self.assertTrue(all(len(block) < 200 for block in blocks))
+
+    def test_invalid_parameters(self):
+        for params in ({'format': 'xml'}, {'after': 'abc'}, {'since': 'ontem'}, {'since': '2024-05-03', 'until': '2024-05-01'}):
+            self.assertEqual(self.client.get(self.url(**params)).status_code, 400)
+
+    def test_only_the_owner_can_export(self):
+        other = User.objects.create_user('outro', password='senha-segura-123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url()).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url()).status_code, 302)
+
+    async def test_asgi_export_is_an_async_stream(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url(format='ndjson'))
+        self.assertTrue(response.is_async)
+        content = b''.join([block async for block in response.streaming_content])
+        self.assertEqual(len(content.splitlines()), 6)
+
+    def test_management_command_writes_file(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'historico.csv')
+        call_command('export_conversations', str(self.chatbot.id), '--output', path, stdout=open(os.devnull, 'w'))
+        with open(path, encoding='utf-8') as exported:
+            self.assertEqual(len(exported.read().splitlines()), 7)
+
+
+class HealthCheckTests(ChatTestCase):
+    async def run_checks(self, handler):
+        with mock_webhook(handler):
+            results = await health.check_all()
+            await webhook_transport.aclose()
+        return results
+
+    async def test_probes_each_url_once_and_records_profile(self):
+        await ChatbotConfig.objects.acreate(user=self.user, name='Outro', webhook_url=self.chatbot.webhook_url)
+        await ChatbotConfig.objects.acreate(user=self.user, name='Sem webhook', webhook_url='')
+        probes = []
+
+        def handler(request):
+            probes.append(request)
+            return httpx.Response(404)
+
+        results = await self.run_checks(handler)
+        self.assertEqual(list(results), [self.chatbot.webhook_url])
+        self.assertEqual(len(probes), 1)
+        self.assertEqual(probes[0].headers[health.HEADER], '1')
+        self.assertEqual(json.loads(probes[0].content)['type'], 'health_check')
+        async for chatbot in ChatbotConfig.objects.filter(webhook_url=self.chatbot.webhook_url):
+            self.assertEqual(chatbot.health_availability, 1.0)
+            self.assertIsNotNone(chatbot.health_latency_p99_ms)
+            self.assertIsNotNone(chatbot.health_checked_at)
+
+    def test_profile_percentiles_and_failing_streak(self):
+        samples = [float(value) for value in range(1, 101)] + [None] * 3
+        fields = health.profile(samples)
+        self.assertEqual(fields['health_latency_p50_ms'], 50)
+        self.assertEqual(fields['health_latency_p99_ms'], 99)
+        self.assertAlmostEqual(fields['health_availability'], 100 / 103)
+        self.assertTrue(fields['health_failing'])
+        self.assertFalse(health.profile([None, None, 10.0])['health_failing'])
+
+    async def test_dead_webhook_has_its_circuit_opened_until_it_answers(self):
+        def down(request):
+            raise httpx.ConnectError('recusada')
+
+        for _ in range(3):
+            self.assertIsNone((await self.run_checks(down))[self.chatbot.webhook_url])
+        self.assertTrue(await circuit_breaker.ais_open(self.chatbot.webhook_url))
+        chatbot = await ChatbotConfig.objects.aget(pk=self.chatbot.pk)
+        self.assertTrue(chatbot.health_failing)
+        self.assertEqual(chatbot.health_availability, 0.0)
+
+        await self.run_checks(lambda request: httpx.Response(200))
+        self.assertFalse(await circuit_breaker.ais_open(self.chatbot.webhook_url))
+
+    def test_health_update_keeps_embed_and_reply_cache_keys(self):
+        updated_at = self.chatbot.updated_at
+        health.record_probe(self.chatbot.webhook_url, 120.0)
+        self.chatbot.refresh_from_db()
+        self.assertEqual(self.chatbot.updated_at, updated_at)
+        self.assertEqual(get_chatbot_config(self.chatbot.id).health_latency_p50_ms, 120)
+
+    def test_proxy_shortens_connect_timeout_from_profile(self):
+        timeouts = []
+
+        def handler(request):
+            timeouts.append(request.extensions['timeout']['connect'])
+            return httpx.Response(200, json={'reply': 'Oi'})
+
+        with mock_webhook(handler):
+            self.post_proxy()
+            health.record_probe(self.chatbot.webhook_url, 200.0)
+            self.post_proxy()
+            ChatbotConfig.objects.filter(pk=self.chatbot.pk).update(health_checked_at=timezone.now() - timedelta(hours=1))
+            clear_local_cache()
+            cache.clear()
+            self.post_proxy()
+        self.assertEqual(timeouts[0], 5.0)
+        self.assertAlmostEqual(timeouts[1], 1.0)
+        self.assertEqual(timeouts[2], 5.0)
+
+    def test_once_command_reports_each_webhook(self):
+        results = {'https://a.example.com/': 12.3, 'https://b.example.com/': None}
+        stdout = io.StringIO()
+        with mock.patch.object(health, 'check_all', mock.AsyncMock(return_value=results)):
+            call_command('run_health_checker', '--once', stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'https://a.example.com/: 12 ms',
+            'https://b.example.com/: sem resposta',
+        ])
+
+
+class QueryCountTests(ChatTestCase):
+    """Páginas do dashboard e do admin com número de queries fixo, qualquer que seja o número de chatbots."""
+
+    def add_tenant_data(self, count):
+        for index in range(count):
+            owner = User.objects.create_user(f'cliente-{ChatbotConfig.objects.count()}')
+            for user in (self.user, owner):
+                chatbot = ChatbotConfig.objects.create(user=user, name=f'Bot {index}')
+                conversation = Conversation.objects.create(chatbot=chatbot, session_id=f'sessao-{index}')
+                Message.objects.create(conversation=conversation, chatbot=chatbot, role=Message.ROLE_USER, content='Olá')
+                DeliveryJob.objects.create(chatbot=chatbot, payload={'message': 'Olá'})
+                UsageRollup.objects.create(chatbot=chatbot, period=UsageRollup.PERIOD_DAY, bucket_start=timezone.now())
+
+    def assertConstantQueries(self, url):
+        with CaptureQueriesContext(connection) as baseline:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_tenant_data(12)
+        with self.assertNumQueries(len(baseline)):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_chatbot_list(self):
+        self.client.force_login(self.user)
+        self.assertConstantQueries('/chatbots/')
+        response = self.client.get('/chatbots/')
+        self.assertEqual(len(response.context['chatbots']), 13)
+        self.assertContains(response, 'Bot 11')
+
+    def test_dashboard(self):
+        self.client.force_login(self.user)
+        self.assertConstantQueries(f'/chatbots/{self.chatbot.id}/dashboard/')
+
+    def test_admin_changelists(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'senha-segura-123'))
+        self.add_tenant_data(1)
+        for model in ('chatbotconfig', 'conversation', 'message', 'deliveryjob', 'usagerollup'):
+            with self.subTest(model=model):
+                self.assertConstantQueries(f'/admin/core/{model}/')
+
+    def test_live_save_updates_only_posted_field(self):
+        self.client.force_login(self.user)
+        updated_at = self.chatbot.updated_at
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                f'/chatbots/{self.chatbot.id}/dashboard/',
+                {'primary_color': '#112233'},
+                headers={'X-Requested-With': 'XMLHttpRequest'},
+            )
+        self.assertTrue(response.json()['success'])
+        [update] = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertIn('"primary_color"', update)
+        self.assertIn('"updated_at"', update)
+        self.assertNotIn('"welcome_message"', update)
+        self.chatbot.refresh_from_db()
+        self.assertEqual(self.chatbot.primary_color, '#112233')
+        self.assertGreater(self.chatbot.updated_at, updated_at)
+
+    def test_delete_without_count_query(self):
+        self.client.force_login(self.user)
+        delete_url = f'/chatbots/{self.chatbot.id}/delete/'
+        self.client.post(delete_url)
+        self.assertTrue(ChatbotConfig.objects.filter(pk=self.chatbot.pk).exists())
+
+        self.add_tenant_data(1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertRedirects(self.client.post(delete_url), '/chatbots/', fetch_redirect_response=False)
+        self.assertFalse(ChatbotConfig.objects.filter(pk=self.chatbot.pk).exists())
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+        other = ChatbotConfig.objects.exclude(user=self.user).first()
+        self.assertEqual(self.client.post(f'/chatbots/{other.id}/delete/').status_code, 404)
+
+
+class LiveSettingsTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.url = f'/chatbots/{self.chatbot.id}/settings/'
+
+    def patch(self, version, changes):
+        return self.client.patch(
+            self.url, json.dumps({'version': version, 'changes': changes}), content_type='application/json'
+        )
+
+    def test_batch_is_one_conditional_update(self):
+        version = self.chatbot.settings_version
+        updated_at = self.chatbot.updated_at
+        get_chatbot_config(self.chatbot.id)
+        # Sessão, usuário e o UPDATE
+        with self.assertNumQueries(3):
+            response = self.patch(version, {'primary_color': '#112233', 'welcome_message': 'Oi!'})
+        self.assertEqual(response.json(), {'success': True, 'version': version + 1})
+        self.chatbot.refresh_from_db()
+        self.assertEqual((self.chatbot.primary_color, self.chatbot.welcome_message), ('#112233', 'Oi!'))
+        self.assertEqual(self.chatbot.settings_version, version + 1)
+        self.assertGreater(self.chatbot.updated_at, updated_at)
+        # Sem os sinais de post_save, os caches são invalidados pelo próprio módulo
+        self.assertEqual(get_chatbot_config(self.chatbot.id).primary_color, '#112233')
+
+    def test_stale_version_is_rejected(self):
+        version = self.chatbot.settings_version
+        self.assertEqual(self.patch(version, {'primary_color': '#112233'}).status_code, 200)
+        response = self.patch(version, {'primary_color': '#445566'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], version + 1)
+        self.assertEqual(response.json()['values']['primary_color'], '#112233')
+        self.chatbot.refresh_from_db()
+        self.assertEqual(self.chatbot.primary_color, '#112233')
+
+    def test_orm_saves_bump_version(self):
+        version = self.chatbot.settings_version
+        self.chatbot.name = 'Vendas'
+        self.chatbot.save()
+        self.client.post(
+            f'/chatbots/{self.chatbot.id}/dashboard/',
+            {'welcome_message': 'Oi'},
+            headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+        self.chatbot.refresh_from_db()
+        self.assertEqual(self.chatbot.settings_version, version + 2)
+        self.assertEqual(self.patch(version, {'primary_color': '#112233'}).status_code, 409)
+
+    def test_invalid_changes(self):
+        version = self.chatbot.settings_version
+        for changes in (
+            {},
+            {'name': 'Outro'},
+            {'primary_color': 'vermelho'},
+            {'webhook_url': 'nao-e-url'},
+            {'welcome_message': 'x' * 300},
+            {'welcome_message': 1},
+        ):
+            with self.subTest(changes=changes):
+                self.assertEqual(self.patch(version, changes).status_code, 400)
+        self.assertEqual(self.patch('1', {'primary_color': '#112233'}).status_code, 400)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+        self.chatbot.refresh_from_db()
+        self.assertEqual(self.chatbot.settings_version, version)
+
+    def test_other_users_chatbot(self):
+        self.client.force_login(User.objects.create_user('outro', password='senha-segura-123'))
+        response = self.patch(self.chatbot.settings_version, {'primary_color': '#112233'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_dashboard_renders_version(self):
+        response = self.client.get(f'/chatbots/{self.chatbot.id}/dashboard/')
+        self.assertContains(response, f'data-settings-version="{self.chatbot.settings_version}"')
+        self.assertContains(response, 'data-debounce-ms="800"')
+
+
+@override_settings(METRICS={'TOKEN': 'segredo'})
+class MetricsTests(ChatTestCase):
+    def scrape(self):
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer segredo'})
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_chat_request_is_measured(self):
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'})):
+            self.post_proxy()
+        body = self.scrape()
+        self.assertIn(
+            'chat_http_requests_total{method="POST",status="200",view="chat_proxy_api"} 1', body
+        )
+        self.assertIn('chat_webhook_duration_seconds_count{view="chat_proxy_api"} 1', body)
+        self.assertIn('chat_proxy_overhead_seconds_count{view="chat_proxy_api"} 1', body)
+        self.assertIn(f'chat_chatbot_responses_total{{chatbot_id="{self.chatbot.id}",status="200"}} 1', body)
+        # Primeira mensagem: o chatbot (e seus endpoints adicionais) ainda não estava no cache
+        self.assertIn('chat_db_queries_total{view="chat_proxy_api"} 2', body)
+
+    def test_sums_snapshots_of_other_workers(self):
+        other = metrics.MetricsRegistry()
+        other.inc('chat_http_requests_total', {'view': 'chat_api', 'method': 'POST', 'status': '200'}, 3)
+        cache.set('metrics:worker:outro-host:1', other.snapshot())
+        cache.set(metrics.WORKERS_KEY, ['metrics:worker:outro-host:1', 'metrics:worker:morto:2'])
+        metrics.registry.inc('chat_http_requests_total', {'view': 'chat_api', 'method': 'POST', 'status': '200'}, 2)
+
+        counters, _ = metrics.collect()
+        key = ('chat_http_requests_total', (('method', 'POST'), ('status', '200'), ('view', 'chat_api')))
+        self.assertEqual(counters[key], 5)
+        # O worker sem snapshot publicado sai da lista
+        self.assertNotIn('metrics:worker:morto:2', cache.get(metrics.WORKERS_KEY))
+
+    def test_token_protects_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer outro'}).status_code, 403)
+        self.scrape()
+
+    def test_endpoint_is_closed_without_token(self):
+        with self.settings(METRICS={'TOKEN': ''}):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+class EmbedCacheTests(ChatTestCase):
+    def embed_url(self):
+        return f'/embed/{self.chatbot.id}/'
+
+    def test_conditional_get_returns_304_without_rendering(self):
+        response = self.client.get(self.embed_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+
+        with mock.patch.object(embed_cache, 'render_to_string') as render:
+            response = self.client.get(self.embed_url(), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        render.assert_not_called()
+
+    def test_rendered_html_is_cached_until_saved(self):
+        self.client.get(self.embed_url())
+        with mock.patch.object(embed_cache, 'render_to_string') as render:
+            self.assertContains(self.client.get(self.embed_url()), 'Olá! Como posso ajudar?')
+        render.assert_not_called()
+
+        old_etag = self.client.get(self.embed_url())['ETag']
+        self.chatbot.welcome_message = 'Seja bem vindo'
+        self.chatbot.save()
+        response = self.client.get(self.embed_url(), headers={'If-None-Match': old_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Seja bem vindo')
+        self.assertNotEqual(response['ETag'], old_etag)
+
+    def test_preview_overrides_bypass_cache(self):
+        etag = self.client.get(self.embed_url())['ETag']
+        response = self.client.get(
+            self.embed_url(), {'primary_color': '#FF0000'}, headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '#FF0000')
+        self.assertNotIn('ETag', response)
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertNotContains(self.client.get(self.embed_url()), '#FF0000')
+
+
+class DeliveryQueueTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chatbot.delivery_mode = ChatbotConfig.DELIVERY_QUEUE
+        self.chatbot.save()
+
+    def poll(self, response, wait=0):
+        return self.client.get(response.json()['poll_url'], {'wait': wait}).json()
+
+    def test_message_is_queued_without_calling_webhook(self):
+        calls = []
+        with mock_webhook(lambda request: calls.append(request) or httpx.Response(200, json={'reply': 'Oi'})):
+            response = self.post_proxy('Olá', session_id='sessao-1')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(calls, [])
+        self.assertEqual(self.poll(response)['status'], DeliveryJob.STATUS_QUEUED)
+
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'})):
+            self.assertTrue(delivery_queue.process_next())
+        self.assertFalse(delivery_queue.process_next())
+        self.assertEqual(self.poll(response), {
+            'job_id': response.json()['job_id'], 'status': DeliveryJob.STATUS_DONE, 'reply': 'Oi',
+        })
+        conversation_log.flush()
+        self.assertEqual(Message.objects.filter(role=Message.ROLE_BOT).get().content, 'Oi')
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        response = self.post_proxy()
+        job = DeliveryJob.objects.get()
+        with mock_webhook(lambda request: httpx.Response(503)), self.assertLogs('core.delivery_queue', 'INFO'):
+            delivery_queue.process_next()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (DeliveryJob.STATUS_QUEUED, 1))
+        self.assertGreater(job.available_at, job.updated_at)
+        # Ainda aguardando o backoff: nenhum job disponível
+        self.assertFalse(delivery_queue.process_next())
+
+        DeliveryJob.objects.update(available_at=job.created_at)
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Voltei'})):
+            delivery_queue.process_next()
+        self.assertEqual(self.poll(response)['reply'], 'Voltei')
+
+    def test_gives_up_after_max_attempts_or_client_error(self):
+        response = self.post_proxy()
+        with mock_webhook(lambda request: httpx.Response(404)), self.assertLogs('core.delivery_queue') as logs:
+            delivery_queue.process_next()
+        self.assertEqual(logs.records[0].error, 'Webhook respondeu HTTP 404')
+        result = self.poll(response)
+        self.assertEqual(result['status'], DeliveryJob.STATUS_FAILED)
+        self.assertEqual(result['reply'], delivery_queue.FAILED_REPLY)
+
+        with self.settings(DELIVERY_QUEUE={'MAX_ATTEMPTS': 1}):
+            response = self.post_proxy()
+            with mock_webhook(lambda request: httpx.Response(500)), self.assertLogs('core.delivery_queue'):
+                delivery_queue.process_next()
+        self.assertEqual(self.poll(response)['status'], DeliveryJob.STATUS_FAILED)
+
+    def test_oversized_webhook_body_fails_without_retry(self):
+        response = self.post_proxy()
+        with self.settings(CHAT_PROXY={'MAX_WEBHOOK_BYTES': 64}), self.assertLogs('core.delivery_queue') as logs:
+            with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'x' * 200})):
+                delivery_queue.process_next()
+        self.assertIn('excede 64 bytes', logs.records[0].error)
+        self.assertEqual(DeliveryJob.objects.get().attempts, 1)
+        self.assertEqual(self.poll(response)['status'], DeliveryJob.STATUS_FAILED)
+
+    def test_legacy_endpoint_always_calls_webhook(self):
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'})):
+            response = self.post_legacy()
+        self.assertEqual(response.json()['reply'], 'Oi')
+        self.assertFalse(DeliveryJob.objects.exists())
+
+    def test_expired_lease_is_claimed_again(self):
+        self.post_proxy()
+        backend = delivery_queue.DatabaseBackend()
+        job = backend.claim()
+        self.assertIsNone(backend.claim())
+        DeliveryJob.objects.update(locked_until=job.created_at)
+        self.assertEqual(backend.claim().attempts, 2)
+
+    def test_in_process_backend_long_poll(self):
+        with self.settings(DELIVERY_QUEUE={'BACKEND': 'inprocess'}):
+            # As threads de entrega não enxergam a transação do teste
+            get_chatbot_config(self.chatbot.id)
+            with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'})):
+                response = self.post_proxy()
+                result = self.poll(response, wait=5)
+        self.assertEqual(result['status'], DeliveryJob.STATUS_DONE)
+        self.assertFalse(DeliveryJob.objects.exists())
+
+    async def test_async_views_enqueue_and_poll(self):
+        factory = AsyncRequestFactory()
+        request = factory.post(
+            '/api/v1/chat/',
+            json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi'}),
+            content_type='application/json',
+        )
+        response = await async_views.chat_proxy_api_async_view(request)
+        self.assertEqual(response.status_code, 202)
+        job_id = json.loads(response.content)['job_id']
+
+        poll = factory.get(f'/api/v1/chat/jobs/{job_id}/', {'wait': 0})
+        response = await async_views.chat_job_result_async_view(poll, job_id)
+        self.assertEqual(json.loads(response.content)['status'], DeliveryJob.STATUS_QUEUED)
+
+    def test_unknown_job_returns_404(self):
+        response = self.client.get('/api/v1/chat/jobs/00000000-0000-0000-0000-000000000000/', {'wait': 0})
+        self.assertEqual(response.status_code, 404)
+
+
+class WebhookRetryTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(webhook_retry, 'backoff', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def configure(self, **fields):
+        ChatbotConfig.objects.filter(pk=self.chatbot.pk).update(**fields)
+        cache.clear()
+        clear_local_cache()
+
+    def test_retries_connection_errors_with_the_same_idempotency_key(self):
+        keys = []
+
+        def handler(request):
+            keys.append(request.headers['Idempotency-Key'])
+            if len(keys) == 1:
+                raise httpx.ConnectError('recusado')
+            return httpx.Response(200, json={'reply': 'Oi'})
+
+        with mock_webhook(handler):
+            response = self.post_proxy()
+        self.assertEqual(response.json()['reply'], 'Oi')
+        self.assertEqual(response['X-Webhook-Attempts'], '2')
+        self.assertIn('webhook-2;dur=', response['Server-Timing'])
+        self.assertEqual(len(set(keys)), 1)
+
+    def test_does_not_retry_when_the_webhook_may_have_processed_the_message(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(500)
+
+        with mock_webhook(handler):
+            response = self.post_proxy()
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(response['X-Webhook-Attempts'], '1')
+
+    def test_ambiguous_failures_are_retried_only_when_enabled(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) % 2:
+                return httpx.Response(502)
+            raise httpx.RemoteProtocolError('Server disconnected without sending a response.')
+
+        with mock_webhook(handler):
+            self.assertEqual(self.post_proxy().status_code, 502)
+            self.assertEqual(len(calls), 1)
+            with self.settings(WEBHOOK_RETRY={'RETRY_AMBIGUOUS': True}):
+                response = self.post_proxy()
+        self.assertEqual(response['X-Webhook-Attempts'], '2')
+        self.assertEqual(len(calls), 3)
+
+    def test_stops_at_max_attempts(self):
+        self.configure(webhook_max_attempts=3)
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503)
+
+        with mock_webhook(handler):
+            response = self.post_proxy()
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(calls), 3)
+
+    def test_skips_retry_that_does_not_fit_the_deadline(self):
+        self.configure(webhook_timeout=1, webhook_max_attempts=5)
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            raise httpx.ConnectError('recusado')
+
+        with mock_webhook(handler), mock.patch.object(webhook_retry, 'backoff', return_value=5):
+            self.assertEqual(self.post_proxy().status_code, 503)
+        self.assertEqual(len(calls), 1)
+
+    def test_legacy_endpoint_retries_within_its_deadline(self):
+        self.configure(webhook_timeout=60)
+        calls = []
+
+        def handler(request):
+            calls.append(request.extensions['timeout']['read'])
+            if len(calls) == 1:
+                return httpx.Response(503)
+            return httpx.Response(200, json={'reply': 'Oi'})
+
+        with mock_webhook(handler):
+            response = self.post_legacy()
+        self.assertEqual(response.json()['reply'], 'Oi')
+        self.assertEqual(response['X-Webhook-Attempts'], '2')
+        self.assertLessEqual(calls[0], proxy.LEGACY_TIMEOUT)
+
+    def test_hedged_request_wins_over_slow_first_call(self):
+        self.configure(hedge_after_ms=50)
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return httpx.Response(200, json={'reply': 'Lenta'})
+            return httpx.Response(200, json={'reply': 'Rápida'})
+
+        with mock_webhook(handler):
+            response = self.post_proxy()
+        self.assertEqual(response.json()['reply'], 'Rápida')
+        self.assertEqual(response['X-Webhook-Hedged'], '1')
+        self.assertEqual(response['X-Webhook-Attempts'], '2')
+
+    def test_trace_is_safe_across_hedge_threads(self):
+        trace = webhook_retry.WebhookTrace()
+
+        def attempt():
+            for _ in range(1000):
+                trace.begin_attempt()
+                trace.record(time.perf_counter())
+
+        threads = [threading.Thread(target=attempt) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(trace.attempts, 4000)
+        self.assertEqual(len(trace.timings), 4000)
+
+    def test_fast_webhook_is_not_hedged(self):
+        self.configure(hedge_after_ms=1000)
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'})):
+            response = self.post_proxy()
+        self.assertEqual(response['X-Webhook-Attempts'], '1')
+        self.assertFalse(response.has_header('X-Webhook-Hedged'))
+
+    async def test_async_hedged_request_cancels_the_slow_call(self):
+        await ChatbotConfig.objects.filter(pk=self.chatbot.pk).aupdate(hedge_after_ms=50)
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                await asyncio.sleep(5)
+            return httpx.Response(200, json={'reply': f'Chamada {len(calls)}'})
+
+        request = AsyncRequestFactory().post(
+            '/api/v1/chat/',
+            json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi'}),
+            content_type='application/json',
+        )
+        started = time.monotonic()
+        with mock_webhook(handler):
+            response = await async_views.chat_proxy_api_async_view(request)
+            await webhook_transport.aclose()
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(json.loads(response.content)['reply'], 'Chamada 2')
+        self.assertEqual(response['X-Webhook-Hedged'], '1')
+
+
+class BalancerTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(webhook_retry, 'backoff', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.replica = WebhookEndpoint.objects.create(chatbot=self.chatbot, url='https://replica.example.com/chat')
+
+    def record(self, url, latency_ms, failed=False):
+        balancer.start(url)
+        balancer.finish(url, time.perf_counter() - latency_ms / 1000, failed)
+
+    def test_choice_follows_weights(self):
+        pool = [balancer.Target('https://a.example.com/', 1), balancer.Target('https://b.example.com/', 1000)]
+        chosen = [balancer.choose(pool).url for _ in range(200)]
+        self.assertGreater(chosen.count('https://b.example.com/'), 180)
+
+    def test_prefers_the_faster_endpoint(self):
+        pool = balancer.targets(get_chatbot_config(self.chatbot.id))
+        self.record(self.chatbot.webhook_url, 500)
+        self.record(self.replica.url, 20)
+        self.assertEqual({balancer.choose(pool).url for _ in range(20)}, {self.replica.url})
+        with override_settings(WEBHOOK_BALANCER={'ALGORITHM': 'least_outstanding'}):
+            balancer.start(self.replica.url)
+            self.assertEqual({balancer.choose(pool).url for _ in range(20)}, {self.chatbot.webhook_url})
+
+    @override_settings(WEBHOOK_BALANCER={'EJECT_AFTER': 2, 'EJECT_SECONDS': 10})
+    def test_ejects_an_endpoint_after_consecutive_failures(self):
+        pool = balancer.targets(get_chatbot_config(self.chatbot.id))
+        self.record(self.replica.url, 5, failed=True)
+        self.assertEqual(balancer.endpoint_stats(self.replica.url)['ejected_for'], 0)
+        self.record(self.replica.url, 5, failed=True)
+        self.assertEqual(balancer.endpoint_stats(self.replica.url)['ejected_for'], 10)
+        self.assertEqual({balancer.choose(pool).url for _ in range(20)}, {self.chatbot.webhook_url})
+        # Todos ejetados: o sorteio volta a considerar todos
+        self.record(self.chatbot.webhook_url, 5, failed=True)
+        self.record(self.chatbot.webhook_url, 5, failed=True)
+        self.assertIn(balancer.choose(pool).url, {self.chatbot.webhook_url, self.replica.url})
+
+    def test_fails_over_to_another_endpoint_without_spending_attempts(self):
+        ChatbotConfig.objects.filter(pk=self.chatbot.pk).update(webhook_max_attempts=1)
+        cache.clear()
+        clear_local_cache()
+        calls = []
+
+        def handler(request):
+            calls.append(str(request.url))
+            if len(calls) == 1:
+                raise httpx.ConnectError('recusado')
+            return httpx.Response(200, json={'reply': 'Oi'})
+
+        with mock_webhook(handler):
+            response = self.post_proxy()
+        self.assertEqual(response.json()['reply'], 'Oi')
+        self.assertEqual(set(calls), {self.chatbot.webhook_url, self.replica.url})
+        self.assertEqual(balancer.endpoint_stats(calls[0])['failures'], 1)
+        self.assertEqual(balancer.endpoint_stats(calls[1])['requests'], 1)
+
+    def test_open_circuits_are_left_out_of_the_pool(self):
+        circuit_breaker.trip(self.chatbot.webhook_url)
+        config = get_chatbot_config(self.chatbot.id)
+        self.assertEqual([target.url for target in balancer.available(config)], [self.replica.url])
+        calls = []
+
+        def handler(request):
+            calls.append(str(request.url))
+            return httpx.Response(200, json={'reply': 'Oi'})
+
+        with mock_webhook(handler):
+            self.assertEqual(self.post_proxy().status_code, 200)
+            circuit_breaker.trip(self.replica.url)
+            self.assertEqual(self.post_proxy().status_code, 503)
+        self.assertEqual(calls, [self.replica.url])
+
+    def test_endpoints_are_cached_with_the_config(self):
+        get_chatbot_config(self.chatbot.id)
+        with self.assertNumQueries(0):
+            pool = balancer.targets(get_chatbot_config(self.chatbot.id))
+        self.assertEqual([target.url for target in pool], [self.chatbot.webhook_url, self.replica.url])
+        self.replica.enabled = False
+        self.replica.save()
+        self.assertEqual(len(balancer.targets(get_chatbot_config(self.chatbot.id))), 1)
+
+    def test_health_checker_probes_endpoints(self):
+        self.assertEqual(health.webhook_urls(), [self.chatbot.webhook_url, self.replica.url])
+        health.record_probe(self.replica.url, 80.0)
+        self.replica.refresh_from_db()
+        self.assertEqual(self.replica.health_latency_p50_ms, 80)
+        endpoint = get_chatbot_config(self.chatbot.id).active_webhook_endpoints()[0]
+        self.assertEqual(endpoint.health_latency_p50_ms, 80)
+
+    def test_dashboard_lists_endpoints_with_stats(self):
+        self.client.force_login(self.user)
+        self.record(self.replica.url, 42)
+        response = self.client.get(f'/chatbots/{self.chatbot.id}/dashboard/')
+        self.assertContains(response, 'id="webhook-endpoints"')
+        self.assertContains(response, self.replica.url)
+        self.assertContains(response, '1 chamadas · 42 ms')
+        self.assertEqual([row['share'] for row in response.context['endpoints']], [50.0, 50.0])
+
+    def test_add_and_remove_endpoints(self):
+        self.client.force_login(self.user)
+        url = f'/chatbots/{self.chatbot.id}/endpoints/'
+        response = self.client.post(url, {'url': 'https://third.example.com/chat', 'weight': 50})
+        self.assertRedirects(response, f'/chatbots/{self.chatbot.id}/dashboard/')
+        self.assertEqual(self.chatbot.webhook_endpoints.get(url='https://third.example.com/chat').weight, 50)
+
+        self.client.post(url, {'url': self.chatbot.webhook_url, 'weight': 100})
+        self.client.post(url, {'url': 'https://x.example.com/', 'weight': 0})
+        with override_settings(WEBHOOK_BALANCER={'MAX_ENDPOINTS': 2}):
+            self.client.post(url, {'url': 'https://fourth.example.com/chat', 'weight': 100})
+        self.assertEqual(self.chatbot.webhook_endpoints.count(), 2)
+
+        endpoint = self.chatbot.webhook_endpoints.get(url='https://third.example.com/chat')
+        self.client.post(f'/chatbots/{self.chatbot.id}/endpoints/{endpoint.id}/delete/')
+        self.assertFalse(WebhookEndpoint.objects.filter(pk=endpoint.pk).exists())
+
+        other = User.objects.create_user('outro', password='senha-segura-123')
+        self.client.force_login(other)
+        response = self.client.post(f'/chatbots/{self.chatbot.id}/endpoints/{self.replica.id}/delete/')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(url, {'url': 'https://other.example.com/chat', 'weight': 100})
+        self.assertEqual(response.status_code, 404)
+
+
+REPLICA_SETTINGS = {
+    'DATABASE_ROUTERS': ['core.replicas.ReplicaRouter'],
+    'DATABASE_REPLICAS': {'ALIASES': ['replica1', 'replica2'], 'HEALTH_INTERVAL': 5.0, 'STICKY_SECONDS': 15},
+}
+
+
+@override_settings(**REPLICA_SETTINGS)
+class ReplicaTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        replicas.reset()
+        self.router = replicas.ReplicaRouter()
+
+    def spy_reads(self):
+        # Os aliases não existem nos testes: a "réplica" escolhida é o próprio banco
+        patcher = mock.patch.object(replicas, 'read_alias', return_value='default')
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_only_marked_reads_go_to_replicas_in_rotation(self):
+        with mock.patch.object(replicas, '_probe', return_value=True):
+            self.assertIsNone(self.router.db_for_read(ChatbotConfig))
+            with replicas.replica_reads():
+                chosen = {self.router.db_for_read(ChatbotConfig) for _ in range(4)}
+                with replicas.primary():
+                    self.assertEqual(self.router.db_for_read(ChatbotConfig), 'default')
+        self.assertEqual(chosen, {'replica1', 'replica2'})
+        replica_instance = ChatbotConfig(pk=self.chatbot.pk)
+        replica_instance._state.db = 'replica1'
+        self.assertEqual(self.router.db_for_write(ChatbotConfig, instance=replica_instance), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'core'))
+        self.assertTrue(self.router.allow_migrate('default', 'core'))
+
+    def test_unhealthy_replicas_leave_the_rotation_until_the_next_check(self):
+        probe = mock.Mock(side_effect=lambda alias: alias == 'replica2')
+        with mock.patch.object(replicas, '_probe', probe), mock.patch.object(replicas.time, 'monotonic', return_value=100.0):
+            self.assertEqual({replicas.read_alias() for _ in range(4)}, {'replica2'})
+            self.assertEqual(probe.call_count, 2)
+            probe.side_effect = lambda alias: False
+            self.assertEqual(replicas.read_alias(), 'replica2')
+        with mock.patch.object(replicas, '_probe', probe), mock.patch.object(replicas.time, 'monotonic', return_value=106.0):
+            self.assertEqual(replicas.read_alias(), 'default')
+
+    def test_chat_and_embed_read_from_replicas(self):
+        read_alias = self.spy_reads()
+        # O chatbot acabou de ser criado (setUp) e seria lido do primário
+        cache.clear()
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'})):
+            self.assertEqual(self.post_proxy().status_code, 200)
+        self.assertEqual(read_alias.call_count, 2)  # chatbot e endpoints (prefetch)
+        clear_local_cache()
+        cache.clear()
+        self.assertEqual(self.client.get(f'/embed/{self.chatbot.id}/').status_code, 200)
+        self.assertEqual(read_alias.call_count, 4)
+        # O dashboard não usa réplicas
+        self.client.force_login(self.user)
+        read_alias.reset_mock()
+        self.client.get(f'/chatbots/{self.chatbot.id}/dashboard/')
+        read_alias.assert_not_called()
+
+    def test_changed_chatbot_is_read_from_the_primary(self):
+        read_alias = self.spy_reads()
+        self.chatbot.welcome_message = 'Nova mensagem'
+        self.chatbot.save()
+        self.assertContains(self.client.get(f'/embed/{self.chatbot.id}/'), 'Nova mensagem')
+        read_alias.assert_not_called()
+        # O perfil de saúde não prende o chatbot no primário
+        cache.clear()
+        clear_local_cache()
+        health.record_probe(self.chatbot.webhook_url, 50.0)
+        self.client.get(f'/embed/{self.chatbot.id}/')
+        self.assertTrue(read_alias.called)
+
+    def test_writes_by_a_logged_in_user_pin_the_browser_to_the_primary(self):
+        read_alias = self.spy_reads()
+        self.client.force_login(self.user)
+        response = self.client.patch(
+            f'/chatbots/{self.chatbot.id}/settings/',
+            json.dumps({'version': self.chatbot.settings_version, 'changes': {'welcome_message': 'Oi!'}}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'], 15)
+        cache.clear()
+        clear_local_cache()
+        self.assertContains(self.client.get(f'/embed/{self.chatbot.id}/'), 'Oi!')
+        read_alias.assert_not_called()
+
+        # Visitantes anônimos não recebem o cookie
+        cache.clear()
+        clear_local_cache()
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'})):
+            response = self.client_class().post(
+                '/api/v1/chat/',
+                json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Olá'}),
+                content_type='application/json',
+            )
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+        self.assertTrue(read_alias.called)
+
+
+class StartupTests(ChatTestCase):
+    def test_webhook_clients_share_one_tls_context(self):
+        manager = WebhookTransportManager()
+        self.assertIsInstance(ssl_context(), ssl.SSLContext)
+        self.assertIs(manager._client_kwargs()['verify'], ssl_context())
+        self.assertIs(WebhookTransportManager()._client_kwargs()['verify'], ssl_context())
+
+    def test_warm_up_records_phases_without_touching_the_database(self):
+        with self.assertNumQueries(0):
+            startup.warm_up(startup.DEFAULT_OPTIONS['TEMPLATES'])
+        self.assertTrue({'urlconf', 'templates', 'http_client'} <= set(startup.phases()))
+
+    async def test_first_request_helper_serves_through_the_asgi_app(self):
+        from django.core.asgi import get_asgi_application
+
+        self.assertEqual(await startup.first_request(get_asgi_application(), '/'), 200)
+
+
+class ReplyCacheTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chatbot.reply_cache_enabled = True
+        self.chatbot.save()
+        self.calls = []
+
+    def handler(self, response):
+        def handler(request):
+            self.calls.append(request)
+            return response
+        return handler
+
+    def test_normalizes_case_accents_and_whitespace(self):
+        self.assertEqual(
+            reply_cache.normalize_message('  Horário de   FUNCIONAMENTO? '),
+            reply_cache.normalize_message('horario de funcionamento?'),
+        )
+
+    def test_repeated_question_is_answered_from_cache(self):
+        with mock_webhook(self.handler(httpx.Response(200, json={'reply': 'Das 8h às 18h', 'extra': 1}))):
+            first = self.post_proxy('Qual o horário?')
+            second = self.post_proxy('qual o HORARIO?')
+        self.assertEqual(len(self.calls), 1)
+        self.assertFalse(first.has_header(reply_cache.HEADER))
+        self.assertEqual(second[reply_cache.HEADER], 'HIT')
+        self.assertEqual(second.json(), {'reply': 'Das 8h às 18h', 'extra': 1})
+
+    def test_disabled_by_default(self):
+        ChatbotConfig.objects.filter(pk=self.chatbot.pk).update(reply_cache_enabled=False)
+        cache.clear()
+        clear_local_cache()
+        with mock_webhook(self.handler(httpx.Response(200, json={'reply': 'Oi'}))):
+            self.post_proxy('Oi')
+            self.post_proxy('Oi')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_webhook_can_mark_reply_as_not_cacheable(self):
+        responses = [
+            httpx.Response(200, headers={'Cache-Control': 'no-store'}, json={'reply': 'Seu saldo é 10'}),
+            httpx.Response(200, json={'reply': 'Seu pedido saiu', 'cacheable': False}),
+        ]
+        for response in responses:
+            self.calls.clear()
+            with mock_webhook(self.handler(response)):
+                self.post_proxy('Meu pedido')
+                self.post_proxy('Meu pedido')
+            self.assertEqual(len(self.calls), 2)
+
+    def test_streamed_reply_is_cached(self):
+        response = httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=SSE_BODY)
+        with mock_webhook(self.handler(response)):
+            stream_lines(self.post_proxy('Oi', stream=True))
+            cached = self.post_proxy('Oi', stream=True)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(cached.json()['reply'], 'Olá, tudo bem?')
+
+    def test_editing_the_chatbot_discards_cached_replies(self):
+        with mock_webhook(self.handler(httpx.Response(200, json={'reply': 'Oi'}))):
+            self.post_proxy('Oi')
+            self.chatbot.welcome_message = 'Bem vindo'
+            self.chatbot.save()
+            self.post_proxy('Oi')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_identical_in_flight_messages_wait_for_the_first(self):
+        config = get_chatbot_config(self.chatbot.id)
+        leader = reply_cache.lookup(config, 'Preço?')
+        self.assertIsNone(leader.fetch(timeout=1))
+        results = []
+        follower = threading.Thread(
+            target=lambda: results.append(reply_cache.lookup(config, 'preco?').fetch(timeout=5))
+        )
+        follower.start()
+        time.sleep(0.05)
+        leader.store({'reply': 'R$ 10'})
+        leader.finish()
+        follower.join()
+        self.assertEqual(results, [{'reply': 'R$ 10'}])
+
+    async def test_async_burst_makes_a_single_webhook_call(self):
+        async def handler(request):
+            self.calls.append(request)
+            await asyncio.sleep(0.1)
+            return httpx.Response(200, json={'reply': 'Das 8h às 18h'})
+
+        factory = AsyncRequestFactory()
+
+        def request():
+            return factory.post(
+                '/api/v1/chat/',
+                json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Horário?'}),
+                content_type='application/json',
+            )
+
+        with mock_webhook(handler):
+            responses = await asyncio.gather(*[async_views.chat_proxy_api_async_view(request()) for _ in range(5)])
+            await webhook_transport.aclose()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual({json.loads(response.content)['reply'] for response in responses}, {'Das 8h às 18h'})
+        self.assertEqual(sum(response.has_header(reply_cache.HEADER) for response in responses), 4)
+
+
+    async def test_async_paths_store_without_blocking_the_loop(self):
+        factory = AsyncRequestFactory()
+        request = factory.post(
+            '/api/v1/chat/',
+            json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Horário?'}),
+            content_type='application/json',
+        )
+        socket = FakeWebSocket(json.dumps({'message': 'Endereço?', 'id': 'm1'}))
+        socket.disconnect()
+        scope = {
+            'type': 'websocket', 'path': f'/ws/chat/{self.chatbot.id}/', 'query_string': b'session_id=sessao-ws',
+            'headers': [], 'client': ('203.0.113.7', 5000),
+        }
+        with mock_webhook(self.handler(httpx.Response(200, json={'reply': 'Das 8h às 18h'}))), \
+                mock.patch.object(websocket, 'close_old_connections'), self.blocking_cache_guard():
+            await async_views.chat_proxy_api_async_view(request)
+            await websocket.websocket_application(scope, socket.receive, socket.send)
+            await webhook_transport.aclose()
+        self.assertEqual(socket.frames(), [{'type': 'done', 'reply': 'Das 8h às 18h', 'id': 'm1'}])
+        reply_cache.clear_local_cache()
+        for message in ('Horário?', 'Endereço?'):
+            cached = await reply_cache.lookup(self.chatbot, message).afetch(1)
+            self.assertEqual(cached, {'reply': 'Das 8h às 18h'})
+
+
+class IdempotencyTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+
+    def webhook(self, *responses):
+        replies = list(responses)
+
+        def handler(request):
+            self.calls.append(request)
+            return replies.pop(0) if replies else httpx.Response(200, json={'reply': 'Oi!'})
+
+        return mock_webhook(handler)
+
+    def post_with_key(self, message='Olá', key='msg-1', **extra):
+        payload = {'chatbot_id': str(self.chatbot.id), 'message': message, **extra}
+        return self.client.post(
+            '/api/v1/chat/', json.dumps(payload), content_type='application/json', headers={idempotency.HEADER: key},
+        )
+
+    def test_resubmission_replays_stored_reply(self):
+        with self.webhook():
+            first = self.post_with_key(session_id='sessao-1')
+            second = self.post_with_key(session_id='sessao-1')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second[idempotency.REPLAYED_HEADER], 'true')
+        self.assertFalse(first.has_header(idempotency.REPLAYED_HEADER))
+        # A repetida não é registrada de novo no histórico
+        self.assertEqual(conversation_log.flush(), 2)
+
+    def test_unique_messages_are_not_affected(self):
+        with self.webhook():
+            self.post_proxy('Olá')
+            self.post_proxy('Olá')
+            self.post_proxy('Olá', client_message_id='msg-2')
+            # Mesmo id com outra mensagem: mensagem nova
+            self.post_proxy('Outra', client_message_id='msg-2')
+            replayed = self.post_proxy('Olá', client_message_id='msg-2')
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(replayed[idempotency.REPLAYED_HEADER], 'true')
+
+    def test_failed_attempt_is_not_replayed(self):
+        with self.webhook(httpx.Response(500)):
+            self.assertEqual(self.post_with_key().status_code, 502)
+            second = self.post_with_key()
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(second.json()['reply'], 'Oi!')
+        self.assertFalse(second.has_header(idempotency.REPLAYED_HEADER))
+
+    def test_streamed_reply_is_replayed_as_ndjson(self):
+        def handler(request):
+            self.calls.append(request)
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=SSE_BODY)
+
+        with mock_webhook(handler):
+            first = stream_lines(self.post_with_key(stream=True))
+            second = self.post_with_key(stream=True)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(second['Content-Type'], streaming.NDJSON_CONTENT_TYPE)
+        self.assertEqual([json.loads(line) for line in second.content.splitlines()], first)
+
+    @override_settings(IDEMPOTENCY={'SYNC_MAX_WAIT': 0.2})
+    def test_sync_duplicate_gives_up_with_409(self):
+        key = idempotency.cache_key(self.chatbot, 'sessao-1', 'msg-1', 'Olá')
+        # Primeira requisição ainda em andamento em outro worker
+        cache.add(key, idempotency._PENDING, 60)
+        started = time.monotonic()
+        with self.webhook():
+            response = self.post_with_key(session_id='sessao-1')
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.calls, [])
+
+    def test_queued_resubmission_returns_same_job(self):
+        self.chatbot.delivery_mode = ChatbotConfig.DELIVERY_QUEUE
+        self.chatbot.save()
+        first = self.post_with_key()
+        second = self.post_with_key()
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(second.json()['job_id'], first.json()['job_id'])
+        self.assertEqual(DeliveryJob.objects.count(), 1)
+
+    async def test_in_flight_duplicates_attach_to_first_call(self):
+        async def handler(request):
+            self.calls.append(request)
+            await asyncio.sleep(0.1)
+            return httpx.Response(200, json={'reply': 'Das 8h às 18h'})
+
+        factory = AsyncRequestFactory()
+
+        def request():
+            return factory.post(
+                '/api/v1/chat/',
+                json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Horário?'}),
+                content_type='application/json',
+                headers={idempotency.HEADER: 'msg-1'},
+            )
+
+        with mock_webhook(handler):
+            responses = await asyncio.gather(*[async_views.chat_proxy_api_async_view(request()) for _ in range(5)])
+            await webhook_transport.aclose()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual({json.loads(response.content)['reply'] for response in responses}, {'Das 8h às 18h'})
+        self.assertEqual(sum(response.has_header(idempotency.REPLAYED_HEADER) for response in responses), 4)
+
+
+class FakeWebSocket:
+    """Par ``receive``/``send`` para chamar a aplicação ASGI sem servidor."""
+
+    def __init__(self, *frames):
+        self.incoming = asyncio.Queue()
+        self.sent = []
+        self.incoming.put_nowait({'type': 'websocket.connect'})
+        for frame in frames:
+            self.incoming.put_nowait({'type': 'websocket.receive', 'text': frame})
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, event):
+        self.sent.append(event)
+
+    def disconnect(self):
+        self.incoming.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+
+    def frames(self):
+        return [json.loads(event['text']) for event in self.sent if event['type'] == 'websocket.send']
+
+
+class WebSocketTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        # A conexão do teste fica dentro da transação do TestCase
+        patcher = mock.patch.object(websocket, 'close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scope(self, chatbot_id=None, session_id='sessao-ws'):
+        return {
+            'type': 'websocket',
+            'path': f'/ws/chat/{chatbot_id or self.chatbot.id}/',
+            'query_string': f'session_id={session_id}'.encode(),
+            'headers': [],
+            'client': ('203.0.113.7', 5000),
+        }
+
+    async def run_socket(self, socket, scope=None):
+        socket.disconnect()
+        await websocket.websocket_application(scope or self.scope(), socket.receive, socket.send)
+        await webhook_transport.aclose()
+
+    async def test_relays_sse_tokens_as_frames(self):
+        def handler(request):
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=SSE_BODY)
+
+        socket = FakeWebSocket(json.dumps({'type': 'message', 'message': 'Oi', 'id': 'm1'}))
+        with mock_webhook(handler):
+            await self.run_socket(socket)
+        self.assertEqual(socket.sent[0], {'type': 'websocket.accept'})
+        self.assertEqual(socket.frames(), [
+            {'type': 'token', 'token': 'Olá', 'id': 'm1'},
+            {'type': 'token', 'token': ', tudo bem?', 'id': 'm1'},
+            {'type': 'done', 'reply': 'Olá, tudo bem?', 'id': 'm1'},
+        ])
+
+    async def test_reuses_connection_for_json_replies(self):
+        payloads = []
+
+        def handler(request):
+            payloads.append(json.loads(request.content))
+            return httpx.Response(200, json={'mensagem': 'Olá do webhook'})
+
+        socket = FakeWebSocket(
+            json.dumps({'message': 'Primeira', 'id': 1}),
+            json.dumps({'message': 'Segunda', 'id': 2}),
+        )
+        with mock_webhook(handler), mock.patch.object(
+            websocket, 'aget_chatbot_config', wraps=websocket.aget_chatbot_config
+        ) as lookup:
+            await self.run_socket(socket)
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual([payload['message'] for payload in payloads], ['Primeira', 'Segunda'])
+        self.assertEqual(payloads[0]['chatbot_id'], str(self.chatbot.id))
+        self.assertEqual(socket.frames(), [
+            {'type': 'done', 'reply': 'Olá do webhook', 'id': 1},
+            {'type': 'done', 'reply': 'Olá do webhook', 'id': 2},
+        ])
+
+    async def test_messages_are_counted_in_usage(self):
+        responses = iter([httpx.Response(200, json={'reply': 'Oi'}), httpx.Response(500)])
+        socket = FakeWebSocket(json.dumps({'message': 'Um'}), json.dumps({'message': 'Dois'}))
+        with mock_webhook(lambda request: next(responses)):
+            await self.run_socket(socket)
+        [(key, counters)] = usage.usage_buffer._pending.items()
+        self.assertEqual(key[0], str(self.chatbot.id))
+        self.assertEqual(counters[usage.REQUESTS], 2)
+        self.assertEqual(counters[usage.ERRORS], 1)
+
+    async def test_post_fallback_replays_websocket_reply(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={'reply': 'Olá do webhook'})
+
+        socket = FakeWebSocket(json.dumps({'message': 'Oi', 'id': 'm1', 'client_message_id': 'msg-1'}))
+        with mock_webhook(handler):
+            await self.run_socket(socket)
+            # O widget não recebeu o frame e reenviou pelo POST com o mesmo id
+            response = await self.async_client.post(
+                '/api/v1/chat/',
+                json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi', 'session_id': 'sessao-ws'}),
+                content_type='application/json',
+                headers={idempotency.HEADER: 'msg-1'},
+            )
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(response[idempotency.REPLAYED_HEADER], 'true')
+        self.assertEqual(response.json()['reply'], 'Olá do webhook')
+
+    async def test_resent_frame_replays_streamed_post(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=SSE_BODY)
+
+        with mock_webhook(handler):
+            response = await self.async_client.post(
+                '/api/v1/chat/',
+                json.dumps({'chatbot_id': str(self.chatbot.id), 'message': 'Oi', 'session_id': 'sessao-ws', 'stream': True}),
+                content_type='application/json',
+                headers={idempotency.HEADER: 'msg-2'},
+            )
+            await sync_to_async(stream_lines)(response)
+            socket = FakeWebSocket(json.dumps({'message': 'Oi', 'id': 'm2', 'client_message_id': 'msg-2'}))
+            await self.run_socket(socket)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(socket.frames(), [{'type': 'done', 'reply': 'Olá, tudo bem?', 'id': 'm2'}])
+
+    def test_connections_do_not_share_one_sync_thread(self):
+        available = balancer.available
+
+        def slow_available(config):
+            time.sleep(0.3)
+            return available(config)
+
+        async def run_sockets(sockets):
+            started = time.monotonic()
+            await asyncio.gather(*[
+                websocket.websocket_application(self.scope(session_id=f'sessao-{n}'), socket.receive, socket.send)
+                for n, socket in enumerate(sockets)
+            ])
+            await webhook_transport.aclose()
+            return time.monotonic() - started
+
+        # Config já em memória: as threads dos contextos não consultam o banco
+        get_chatbot_config(self.chatbot.id)
+        sockets = [FakeWebSocket(json.dumps({'message': 'Oi', 'id': n})) for n in range(2)]
+        for socket in sockets:
+            socket.disconnect()
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Oi'})), mock.patch.object(
+            balancer, 'aavailable', sync_to_async(slow_available)
+        ):
+            # Event loop próprio, como o do servidor ASGI (sem async_to_sync por cima)
+            elapsed = asyncio.run(run_sockets(sockets))
+        self.assertEqual([socket.frames()[0]['type'] for socket in sockets], ['done', 'done'])
+        # Em série seriam ao menos 0,6 s
+        self.assertLess(elapsed, 0.55)
+
+    async def test_queue_mode_sends_job_result(self):
+        self.chatbot.delivery_mode = ChatbotConfig.DELIVERY_QUEUE
+        await self.chatbot.asave()
+        await_result = delivery_queue.await_result
+
+        async def deliver_then_wait(job_id, timeout):
+            # O worker atende a fila enquanto o WebSocket espera o job
+            self.assertTrue(await DeliveryJob.objects.filter(pk=job_id).aexists())
+            await sync_to_async(delivery_queue.process_next)()
+            return await await_result(job_id, timeout)
+
+        socket = FakeWebSocket(json.dumps({'message': 'Oi', 'id': 'm1'}))
+        with mock_webhook(lambda request: httpx.Response(200, json={'reply': 'Da fila'})), mock.patch.object(
+            delivery_queue, 'await_result', deliver_then_wait
+        ):
+            await self.run_socket(socket)
+        self.assertEqual(socket.frames(), [{'type': 'done', 'reply': 'Da fila', 'id': 'm1'}])
+
+    async def test_webhook_error_is_sent_as_error_frame(self):
+        def handler(request):
+            raise httpx.ReadTimeout('lento')
+
+        socket = FakeWebSocket(json.dumps({'message': 'Oi', 'id': 'm1'}))
+        with mock_webhook(handler):
+            await self.run_socket(socket)
+        frame = socket.frames()[0]
+        self.assertEqual(frame['type'], 'error')
+        self.assertEqual(frame['id'], 'm1')
+
+    async def test_invalid_frame_keeps_connection_open(self):
+        socket = FakeWebSocket('não é json', json.dumps({'message': '   '}))
+        await self.run_socket(socket)
+        self.assertEqual([frame['type'] for frame in socket.frames()], ['error', 'error'])
+        self.assertEqual(socket.sent[-1]['type'], 'websocket.send')
+
+    async def test_unknown_chatbot_closes_with_4404(self):
+        socket = FakeWebSocket()
+        await self.run_socket(socket, self.scope('00000000-0000-0000-0000-000000000000'))
+        self.assertEqual(socket.sent, [{'type': 'websocket.close', 'code': websocket.CLOSE_NOT_FOUND}])
+
+    async def test_push_reaches_open_session(self):
+        socket = FakeWebSocket()
+        task = asyncio.ensure_future(
+            websocket.websocket_application(self.scope(), socket.receive, socket.send)
+        )
+        while not socket.sent:
+            await asyncio.sleep(0.01)
+        self.assertTrue(await websocket.push(self.chatbot.id, 'sessao-ws', 'Seu pedido saiu para entrega'))
+        self.assertFalse(await websocket.push(self.chatbot.id, 'outra-sessao', 'Oi'))
+        socket.disconnect()
+        await task
+        self.assertEqual(socket.frames(), [{'type': 'push', 'message': 'Seu pedido saiu para entrega'}])
+        self.assertFalse(await websocket.push(self.chatbot.id, 'sessao-ws', 'Oi'))
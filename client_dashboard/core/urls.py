@@ -1,5 +1,16 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Sob ASGI (CHAT_ASYNC_PROXY=True) os endpoints de chat usam as views assíncronas
+if settings.CHAT_ASYNC_PROXY:
+    chat_api = async_views.chat_api_async
+    chat_proxy_api = async_views.chat_proxy_api_async_view
+    chat_job_result = async_views.chat_job_result_async_view
+else:
+    chat_api = views.chat_api
+    chat_proxy_api = views.chat_proxy_api_view
+    chat_job_result = views.chat_job_result_view
 
 urlpatterns = [
     path('', views.landing_page, name='landing_page'),
@@ -9,7 +20,16 @@ urlpatterns = [
     path('chatbots/create/', views.create_chatbot, name='create_chatbot'),
     path('chatbots/<uuid:chatbot_id>/dashboard/', views.dashboard, name='dashboard'),
     path('chatbots/<uuid:chatbot_id>/delete/', views.delete_chatbot, name='delete_chatbot'),
+    path('chatbots/<uuid:chatbot_id>/settings/', views.update_chatbot_settings, name='chatbot_settings'),
+    path('chatbots/<uuid:chatbot_id>/endpoints/', views.add_webhook_endpoint, name='add_webhook_endpoint'),
+    path(
+        'chatbots/<uuid:chatbot_id>/endpoints/<int:endpoint_id>/delete/',
+        views.delete_webhook_endpoint,
+        name='delete_webhook_endpoint',
+    ),
+    path('chatbots/<uuid:chatbot_id>/export/', views.export_conversations, name='export_conversations'),
     path('embed/<uuid:chatbot_id>/', views.chat_embed_view, name='chat_embed'),
-    path('api/chat/', views.chat_api, name='chat_api'),
-    path('api/v1/chat/', views.chat_proxy_api_view, name='chat_proxy_api'),
+    path('api/chat/', chat_api, name='chat_api'),
+    path('api/v1/chat/', chat_proxy_api, name='chat_proxy_api'),
+    path('api/v1/chat/jobs/<uuid:job_id>/', chat_job_result, name='chat_job_result'),
 ]
\ No newline at end of file
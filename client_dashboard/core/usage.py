@@ -0,0 +1,323 @@
+"""
+Uso dos chatbots (mensagens, erros e latência) para o painel do dashboard.
+
+O ``MetricsMiddleware`` e o canal WebSocket chamam ``record`` a cada mensagem
+de chat; os números ficam acumulados em memória por chatbot e minuto, sem
+acesso ao banco. Uma thread de fundo por processo soma o acumulado a cada
+``FLUSH_INTERVAL`` segundos nas linhas de minuto, hora e dia de
+``UsageRollup`` (incrementos com ``F()``, então vários workers podem gravar
+o mesmo bucket sem perder contagens).
+
+O painel lê só essas linhas: algumas dezenas por chatbot, qualquer que seja o
+volume de mensagens. Buckets antigos são apagados pelo comando
+``compact_usage``; os de minuto e hora expiram antes, mas continuam somados
+nos de dia.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ChatbotConfig, UsageRollup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'ENABLED': True,
+    'FLUSH_INTERVAL': 10.0,
+    # Máximo de pares (chatbot, minuto) acumulados antes de descartar novos
+    'MAX_BUFFERED': 10000,
+    # Retenção (dias) de cada granularidade, aplicada por compact_usage
+    'MINUTE_RETENTION_DAYS': 2,
+    'HOUR_RETENTION_DAYS': 90,
+    'DAY_RETENTION_DAYS': 730,
+}
+
+# Índices dos contadores acumulados por (chatbot, minuto)
+REQUESTS, ERRORS, RATE_LIMITED, LATENCY_TOTAL, LATENCY_MAX = range(5)
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'USAGE', {}))
+    return options
+
+
+def is_enabled():
+    return _options()['ENABLED']
+
+
+def _merge(target, key, counters):
+    current = target.get(key)
+    if current is None:
+        target[key] = list(counters)
+        return
+    for index in (REQUESTS, ERRORS, RATE_LIMITED, LATENCY_TOTAL):
+        current[index] += counters[index]
+    current[LATENCY_MAX] = max(current[LATENCY_MAX], counters[LATENCY_MAX])
+
+
+class UsageBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._worker = None
+        self._pid = os.getpid()
+
+    def record(self, chatbot_id, status, latency):
+        """Soma uma resposta de chat (``latency`` em segundos) ao minuto atual."""
+        options = _options()
+        if not options['ENABLED']:
+            return
+        key = (str(chatbot_id), int(time.time() // 60))
+        latency_ms = latency * 1000
+        with self._lock:
+            counters = self._pending.get(key)
+            if counters is None:
+                if len(self._pending) >= options['MAX_BUFFERED']:
+                    logger.warning('Buffer de uso cheio; descartando a contagem.')
+                    return
+                counters = self._pending[key] = [0, 0, 0, 0.0, 0.0]
+            counters[REQUESTS] += 1
+            if status == 429:
+                counters[RATE_LIMITED] += 1
+            elif status >= 400:
+                counters[ERRORS] += 1
+            counters[LATENCY_TOTAL] += latency_ms
+            if latency_ms > counters[LATENCY_MAX]:
+                counters[LATENCY_MAX] = latency_ms
+        self._ensure_worker()
+
+    def reset_after_fork(self):
+        """No processo filho o acumulado e a thread do pai não valem."""
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._worker = None
+        self._pid = os.getpid()
+
+    def _ensure_worker(self):
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='usage-rollup', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(_options()['FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Falha ao gravar o uso agregado dos chatbots.')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Soma o acumulado às tabelas de uso. Retorna o número de pares gravados."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            _write_batch(batch)
+        except Exception:
+            # Devolve o acumulado para a próxima tentativa
+            with self._lock:
+                for key, counters in batch.items():
+                    _merge(self._pending, key, counters)
+            raise
+        return len(batch)
+
+    def pending(self):
+        return len(self._pending)
+
+
+def bucket_starts(minute):
+    """Início do minuto, da hora e do dia (no fuso do projeto) de ``minute``."""
+    start = datetime.fromtimestamp(minute * 60, tz=dt_timezone.utc)
+    local = timezone.localtime(start)
+    return (
+        (UsageRollup.PERIOD_MINUTE, start),
+        (UsageRollup.PERIOD_HOUR, start.replace(minute=0)),
+        (UsageRollup.PERIOD_DAY, local.replace(hour=0, minute=0)),
+    )
+
+
+def _write_batch(batch):
+    # Descarta contagens de chatbots excluídos (violariam a FK)
+    existing = {
+        str(pk) for pk in ChatbotConfig.objects.filter(
+            pk__in={chatbot_id for chatbot_id, _ in batch}
+        ).values_list('pk', flat=True)
+    }
+    rollups = {}
+    for (chatbot_id, minute), counters in batch.items():
+        if chatbot_id not in existing:
+            continue
+        for period, bucket_start in bucket_starts(minute):
+            _merge(rollups, (chatbot_id, period, bucket_start), counters)
+    with transaction.atomic():
+        for (chatbot_id, period, bucket_start), counters in rollups.items():
+            _increment(chatbot_id, period, bucket_start, counters)
+
+
+def _increment(chatbot_id, period, bucket_start, counters):
+    bucket = {'chatbot_id': chatbot_id, 'period': period, 'bucket_start': bucket_start}
+    changes = {
+        'requests': F('requests') + counters[REQUESTS],
+        'errors': F('errors') + counters[ERRORS],
+        'rate_limited': F('rate_limited') + counters[RATE_LIMITED],
+        'latency_total_ms': F('latency_total_ms') + counters[LATENCY_TOTAL],
+        'latency_max_ms': Greatest('latency_max_ms', Value(counters[LATENCY_MAX])),
+    }
+    if UsageRollup.objects.filter(**bucket).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            UsageRollup.objects.create(
+                **bucket,
+                requests=counters[REQUESTS],
+                errors=counters[ERRORS],
+                rate_limited=counters[RATE_LIMITED],
+                latency_total_ms=counters[LATENCY_TOTAL],
+                latency_max_ms=counters[LATENCY_MAX],
+            )
+    except IntegrityError:
+        # Outro worker criou o bucket entre o update e o create
+        UsageRollup.objects.filter(**bucket).update(**changes)
+
+
+usage_buffer = UsageBuffer()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=usage_buffer.reset_after_fork)
+
+
+def record(chatbot_id, status, latency):
+    usage_buffer.record(chatbot_id, status, latency)
+
+
+def flush():
+    return usage_buffer.flush()
+
+
+@atexit.register
+def _flush_on_exit():
+    if usage_buffer.pending() and usage_buffer._pid == os.getpid():
+        try:
+            usage_buffer.flush()
+        except Exception:
+            logger.exception('Falha ao gravar o uso pendente no encerramento.')
+
+
+# --- Leitura (dashboard) ------------------------------------------------------
+
+class UsageTotals:
+    """Soma de buckets de uso, com as taxas exibidas no painel."""
+
+    __slots__ = ('requests', 'errors', 'rate_limited', 'latency_total_ms', 'latency_max_ms')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.latency_total_ms = 0.0
+        self.latency_max_ms = 0.0
+
+    def add(self, rollup):
+        self.requests += rollup.requests
+        self.errors += rollup.errors
+        self.rate_limited += rollup.rate_limited
+        self.latency_total_ms += rollup.latency_total_ms
+        self.latency_max_ms = max(self.latency_max_ms, rollup.latency_max_ms)
+
+    @property
+    def error_rate(self):
+        return self.errors / self.requests * 100 if self.requests else 0.0
+
+    @property
+    def latency_avg_ms(self):
+        return self.latency_total_ms / self.requests if self.requests else 0.0
+
+
+def summary(config, now=None):
+    """
+    Uso do chatbot para o painel: última hora (buckets de minuto), últimas
+    24 horas (de hora, também como série ``hourly``) e últimos 30 dias (de
+    dia). Uma única query, que lê no máximo 114 linhas.
+    """
+    now = now or timezone.now()
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    windows = {
+        UsageRollup.PERIOD_MINUTE: now.replace(second=0, microsecond=0) - timedelta(minutes=59),
+        UsageRollup.PERIOD_HOUR: current_hour - timedelta(hours=23),
+        UsageRollup.PERIOD_DAY: timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=29),
+    }
+    condition = Q()
+    for period, since in windows.items():
+        condition |= Q(period=period, bucket_start__gte=since)
+    rollups = UsageRollup.objects.filter(condition, chatbot=config)
+
+    totals = {period: UsageTotals() for period in windows}
+    per_hour = {}
+    for rollup in rollups:
+        totals[rollup.period].add(rollup)
+        if rollup.period == UsageRollup.PERIOD_HOUR:
+            per_hour[rollup.bucket_start] = rollup.requests
+
+    starts = [windows[UsageRollup.PERIOD_HOUR] + timedelta(hours=offset) for offset in range(24)]
+    peak = max(per_hour.values(), default=0)
+    hourly = [
+        {
+            'start': start,
+            'requests': per_hour.get(start, 0),
+            'height': round(per_hour.get(start, 0) / peak * 100) if peak else 0,
+        }
+        for start in starts
+    ]
+    return {
+        'last_hour': totals[UsageRollup.PERIOD_MINUTE],
+        'last_day': totals[UsageRollup.PERIOD_HOUR],
+        'last_month': totals[UsageRollup.PERIOD_DAY],
+        'hourly': hourly,
+    }
+
+
+# --- Retenção -------------------------------------------------------------------
+
+def compact(now=None, batch_size=5000, dry_run=False):
+    """
+    Apaga os buckets além da retenção de cada granularidade, em lotes de
+    ``batch_size`` linhas. Retorna ``{período: linhas apagadas}``.
+    """
+    now = now or timezone.now()
+    options = _options()
+    retention = {
+        UsageRollup.PERIOD_MINUTE: options['MINUTE_RETENTION_DAYS'],
+        UsageRollup.PERIOD_HOUR: options['HOUR_RETENTION_DAYS'],
+        UsageRollup.PERIOD_DAY: options['DAY_RETENTION_DAYS'],
+    }
+    deleted = {}
+    for period, days in retention.items():
+        expired = UsageRollup.objects.filter(period=period, bucket_start__lt=now - timedelta(days=days))
+        if dry_run:
+            deleted[period] = expired.count()
+            continue
+        deleted[period] = 0
+        while True:
+            ids = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted[period] += UsageRollup.objects.filter(pk__in=ids).delete()[0]
+    return deleted
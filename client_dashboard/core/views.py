@@ -3,13 +3,18 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
-from django.http import JsonResponse, Http404
+from django.http import HttpResponse, JsonResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
-import json
-import requests
+from django.views.decorators.http import condition, require_http_methods
+from django.db.models import Case, When
+import logging
+
 import httpx
-from .models import ChatbotConfig
+from . import balancer, circuit_breaker, conversation_log, delivery_queue, embed_cache, export, idempotency, live_settings, metrics, proxy, ratelimit, replicas, reply_cache, session_context, streaming, usage, webhook_retry
+from .config_cache import get_chatbot_config
+from .models import ChatbotConfig, WebhookEndpoint
+
+logger = logging.getLogger(__name__)
 
 def landing_page(request):
     """Landing page do BeckerChat"""
@@ -33,17 +38,21 @@ def register(request):
         form = UserCreationForm()
     return render(request, 'registration/register.html', {'form': form})
 
-from .forms import ChatbotConfigForm
+from .forms import ChatbotConfigForm, WebhookEndpointForm
 
 @login_required
 def home(request):
     # Redireciona para a lista de chatbots
     return redirect('chatbot_list')
 
+# Colunas usadas pelo template chatbot_list.html
+LIST_FIELDS = ('id', 'name', 'primary_color', 'welcome_message', 'webhook_url', 'created_at')
+
 @login_required
 def chatbot_list(request):
     """Lista todos os chatbots do usuário"""
-    chatbots = ChatbotConfig.objects.filter(user=request.user)
+    # Só as colunas exibidas nos cards (índice chatbot_user_created_idx)
+    chatbots = ChatbotConfig.objects.filter(user=request.user).only(*LIST_FIELDS)
     return render(request, 'chatbot_list.html', {'chatbots': chatbots})
 
 @login_required
@@ -65,27 +74,23 @@ def dashboard(request, chatbot_id):
     """Dashboard para personalizar um chatbot específico"""
     config = get_object_or_404(ChatbotConfig, id=chatbot_id, user=request.user)
     if request.method == 'POST':
-        print(f"DEBUG: Requisição POST recebida para chatbot {chatbot_id}")
-        print(f"DEBUG: Dados POST: {dict(request.POST)}")
-        print(f"DEBUG: Content-Type: {request.content_type}")
+        logger.debug('POST no dashboard', extra={
+            'chatbot_id': chatbot_id,
+            'fields': sorted(request.POST.keys()),
+            'content_type': request.content_type,
+        })
         
         # Check if it's an AJAX request for real-time updates
         is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
-        if is_ajax and ('primary_color' in request.POST or 'welcome_message' in request.POST or 'webhook_url' in request.POST):
-            print("DEBUG: Detectada requisição AJAX para atualização em tempo real")
+        live_fields = [field for field in live_settings.FIELDS if field in request.POST]
+        if is_ajax and live_fields:
             try:
                 # Update only the specific fields for real-time customization
-                if 'primary_color' in request.POST:
-                    print(f"DEBUG: Atualizando primary_color: {request.POST['primary_color']}")
-                    config.primary_color = request.POST['primary_color']
-                if 'welcome_message' in request.POST:
-                    print(f"DEBUG: Atualizando welcome_message: {request.POST['welcome_message']}")
-                    config.welcome_message = request.POST['welcome_message']
-                if 'webhook_url' in request.POST:
-                    print(f"DEBUG: Atualizando webhook_url: {request.POST['webhook_url']}")
-                    config.webhook_url = request.POST['webhook_url']
-                config.save()
-                print("DEBUG: Configurações salvas com sucesso!")
+                for field in live_fields:
+                    setattr(config, field, request.POST[field])
+                # updated_at entra no UPDATE: invalida o ETag do embed e o cache de respostas
+                config.save(update_fields=[*live_fields, 'updated_at'])
+                logger.debug('Configurações atualizadas em tempo real', extra={'chatbot_id': chatbot_id})
                 return JsonResponse({'success': True, 'message': 'Configurações salvas com sucesso!'})
             except Exception as e:
                 return JsonResponse({'success': False, 'error': str(e)})
@@ -97,18 +102,60 @@ def dashboard(request, chatbot_id):
                 return redirect('chatbot_list')
     else:
         form = ChatbotConfigForm(instance=config)
-    return render(request, 'dashboard.html', {'form': form, 'chatbot': config})
+    return render(request, 'dashboard.html', {
+        'form': form,
+        'chatbot': config,
+        'circuit': circuit_breaker.get_status(config.webhook_url),
+        # Só as tabelas agregadas, nunca as mensagens (core.usage)
+        'usage': usage.summary(config),
+        'live_save': live_settings.client_options(),
+        'endpoints': balancer.pool_status(config, config.webhook_endpoints.all()) if config.webhook_url else [],
+        'endpoint_form': WebhookEndpointForm(),
+        'max_endpoints': balancer.max_endpoints(),
+    })
+
+@login_required
+@require_http_methods(["PATCH"])
+def update_chatbot_settings(request, chatbot_id):
+    """
+    Grava em lote as alterações em tempo real do dashboard.
+
+    Corpo: ``{"version": <settings_version>, "changes": {campo: valor}}``;
+    responde 409 com os valores atuais se o chatbot mudou desde ``version``.
+    """
+    try:
+        version, changes = live_settings.parse(request.body)
+        version = live_settings.apply(chatbot_id, request.user, version, changes)
+    except live_settings.SettingsError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except live_settings.StaleVersion as e:
+        current = dict(e.current)
+        return JsonResponse({
+            'success': False,
+            'error': 'O chatbot foi alterado em outra janela.',
+            'version': current.pop('settings_version'),
+            'values': current,
+        }, status=409)
+    except ChatbotConfig.DoesNotExist:
+        raise Http404('Chatbot não encontrado')
+    return JsonResponse({'success': True, 'version': version})
 
 @login_required
 def delete_chatbot(request, chatbot_id):
     """View para excluir um chatbot específico"""
-    chatbot = get_object_or_404(ChatbotConfig, id=chatbot_id, user=request.user)
+    # Uma query: o chatbot pedido (primeiro) e, se existir, outro do usuário
+    chatbots = list(
+        ChatbotConfig.objects.filter(user=request.user)
+        .only('id', 'name')
+        .order_by(Case(When(pk=chatbot_id, then=0), default=1))[:2]
+    )
+    if not chatbots or chatbots[0].pk != chatbot_id:
+        raise Http404('Chatbot não encontrado')
+    chatbot = chatbots[0]
     
     if request.method == 'POST':
         # Verificar se o usuário tem pelo menos um chatbot restante
-        user_chatbots_count = ChatbotConfig.objects.filter(user=request.user).count()
-        
-        if user_chatbots_count <= 1:
+        if len(chatbots) < 2:
             messages.error(request, 'Você deve ter pelo menos um chatbot. Não é possível excluir o último chatbot.')
             return redirect('chatbot_list')
         
@@ -120,72 +167,239 @@ def delete_chatbot(request, chatbot_id):
     # Se não for POST, redirecionar para a lista
     return redirect('chatbot_list')
 
+@login_required
+@require_http_methods(["POST"])
+def add_webhook_endpoint(request, chatbot_id):
+    """Adiciona um endpoint ao pool do webhook do chatbot (core.balancer)."""
+    config = get_object_or_404(ChatbotConfig.objects.only('id', 'webhook_url'), id=chatbot_id, user=request.user)
+    form = WebhookEndpointForm(request.POST)
+    if not form.is_valid():
+        errors = [error for field_errors in form.errors.values() for error in field_errors]
+        messages.error(request, ' '.join(errors))
+        return redirect('dashboard', chatbot_id=chatbot_id)
+
+    # Uma query: as URLs já cadastradas dão a duplicidade e o limite
+    existing = list(config.webhook_endpoints.values_list('url', flat=True))
+    url = form.cleaned_data['url']
+    if url == config.webhook_url or url in existing:
+        messages.error(request, 'Esse endpoint já faz parte do webhook do chatbot.')
+    elif len(existing) >= balancer.max_endpoints():
+        messages.error(request, f'O chatbot já tem o máximo de {balancer.max_endpoints()} endpoints adicionais.')
+    else:
+        endpoint = form.save(commit=False)
+        endpoint.chatbot = config
+        endpoint.save()
+        messages.success(request, 'Endpoint adicionado ao webhook.')
+    return redirect('dashboard', chatbot_id=chatbot_id)
+
+@login_required
+@require_http_methods(["POST"])
+def delete_webhook_endpoint(request, chatbot_id, endpoint_id):
+    """Remove um endpoint adicional do webhook do chatbot."""
+    endpoint = get_object_or_404(
+        WebhookEndpoint.objects.only('id', 'chatbot_id'),
+        id=endpoint_id, chatbot_id=chatbot_id, chatbot__user=request.user,
+    )
+    endpoint.delete()
+    messages.success(request, 'Endpoint removido do webhook.')
+    return redirect('dashboard', chatbot_id=chatbot_id)
+
+@login_required
+@require_http_methods(["GET"])
+def export_conversations(request, chatbot_id):
+    """
+    Download do histórico de conversas do chatbot, em streaming.
+
+    Query string: ``format`` (csv ou ndjson), ``since``/``until`` (data ou
+    data e hora), ``after`` (id da última mensagem já recebida) e ``gzip=1``.
+    """
+    config = get_object_or_404(ChatbotConfig, id=chatbot_id, user=request.user)
+    try:
+        params = export.parse_params(request.GET)
+    except export.ExportError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return export.export_response(request, config, params)
+
+@replicas.read_from_replica
+@condition(etag_func=embed_cache.embed_etag, last_modified_func=embed_cache.embed_last_modified)
 def chat_embed_view(request, chatbot_id):
-    config = get_object_or_404(ChatbotConfig, id=chatbot_id)
+    config = get_chatbot_config(chatbot_id)
+    if config is None:
+        raise Http404('Chatbot não encontrado')
     
-    # Allow dynamic override of config values for preview
-    preview_config = {
-        'primary_color': request.GET.get('primary_color', config.primary_color),
-        'welcome_message': request.GET.get('welcome_message', config.welcome_message),
-        'name': config.name,
-        'id': config.id
-    }
+    # Query params primary_color/welcome_message sobrescrevem a config (pré-visualização
+    # do dashboard) e não passam pelo cache
+    response = HttpResponse(embed_cache.render_embed(request, config))
+    return embed_cache.patch_embed_headers(request, response)
+
+def _forward_legacy_message(config, message, on_reply, trace):
+    """Envia a mensagem de ``/api/chat/`` ao webhook e devolve a resposta."""
+    # Circuito aberto em todos os endpoints: responder o fallback sem esperar o webhook
+    targets = balancer.available(config)
+    if not targets:
+        return proxy.legacy_fallback_response()
     
-    return render(request, 'chat_embed.html', {'config': preview_config, 'chatbot_id': chatbot_id})
+    try:
+        # Prazo total, novas tentativas e hedging conforme o chatbot
+        webhook_response = webhook_retry.post_stream(
+            config,
+            json={'message': message},
+            headers=proxy.WEBHOOK_HEADERS,
+            trace=trace,
+            deadline=proxy.legacy_deadline(config),
+            targets=targets
+        )
+        try:
+            body = proxy.read_webhook_body(webhook_response)
+        finally:
+            webhook_response.close()
+        webhook_response.raise_for_status()
+        
+        # Retornar a resposta do webhook como veio
+        return proxy.legacy_reply_response(body, on_reply)
+        
+    except (httpx.HTTPError, ValueError):
+        return proxy.legacy_fallback_response()
+
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@replicas.read_from_replica
 def chat_api(request):
     try:
         # Obter o chatbot_id do header X-Client-ID
-        chatbot_id = request.headers.get('X-Client-ID')
-        if not chatbot_id:
-            return JsonResponse({'error': 'Header X-Client-ID é obrigatório'}, status=400)
+        chatbot_id = proxy.legacy_chatbot_id(request)
         
-        # Buscar a configuração do chatbot
-        try:
-            config = ChatbotConfig.objects.get(id=chatbot_id)
-        except ChatbotConfig.DoesNotExist:
+        # Buscar a configuração do chatbot (cache em memória + compartilhado)
+        config = get_chatbot_config(chatbot_id)
+        if config is None:
             return JsonResponse({'error': 'Chatbot não encontrado'}, status=404)
+        metrics.tag_chatbot(config.pk)
         
         # Verificar se há webhook configurado
         if not config.webhook_url:
-            return JsonResponse({'reply': 'Desculpe, o webhook não está configurado para este chatbot.'}, status=200)
+            return proxy.legacy_missing_webhook_response()
         
         # Obter dados da mensagem
-        data = json.loads(request.body)
-        message = data.get('message', '')
+        data = proxy.parse_legacy_request(request)
         
-        if not message:
-            return JsonResponse({'error': 'Mensagem é obrigatória'}, status=400)
+        # Limites de taxa (chatbot e IP) e de chamadas simultâneas ao webhook
+        retry_after = ratelimit.check_rate_limit(config, ratelimit.client_ip(request))
+        if retry_after:
+            return proxy.rate_limited_response(retry_after)
+        slot = ratelimit.acquire_slot(config)
+        if slot is None:
+            return proxy.rate_limited_response(1)
         
-        # Enviar para o webhook
         try:
-            webhook_response = requests.post(
-                config.webhook_url,
-                json={'message': message},
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
-            webhook_response.raise_for_status()
-            
-            # Retornar resposta do webhook
-            webhook_data = webhook_response.json()
-            return JsonResponse(webhook_data)
-            
-        except requests.exceptions.RequestException as e:
-            return JsonResponse({
-                'reply': 'Desculpe, não consegui me conectar ao serviço de chat no momento. Tente novamente mais tarde.'
-            }, status=200)
+            on_reply = conversation_log.start_exchange(config.pk, proxy.session_id(request, data), data['message'])
+            trace = webhook_retry.WebhookTrace()
+            return trace.apply(_forward_legacy_message(config, data['message'], on_reply, trace))
+        finally:
+            slot.release()
         
-    except json.JSONDecodeError:
-        return JsonResponse({'error': 'Dados JSON inválidos'}, status=400)
-    except Exception as e:
+    except proxy.ChatRequestError as e:
+        return e.response
+    except Exception:
+        logger.exception('Erro interno na chat_api')
         return JsonResponse({'error': 'Erro interno do servidor'}, status=500)
 
 
+def _forward_proxy_message(request, data, payload, config, on_reply, trace, lookup):
+    """
+    Envia a mensagem de ``/api/v1/chat/`` ao webhook e monta a resposta.
+
+    Pode devolver uma resposta em streaming, que mantém a chamada ao webhook
+    aberta até o fim do stream. As chamadas feitas ficam em ``trace``.
+    """
+    # Circuito aberto em todos os endpoints: devolver o fallback na hora, sem chamar o webhook
+    targets = balancer.available(config)
+    if not targets:
+        return proxy.circuit_open_response(balancer.retry_after(config))
+    
+    # Enviar ao webhook reaproveitando o pool de conexões do processo, dentro
+    # do prazo do chatbot e com novas tentativas/hedging (core.webhook_retry).
+    # A resposta é aberta em modo stream: só os headers foram lidos aqui.
+    wants_stream = streaming.client_accepts_stream(request, data)
+    try:
+        webhook_response = webhook_retry.post_stream(
+            config,
+            json=payload,
+            headers=proxy.webhook_headers(wants_stream),
+            trace=trace,
+            targets=targets
+        )
+    except httpx.HTTPError as e:
+        return proxy.webhook_error_response(e)
+    lookup.observe(webhook_response)
+    
+    # Webhook em SSE/NDJSON: repassar os tokens ao widget conforme chegam
+    is_stream = webhook_response.is_success and streaming.is_stream_response(webhook_response)
+    if is_stream and wants_stream:
+        return streaming.relay_stream(webhook_response, on_complete=lookup.wrap(on_reply))
+    
+    try:
+        if is_stream:
+            return streaming.collect_reply(webhook_response, on_complete=lookup.wrap(on_reply))
+        body = proxy.read_webhook_body(webhook_response)
+        webhook_response.raise_for_status()
+    except httpx.HTTPError as e:
+        return proxy.webhook_error_response(e)
+    finally:
+        webhook_response.close()
+    
+    # Retornar resposta do webhook com o campo 'reply' garantido
+    return proxy.webhook_reply_response(webhook_response, body, on_reply=on_reply, on_data=lookup.store)
+
+
+def _respond_proxy_message(request, data, config, session_id):
+    """Resposta de ``/api/v1/chat/`` para uma mensagem válida de um chatbot com webhook."""
+    # Limites de taxa (chatbot e IP) e de chamadas simultâneas ao webhook
+    retry_after = ratelimit.check_rate_limit(config, ratelimit.client_ip(request))
+    if retry_after:
+        return proxy.rate_limited_response(retry_after)
+    
+    # Entrega em fila: responde com o id do job, o widget busca a resposta depois
+    if config.delivery_mode == ChatbotConfig.DELIVERY_QUEUE:
+        conversation_log.start_exchange(config.pk, session_id, data['message'])
+        context = session_context.load(config, session_id)
+        return delivery_queue.queued_response(delivery_queue.enqueue(config, data, session_id, context))
+    
+    # Trocas anteriores da sessão, enviadas ao webhook
+    context = session_context.load(config, session_id)
+
+    # Resposta guardada para uma mensagem repetida (opt-in por chatbot), ou
+    # a de uma mensagem idêntica que já está aguardando o webhook
+    lookup = reply_cache.lookup(config, data['message'], context)
+    cached = lookup.fetch(config.webhook_timeout)
+    if cached is not None:
+        conversation_log.start_exchange(config.pk, session_id, data['message'])(cached['reply'])
+        session_context.remember(config, session_id, data['message'], cached['reply'], context)
+        return reply_cache.hit_response(cached)
+    
+    slot = ratelimit.acquire_slot(config)
+    if slot is None:
+        lookup.finish()
+        return proxy.rate_limited_response(1)
+    
+    try:
+        # Registrar a conversa (gravada em lote, fora da requisição) e a
+        # troca na janela da sessão
+        on_reply = conversation_log.start_exchange(config.pk, session_id, data['message'])
+        on_reply = session_context.extend(config, session_id, data['message'], context, on_reply)
+        payload = proxy.build_webhook_payload(data, session_id, context)
+        trace = webhook_retry.WebhookTrace()
+        response = trace.apply(_forward_proxy_message(request, data, payload, config, on_reply, trace, lookup))
+    except Exception:
+        slot.release()
+        lookup.finish()
+        raise
+    return slot.bind(lookup.bind(response))
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
+@replicas.read_from_replica
 def chat_proxy_api_view(request):
     """
     API otimizada para proxy de chat que substitui a lógica do FastAPI.
@@ -198,125 +412,50 @@ def chat_proxy_api_view(request):
     - JsonResponse com a resposta do webhook do cliente
     """
     try:
-        # Validar Content-Type
-        if request.content_type != 'application/json':
-            return JsonResponse({
-                'error': 'Content-Type deve ser application/json'
-            }, status=400)
-        
-        # Parsear dados JSON do corpo da requisição
-        try:
-            data = json.loads(request.body)
-        except json.JSONDecodeError:
-            return JsonResponse({
-                'error': 'Dados JSON inválidos no corpo da requisição'
-            }, status=400)
-        
-        # Extrair chatbot_id e message do corpo da requisição
-        chatbot_id = data.get('chatbot_id')
-        message = data.get('message')
+        # Validar Content-Type, JSON e parâmetros obrigatórios
+        data = proxy.parse_proxy_request(request)
+        chatbot_id = data['chatbot_id']
         
-        # Validar parâmetros obrigatórios
-        if not chatbot_id:
-            return JsonResponse({
-                'error': 'chatbot_id é obrigatório no corpo da requisição'
-            }, status=400)
-        
-        if not message:
-            return JsonResponse({
-                'error': 'message é obrigatória no corpo da requisição'
-            }, status=400)
-        
-        # Buscar configuração do chatbot no banco de dados
-        try:
-            config = ChatbotConfig.objects.get(id=chatbot_id)
-        except ChatbotConfig.DoesNotExist:
-            return JsonResponse({
-                'error': f'Chatbot com ID {chatbot_id} não encontrado'
-            }, status=404)
+        # Buscar configuração do chatbot (cache em memória + compartilhado)
+        config = get_chatbot_config(chatbot_id)
+        if config is None:
+            return proxy.chatbot_not_found(chatbot_id)
+        metrics.tag_chatbot(config.pk)
         
         # Verificar se webhook_url está configurado
         if not config.webhook_url:
-            return JsonResponse({
-                'error': 'Webhook URL não configurada para este chatbot',
-                'chatbot_id': chatbot_id
-            }, status=400)
+            return proxy.webhook_not_configured(chatbot_id)
         
-        # Preparar payload para o webhook
-        webhook_payload = {
-            'message': message,
-            'chatbot_id': chatbot_id,
-            'timestamp': data.get('timestamp')
-        }
+        # Mensagem reenviada com a mesma Idempotency-Key: recebe a resposta da
+        # primeira (aguardando-a, se ainda estiver em andamento)
+        session_id = proxy.session_id(request, data)
+        submission = idempotency.submission(config, request, data, session_id)
+        replayed = submission.fetch()
+        if replayed is not None:
+            return replayed
         
-        # Usar httpx para comunicação com o webhook
         try:
-            with httpx.Client(timeout=30.0) as client:
-                webhook_response = client.post(
-                    config.webhook_url,
-                    json=webhook_payload,
-                    headers={
-                        'Content-Type': 'application/json',
-                        'User-Agent': 'Django-Chat-Proxy/1.0'
-                    }
-                )
-                
-                # Verificar status da resposta
-                webhook_response.raise_for_status()
-                
-                # Tentar parsear resposta JSON do webhook
-                try:
-                    webhook_data = webhook_response.json()
-                    
-                    # Garantir que sempre há um campo 'reply' na resposta
-                    if 'reply' not in webhook_data:
-                        if 'mensagem' in webhook_data:
-                            webhook_data['reply'] = webhook_data['mensagem']
-                        elif 'message' in webhook_data:
-                            webhook_data['reply'] = webhook_data['message']
-                        elif 'response' in webhook_data:
-                            webhook_data['reply'] = webhook_data['response']
-                        else:
-                            # Se não encontrar nenhum campo conhecido, usar o primeiro valor string
-                            for key, value in webhook_data.items():
-                                if isinstance(value, str) and value.strip():
-                                    webhook_data['reply'] = value
-                                    break
-                            else:
-                                webhook_data['reply'] = 'Resposta recebida mas formato não reconhecido.'
-                    
-                except json.JSONDecodeError:
-                    # Se não for JSON válido, retornar texto como resposta
-                    webhook_data = {
-                        'reply': webhook_response.text.strip() or 'Resposta vazia do webhook.',
-                        'status': 'success'
-                    }
-                
-                # Retornar resposta do webhook como JsonResponse
-                return JsonResponse(webhook_data, status=200)
-                
-        except httpx.TimeoutException:
-            return JsonResponse({
-                'error': 'Timeout ao conectar com o webhook',
-                'reply': 'Desculpe, o serviço está demorando para responder. Tente novamente.'
-            }, status=408)
+            response = _respond_proxy_message(request, data, config, session_id)
+        except Exception:
+            submission.release()
+            raise
+        return submission.bind(response)
             
-        except httpx.HTTPStatusError as e:
-            return JsonResponse({
-                'error': f'Erro HTTP do webhook: {e.response.status_code}',
-                'reply': 'Desculpe, houve um problema com o serviço de chat. Tente novamente mais tarde.'
-            }, status=502)
-            
-        except httpx.RequestError as e:
-            return JsonResponse({
-                'error': f'Erro de conexão com webhook: {str(e)}',
-                'reply': 'Desculpe, não consegui me conectar ao serviço de chat. Verifique sua conexão.'
-            }, status=503)
-            
-    except Exception as e:
-        # Log do erro para debugging (em produção, usar logging adequado)
-        print(f"Erro interno na chat_proxy_api_view: {str(e)}")
-        return JsonResponse({
-            'error': 'Erro interno do servidor',
-            'reply': 'Desculpe, ocorreu um erro interno. Tente novamente mais tarde.'
-        }, status=500)
+    except proxy.ChatRequestError as e:
+        return e.response
+    except Exception:
+        logger.exception('Erro interno na chat_proxy_api_view')
+        return proxy.internal_error_response()
+
+
+@require_http_methods(["GET"])
+def chat_job_result_view(request, job_id):
+    """
+    Long-poll do resultado de uma mensagem entregue em fila.
+
+    Segura a requisição até o job terminar ou ``?wait=`` segundos passarem
+    (no máximo ``LONG_POLL_TIMEOUT``); o widget repete enquanto o status não
+    for ``done`` ou ``failed``.
+    """
+    result = delivery_queue.wait_for_result(job_id, delivery_queue.long_poll_timeout(request))
+    return delivery_queue.result_response(job_id, result)
@@ -0,0 +1,235 @@
+"""
+Gerenciador de transporte HTTP para os webhooks dos clientes.
+
+Mantém um ``httpx.Client`` com pool de conexões keep-alive por host (origem),
+compartilhado por todas as requisições do processo. Assim uma mensagem de chat
+reaproveita a conexão TCP/TLS já aberta com o webhook em vez de refazer o
+handshake a cada chamada.
+
+O gerenciador é seguro para uso após ``fork`` (workers do gunicorn): o processo
+filho descarta os clientes herdados do pai e abre suas próprias conexões.
+
+Para as views assíncronas há um ``httpx.AsyncClient`` por host e por event loop,
+já que um cliente assíncrono não pode ser compartilhado entre loops.
+
+Todos os clientes usam o mesmo contexto TLS (``ssl_context``): sem ele cada
+cliente novo recarregaria os certificados das CAs (dezenas de ms de CPU na
+requisição que abre o primeiro contato com um host).
+"""
+import asyncio
+import functools
+import importlib.util
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Django-Chat-Proxy/1.0'
+
+DEFAULT_OPTIONS = {
+    # Limites aplicados a cada host individualmente
+    'MAX_CONNECTIONS': 100,
+    'MAX_KEEPALIVE_CONNECTIONS': 20,
+    # Segundos que uma conexão ociosa permanece aberta no pool
+    'KEEPALIVE_EXPIRY': 30.0,
+    # Timeouts de conexão e de espera por uma conexão livre do pool
+    'CONNECT_TIMEOUT': 5.0,
+    'POOL_TIMEOUT': 5.0,
+    # HTTP/2 exige o pacote opcional ``h2`` (pip install httpx[http2])
+    'HTTP2': False,
+}
+
+
+def _origin(url):
+    """Retorna a chave (scheme, host, porta) usada para separar os pools."""
+    parts = urlsplit(url)
+    scheme = (parts.scheme or 'http').lower()
+    port = parts.port or (443 if scheme == 'https' else 80)
+    return scheme, (parts.hostname or '').lower(), port
+
+
+@functools.cache
+def ssl_context():
+    """Contexto TLS dos webhooks, criado uma vez por processo (ou antes do fork)."""
+    return httpx.create_ssl_context()
+
+
+@contextmanager
+def _upstream_timer():
+    """Contabiliza a espera pelo webhook (até os headers) nas métricas da requisição."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record_upstream(time.perf_counter() - started)
+
+
+class WebhookTransportManager:
+    """
+    Mantém um cliente HTTP por origem, reutilizado entre requisições.
+
+    As opções vêm de ``settings.WEBHOOK_CLIENT`` (ver ``DEFAULT_OPTIONS``) e
+    podem ser sobrescritas passando ``options`` no construtor.
+    """
+
+    def __init__(self, options=None):
+        self._overrides = options or {}
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._pid = os.getpid()
+
+    @property
+    def options(self):
+        merged = dict(DEFAULT_OPTIONS)
+        merged.update(getattr(settings, 'WEBHOOK_CLIENT', {}))
+        merged.update(self._overrides)
+        return merged
+
+    def _http2_enabled(self, options):
+        if not options['HTTP2']:
+            return False
+        if importlib.util.find_spec('h2') is None:
+            logger.warning('WEBHOOK_CLIENT["HTTP2"] ativo, mas o pacote h2 não está instalado; usando HTTP/1.1.')
+            return False
+        return True
+
+    def _client_kwargs(self):
+        options = self.options
+        return {
+            'http2': self._http2_enabled(options),
+            'limits': httpx.Limits(
+                max_connections=options['MAX_CONNECTIONS'],
+                max_keepalive_connections=options['MAX_KEEPALIVE_CONNECTIONS'],
+                keepalive_expiry=options['KEEPALIVE_EXPIRY'],
+            ),
+            'timeout': httpx.Timeout(
+                30.0,
+                connect=options['CONNECT_TIMEOUT'],
+                pool=options['POOL_TIMEOUT'],
+            ),
+            'headers': {'User-Agent': USER_AGENT},
+            'verify': ssl_context(),
+        }
+
+    def _build_client(self):
+        return httpx.Client(**self._client_kwargs())
+
+    def _build_async_client(self):
+        return httpx.AsyncClient(**self._client_kwargs())
+
+    def _request_kwargs(self, json, headers, timeout, connect_timeout=None):
+        kwargs = {'json': json, 'headers': headers}
+        if timeout is not None:
+            options = self.options
+            connect = min(timeout, options['CONNECT_TIMEOUT'])
+            if connect_timeout is not None:
+                # Só encurta o padrão (ex.: perfil de latência de core.health)
+                connect = min(connect, connect_timeout)
+            kwargs['timeout'] = httpx.Timeout(
+                timeout,
+                connect=connect,
+                pool=min(timeout, options['POOL_TIMEOUT']),
+            )
+        return kwargs
+
+    def _check_pid(self):
+        # Rede de segurança para forks que não passam por os.register_at_fork
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+
+    def get_client(self, url):
+        """Retorna o cliente com pool dedicado ao host de ``url``."""
+        self._check_pid()
+        key = _origin(url)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._build_client()
+                    self._clients[key] = client
+        return client
+
+    def post(self, url, *, json=None, headers=None, timeout=None):
+        """Envia um POST ao webhook reutilizando o pool do host."""
+        with _upstream_timer():
+            return self.get_client(url).post(url, **self._request_kwargs(json, headers, timeout))
+
+    def post_stream(self, url, *, json=None, headers=None, timeout=None, connect_timeout=None):
+        """
+        POST em modo stream: retorna assim que os headers chegam.
+
+        O corpo ainda não foi lido; quem chama deve ler e fechar a resposta.
+        """
+        client = self.get_client(url)
+        request = client.build_request('POST', url, **self._request_kwargs(json, headers, timeout, connect_timeout))
+        with _upstream_timer():
+            return client.send(request, stream=True)
+
+    def get_async_client(self, url):
+        """Retorna o cliente assíncrono do host de ``url`` no event loop atual."""
+        self._check_pid()
+        loop = asyncio.get_running_loop()
+        clients = self._async_clients.get(loop)
+        if clients is None:
+            clients = self._async_clients[loop] = {}
+        key = _origin(url)
+        client = clients.get(key)
+        if client is None:
+            # Sem await entre a busca e a inserção: não há corrida dentro do loop
+            client = clients[key] = self._build_async_client()
+        return client
+
+    async def apost(self, url, *, json=None, headers=None, timeout=None):
+        """Versão assíncrona de ``post``."""
+        client = self.get_async_client(url)
+        with _upstream_timer():
+            return await client.post(url, **self._request_kwargs(json, headers, timeout))
+
+    async def apost_stream(self, url, *, json=None, headers=None, timeout=None, connect_timeout=None):
+        """Versão assíncrona de ``post_stream``."""
+        client = self.get_async_client(url)
+        request = client.build_request('POST', url, **self._request_kwargs(json, headers, timeout, connect_timeout))
+        with _upstream_timer():
+            return await client.send(request, stream=True)
+
+    async def aclose(self):
+        """Fecha os clientes assíncronos criados no event loop atual."""
+        clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+    def close(self):
+        """Fecha todas as conexões abertas por este processo."""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+    def reset_after_fork(self):
+        """
+        Descarta os clientes herdados do processo pai sem fechá-los.
+
+        Os sockets pertencem ao pai; fechá-los aqui derrubaria as conexões dele.
+        """
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._pid = os.getpid()
+
+
+webhook_transport = WebhookTransportManager()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=webhook_transport.reset_after_fork)
@@ -0,0 +1,442 @@
+"""
+Chamada ao webhook com prazo total, novas tentativas e requisições "hedged".
+
+Cada mensagem tem um prazo (``ChatbotConfig.webhook_timeout``) que vale para
+todas as tentativas somadas, até a chegada dos headers da resposta: cada
+tentativa recebe como timeout só o que resta do prazo, então uma tentativa
+lenta não impede outra. O timeout do httpx é por operação: na leitura do
+corpo, que acontece depois, cada leitura espera no máximo o que restava do
+prazo quando a tentativa começou, mas o corpo inteiro pode passar do prazo.
+
+- **Novas tentativas** (até ``webhook_max_attempts``) só acontecem quando a
+  falha indica que o webhook não recebeu a mensagem: erro ao conectar, fila
+  de conexões esgotada, ou respostas 429/503. Falhas ambíguas, em que a
+  mensagem pode ter chegado ao webhook (conexão fechada depois do envio,
+  502/504 de um gateway com o webhook ainda rodando), só são repetidas com
+  ``RETRY_AMBIGUOUS``, para webhooks que descartam duplicatas pelo
+  ``Idempotency-Key``. A espera entre as tentativas é um backoff exponencial
+  com jitter ("full jitter"), e não se tenta de novo se o prazo restante não
+  comportar a espera ou se o circuito do webhook abriu no meio do caminho.
+- **Hedging** (``hedge_after_ms`` > 0): se a primeira chamada não devolver os
+  headers nesse tempo, uma segunda é disparada em paralelo e vale a que
+  responder primeiro. O valor indicado é o p95 de latência do webhook.
+
+Todas as chamadas de uma mensagem levam o mesmo header ``Idempotency-Key``,
+para que o webhook possa descartar duplicatas. O ``WebhookTrace`` guarda o
+número de chamadas e o tempo de cada uma, devolvidos ao widget nos headers
+``X-Webhook-Attempts`` e ``Server-Timing``.
+
+Quando ``core.health`` já tem o perfil de latência do webhook, o timeout de
+conexão de cada tentativa é encurtado a partir dele: um host que parou de
+aceitar conexões falha rápido e ainda sobra prazo para a nova tentativa.
+
+Com vários endpoints (``core.balancer``), cada chamada vai para o endpoint
+escolhido pelo balanceador. Uma falha que permite nova tentativa passa na hora
+para um endpoint ainda não tentado, sem backoff e sem gastar
+``webhook_max_attempts``; a chamada hedged também vai para outro endpoint.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+from django.conf import settings
+
+from . import balancer, circuit_breaker, metrics
+from .webhook_client import webhook_transport
+
+DEFAULT_OPTIONS = {
+    # Backoff entre tentativas: sorteado entre 0 e min(MAX, BASE * 2 ** n)
+    'BACKOFF_BASE': 0.1,
+    'BACKOFF_MAX': 2.0,
+    # Não iniciar uma tentativa com menos que isso de prazo restante
+    'MIN_ATTEMPT_TIMEOUT': 0.5,
+    # Threads usadas pelas chamadas em paralelo das views síncronas
+    'HEDGE_THREADS': 32,
+    # Repetir também as falhas ambíguas (AMBIGUOUS_ERRORS/AMBIGUOUS_STATUS)
+    'RETRY_AMBIGUOUS': False,
+}
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# Falhas em que o webhook não chegou a receber (ou a aceitar) a mensagem
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRYABLE_STATUS = frozenset({429, 503})
+# Falhas em que a mensagem pode ter sido processada: só com RETRY_AMBIGUOUS
+AMBIGUOUS_ERRORS = (httpx.RemoteProtocolError,)
+AMBIGUOUS_STATUS = frozenset({502, 504})
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'WEBHOOK_RETRY', {}))
+    return options
+
+
+class Deadline:
+    """Prazo da mensagem, somando todas as tentativas."""
+
+    __slots__ = ('expires_at',)
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+class WebhookTrace:
+    """
+    Chamadas feitas ao webhook para uma mensagem e o tempo de cada uma.
+
+    ``attempts`` conta as chamadas iniciadas; ``timings`` só tem as que já
+    terminaram (uma chamada hedged perdedora pode ainda estar em andamento).
+    No hedging síncrono as chamadas rodam em threads do pool: contagem e
+    tempos passam por ``_lock``.
+    """
+
+    __slots__ = ('attempts', 'timings', 'hedged', 'started', 'elapsed', '_lock')
+
+    def __init__(self):
+        self.attempts = 0
+        self.timings = []
+        self.hedged = False
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def begin_attempt(self):
+        with self._lock:
+            self.attempts += 1
+
+    def record(self, started):
+        """Guarda a duração da chamada iniciada em ``started``."""
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.timings.append(elapsed)
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def headers(self):
+        with self._lock:
+            attempts, timings = self.attempts, list(self.timings)
+        parts = [f'webhook;dur={self.elapsed * 1000:.1f}']
+        parts += [f'webhook-{n};dur={elapsed * 1000:.1f}' for n, elapsed in enumerate(timings, 1)]
+        headers = {'X-Webhook-Attempts': str(attempts), 'Server-Timing': ', '.join(parts)}
+        if self.hedged:
+            headers['X-Webhook-Hedged'] = '1'
+        return headers
+
+    def apply(self, response):
+        """Acrescenta os headers de diagnóstico à resposta do widget."""
+        if self.attempts:
+            for name, value in self.headers().items():
+                response[name] = value
+        return response
+
+
+def backoff(attempt):
+    """Espera antes da tentativa ``attempt + 1`` (full jitter)."""
+    options = _options()
+    return random.uniform(0, min(options['BACKOFF_MAX'], options['BACKOFF_BASE'] * 2 ** (attempt - 1)))
+
+
+def is_retryable(exc=None, status_code=None):
+    ambiguous = _options()['RETRY_AMBIGUOUS']
+    if exc is not None:
+        return isinstance(exc, RETRYABLE_ERRORS) or (ambiguous and isinstance(exc, AMBIGUOUS_ERRORS))
+    return status_code in RETRYABLE_STATUS or (ambiguous and status_code in AMBIGUOUS_STATUS)
+
+
+def _deadline_exceeded():
+    return httpx.ReadTimeout('Prazo para a resposta do webhook esgotado')
+
+
+def _retry_delay(attempt, deadline):
+    """Espera até a próxima tentativa, ou ``None`` se o prazo não comporta outra."""
+    delay = backoff(attempt)
+    if deadline.remaining() - delay < _options()['MIN_ATTEMPT_TIMEOUT']:
+        return None
+    return delay
+
+
+def _prepare(config, headers, deadline):
+    deadline = Deadline(deadline if deadline is not None else config.webhook_timeout)
+    headers = {**headers, IDEMPOTENCY_HEADER: uuid.uuid4().hex}
+    hedge_after = config.hedge_after_ms / 1000 if config.hedge_after_ms else None
+    return deadline, headers, hedge_after, max(1, config.webhook_max_attempts)
+
+
+def _can_retry(pool, tried, retries, max_attempts):
+    return len(tried) < len(pool) or retries < max_attempts
+
+
+def _next_attempt(pool, tried, retries, max_attempts, deadline, opened):
+    """
+    Endpoint, espera e se é failover para a próxima tentativa, ou ``None``.
+
+    Primeiro um endpoint ainda não tentado (sem espera); depois novas
+    tentativas limitadas a ``max_attempts``, com backoff. Endpoints em
+    ``opened`` (circuito aberto no meio do caminho) ficam de fora.
+    """
+    candidates = [target for target in pool if target.url not in opened]
+    untried = [target for target in candidates if target.url not in tried]
+    if untried:
+        if deadline.remaining() < _options()['MIN_ATTEMPT_TIMEOUT']:
+            return None
+        return balancer.choose(untried), 0.0, True
+    if not candidates or retries >= max_attempts:
+        return None
+    delay = _retry_delay(retries, deadline)
+    if delay is None:
+        return None
+    return balancer.choose(candidates), delay, False
+
+
+# --- Views síncronas ----------------------------------------------------------
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(_options()['HEDGE_THREADS'], thread_name_prefix='webhook-hedge')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _attempt(target, json, headers, deadline, trace):
+    trace.begin_attempt()
+    started = balancer.start(target.url)
+    failed = None
+    try:
+        response = webhook_transport.post_stream(
+            target.url, json=json, headers=headers, timeout=deadline.remaining(), connect_timeout=target.connect_timeout
+        )
+        failed = response.status_code >= 500
+    except httpx.HTTPError as exc:
+        failed = True
+        trace.record(started)
+        circuit_breaker.record_result(target.url, exc=exc)
+        raise
+    finally:
+        balancer.finish(target.url, started, failed)
+    trace.record(started)
+    circuit_breaker.record_result(target.url, status_code=response.status_code)
+    return response
+
+
+def _close_when_done(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _hedged(pool, target, json, headers, deadline, hedge_after, trace):
+    """Chamada a ``target`` e, se ela demorar ``hedge_after``, outra em paralelo (em outro endpoint, se houver)."""
+    executor = _get_executor()
+    started = time.perf_counter()
+    pending = {executor.submit(_attempt, target, json, headers, deadline, trace)}
+    hedge_at = time.monotonic() + hedge_after
+    last_response = last_error = None
+    try:
+        while pending:
+            timeout = deadline.remaining()
+            if hedge_at is not None:
+                timeout = min(max(0.0, hedge_at - time.monotonic()), timeout)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except httpx.HTTPError as exc:
+                    last_error = exc
+                    continue
+                if last_response is not None:
+                    last_response.close()
+                last_response = response
+                if not is_retryable(status_code=response.status_code):
+                    return response
+            if not done and (hedge_at is None or deadline.remaining() <= 0):
+                break  # prazo esgotado
+            if pending and hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None
+                if deadline.remaining() > _options()['MIN_ATTEMPT_TIMEOUT']:
+                    trace.hedged = True
+                    hedge = balancer.choose(pool, exclude={target.url})
+                    pending.add(executor.submit(_attempt, hedge, json, headers, deadline, trace))
+        if last_response is not None:
+            return last_response
+        raise last_error or _deadline_exceeded()
+    finally:
+        for future in pending:
+            future.add_done_callback(_close_when_done)
+        # As chamadas rodam em outras threads, fora das métricas da requisição
+        metrics.record_upstream(time.perf_counter() - started)
+
+
+def post_stream(config, *, json, headers, trace, deadline=None, targets=None):
+    """
+    Envia a mensagem ao webhook do chatbot em modo stream (só os headers lidos).
+
+    Aplica prazo, novas tentativas, failover entre os endpoints (``targets``,
+    por padrão todos os do chatbot) e hedging conforme o ``ChatbotConfig`` e
+    registra cada chamada no circuit breaker e em ``trace``. Levanta o último
+    ``httpx.HTTPError`` se nenhuma chamada der certo.
+    """
+    pool = targets or balancer.targets(config)
+    deadline, headers, hedge_after, max_attempts = _prepare(config, headers, deadline)
+    target = balancer.choose(pool)
+    tried = {target.url}
+    retries = 1
+    try:
+        while True:
+            try:
+                if hedge_after:
+                    response = _hedged(pool, target, json, headers, deadline, hedge_after, trace)
+                else:
+                    response = _attempt(target, json, headers, deadline, trace)
+            except httpx.HTTPError as exc:
+                step = None
+                if is_retryable(exc=exc) and _can_retry(pool, tried, retries, max_attempts):
+                    opened = circuit_breaker.open_urls([candidate.url for candidate in pool])
+                    step = _next_attempt(pool, tried, retries, max_attempts, deadline, opened)
+                if step is None:
+                    raise
+            else:
+                step = None
+                if is_retryable(status_code=response.status_code) and _can_retry(pool, tried, retries, max_attempts):
+                    opened = circuit_breaker.open_urls([candidate.url for candidate in pool])
+                    step = _next_attempt(pool, tried, retries, max_attempts, deadline, opened)
+                if step is None:
+                    return response
+                response.close()
+            target, delay, failover = step
+            tried.add(target.url)
+            if not failover:
+                retries += 1
+                time.sleep(delay)
+    finally:
+        trace.finish()
+
+
+# --- Views assíncronas --------------------------------------------------------
+
+async def _aattempt(target, json, headers, deadline, trace):
+    trace.begin_attempt()
+    started = balancer.start(target.url)
+    failed = None
+    try:
+        response = await webhook_transport.apost_stream(
+            target.url, json=json, headers=headers, timeout=deadline.remaining(), connect_timeout=target.connect_timeout
+        )
+        failed = response.status_code >= 500
+    except httpx.HTTPError as exc:
+        failed = True
+        trace.record(started)
+        await circuit_breaker.arecord_result(target.url, exc=exc)
+        raise
+    finally:
+        # Cancelada pelo hedging: failed continua None
+        balancer.finish(target.url, started, failed)
+    trace.record(started)
+    await circuit_breaker.arecord_result(target.url, status_code=response.status_code)
+    return response
+
+
+async def _discard(tasks):
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, httpx.Response):
+            await result.aclose()
+
+
+async def _ahedged(pool, target, json, headers, deadline, hedge_after, trace):
+    """Versão assíncrona de ``_hedged``; as chamadas perdedoras são canceladas."""
+    started = time.perf_counter()
+
+    def start(target):
+        # Contexto próprio: a espera entra uma única vez nas métricas, abaixo
+        return asyncio.create_task(_aattempt(target, json, headers, deadline, trace), context=contextvars.Context())
+
+    pending = {start(target)}
+    hedge_at = time.monotonic() + hedge_after
+    last_response = last_error = None
+    try:
+        while pending:
+            timeout = deadline.remaining()
+            if hedge_at is not None:
+                timeout = min(max(0.0, hedge_at - time.monotonic()), timeout)
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    response = task.result()
+                except httpx.HTTPError as exc:
+                    last_error = exc
+                    continue
+                if last_response is not None:
+                    await last_response.aclose()
+                last_response = response
+                if not is_retryable(status_code=response.status_code):
+                    return response
+            if not done and (hedge_at is None or deadline.remaining() <= 0):
+                break  # prazo esgotado
+            if pending and hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None
+                if deadline.remaining() > _options()['MIN_ATTEMPT_TIMEOUT']:
+                    trace.hedged = True
+                    pending.add(start(balancer.choose(pool, exclude={target.url})))
+        if last_response is not None:
+            return last_response
+        raise last_error or _deadline_exceeded()
+    finally:
+        await _discard(pending)
+        metrics.record_upstream(time.perf_counter() - started)
+
+
+async def apost_stream(config, *, json, headers, trace, deadline=None, targets=None):
+    """Versão assíncrona de ``post_stream`` (``targets`` vem de ``balancer.aavailable``)."""
+    pool = targets or balancer.targets(config)
+    deadline, headers, hedge_after, max_attempts = _prepare(config, headers, deadline)
+    target = balancer.choose(pool)
+    tried = {target.url}
+    retries = 1
+    try:
+        while True:
+            try:
+                if hedge_after:
+                    response = await _ahedged(pool, target, json, headers, deadline, hedge_after, trace)
+                else:
+                    response = await _aattempt(target, json, headers, deadline, trace)
+            except httpx.HTTPError as exc:
+                step = None
+                if is_retryable(exc=exc) and _can_retry(pool, tried, retries, max_attempts):
+                    opened = await circuit_breaker.aopen_urls([candidate.url for candidate in pool])
+                    step = _next_attempt(pool, tried, retries, max_attempts, deadline, opened)
+                if step is None:
+                    raise
+            else:
+                step = None
+                if is_retryable(status_code=response.status_code) and _can_retry(pool, tried, retries, max_attempts):
+                    opened = await circuit_breaker.aopen_urls([candidate.url for candidate in pool])
+                    step = _next_attempt(pool, tried, retries, max_attempts, deadline, opened)
+                if step is None:
+                    return response
+                await response.aclose()
+            target, delay, failover = step
+            tried.add(target.url)
+            if not failover:
+                retries += 1
+                await asyncio.sleep(delay)
+    finally:
+        trace.finish()
@@ -0,0 +1,352 @@
+"""
+Canal WebSocket do widget: ``/ws/chat/<chatbot_id>/?session_id=...``.
+
+Servido direto pelo ``client_dashboard.asgi`` (aplicação ASGI pura, sem
+Channels). O ``ChatbotConfig`` é resolvido uma vez na conexão (e revalidado a
+cada ``CONFIG_REFRESH`` segundos); depois disso cada mensagem é só um frame,
+sem headers, dispatch de view nem consulta ao banco.
+
+Frames do widget::
+
+    {"type": "message", "message": "Olá", "id": "opcional", "client_message_id": "opcional"}
+
+``client_message_id`` é a chave de idempotência da mensagem (ver
+``core.idempotency``), a mesma que o widget usa no POST se o WebSocket cair.
+
+Frames do servidor (o ``id`` da mensagem é devolvido em cada um)::
+
+    {"type": "token", "token": "Olá", "id": ...}
+    {"type": "done", "reply": "Olá, tudo bem?", "id": ...}
+    {"type": "error", "error": "...", "reply": "...", "id": ...}
+    {"type": "push", "message": "..."}          # enviado por ``push()``
+
+Cada conexão processa uma mensagem por vez e guarda só o estado de
+``ChatConnection`` (com ``__slots__``); conexões ociosas custam uma corrotina
+parada em ``receive()``, o que permite dezenas de milhares por processo.
+"""
+import logging
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+import httpx
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import balancer, codec, conversation_log, delivery_queue, idempotency, proxy, ratelimit, reply_cache, session_context, streaming, usage, webhook_retry
+from .config_cache import aget_chatbot_config
+from .models import ChatbotConfig, DeliveryJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'PATH_PREFIX': '/ws/chat/',
+    # Tamanho máximo de um frame recebido do widget
+    'MAX_MESSAGE_BYTES': 16384,
+    # Intervalo para revalidar o ChatbotConfig de uma conexão aberta
+    'CONFIG_REFRESH': 30.0,
+    # Espera máxima pela resposta de um chatbot em modo fila
+    'QUEUED_REPLY_TIMEOUT': 600.0,
+}
+
+# Códigos de fechamento (faixa 4000-4999 é da aplicação)
+CLOSE_NOT_FOUND = 4404
+CLOSE_WEBHOOK_MISSING = 4400
+
+# Conexões abertas neste processo, por (chatbot_id, session_id), para push()
+_connections = {}
+
+
+def _options():
+    options = dict(DEFAULT_OPTIONS)
+    options.update(getattr(settings, 'WEBSOCKET', {}))
+    return options
+
+
+def _headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+def _client_ip(scope):
+    """IP do visitante, com as mesmas regras de proxies confiáveis das views HTTP."""
+    headers = _headers(scope)
+    client = scope.get('client') or ('', 0)
+    meta = {'REMOTE_ADDR': client[0]}
+    if 'x-forwarded-for' in headers:
+        meta['HTTP_X_FORWARDED_FOR'] = headers['x-forwarded-for']
+    return ratelimit.client_ip(SimpleNamespace(META=meta))
+
+
+class ChatConnection:
+    __slots__ = ('send', 'config', 'config_loaded_at', 'session_id', 'ip')
+
+    def __init__(self, send, config, session_id, ip):
+        self.send = send
+        self.config = config
+        self.config_loaded_at = time.monotonic()
+        self.session_id = session_id
+        self.ip = ip
+
+    async def send_event(self, event):
+        await self.send({'type': 'websocket.send', 'text': codec.dumps(event).decode('utf-8')})
+
+    async def refresh_config(self):
+        """Revalida o chatbot; ``False`` se ele foi excluído."""
+        if time.monotonic() - self.config_loaded_at < _options()['CONFIG_REFRESH']:
+            return True
+        config = await aget_chatbot_config(self.config.pk)
+        if config is None:
+            return False
+        self.config = config
+        self.config_loaded_at = time.monotonic()
+        return True
+
+
+async def push(chatbot_id, session_id, message):
+    """
+    Envia uma mensagem do servidor ao widget conectado neste processo.
+
+    Retorna ``False`` se a sessão não tiver um WebSocket aberto aqui.
+    """
+    connection = _connections.get((str(chatbot_id), session_id))
+    if connection is None:
+        return False
+    await connection.send_event({'type': 'push', 'message': message})
+    return True
+
+
+def _parse_frame(event):
+    text = event.get('text')
+    if text is None and event.get('bytes') is not None:
+        text = event['bytes'].decode('utf-8', errors='replace')
+    if text is None or len(text.encode('utf-8')) > _options()['MAX_MESSAGE_BYTES']:
+        return None
+    try:
+        data = codec.loads(text)
+    except codec.DecodeError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('message'), str) or not data['message'].strip():
+        return None
+    return data
+
+
+async def _relay(connection, data, reply_id, lookup, context, submission):
+    """
+    Encaminha a mensagem ao webhook e devolve os frames da resposta.
+
+    Retorna o status HTTP equivalente ao resultado (para ``core.usage``).
+    """
+    config = connection.config
+    on_reply = conversation_log.start_exchange(config.pk, connection.session_id, data['message'])
+
+    targets = await balancer.aavailable(config)
+    if not targets:
+        await connection.send_event({'type': 'error', **proxy.CIRCUIT_OPEN_BODY, 'id': reply_id})
+        return 503
+
+    on_reply = session_context.aextend(config, connection.session_id, data['message'], context, on_reply)
+    payload = proxy.build_webhook_payload({**data, 'chatbot_id': str(config.pk)}, connection.session_id, context)
+    try:
+        webhook_response = await webhook_retry.apost_stream(
+            config, json=payload, headers=proxy.webhook_headers(True), trace=webhook_retry.WebhookTrace(), targets=targets
+        )
+    except httpx.HTTPError as exc:
+        body, status = proxy.webhook_error_body(exc)
+        await connection.send_event({'type': 'error', **body, 'id': reply_id})
+        return status
+    lookup.observe(webhook_response)
+
+    try:
+        if webhook_response.is_success and streaming.is_stream_response(webhook_response):
+            reply = []
+            async for token in streaming.aiter_tokens(webhook_response):
+                reply.append(token)
+                await connection.send_event({'type': 'token', 'token': token, 'id': reply_id})
+            reply = ''.join(reply) or streaming.EMPTY_REPLY
+            await lookup.astore({'reply': reply, 'status': 'success'})
+        else:
+            body = await proxy.aread_webhook_body(webhook_response)
+            webhook_response.raise_for_status()
+            reply_data = proxy.reply_data(webhook_response, body)
+            await lookup.astore(reply_data)
+            reply = reply_data['reply']
+    except httpx.HTTPError as exc:
+        body, status = proxy.webhook_error_body(exc)
+        await connection.send_event({'type': 'error', **body, 'id': reply_id})
+        return status
+    finally:
+        await webhook_response.aclose()
+
+    await on_reply(reply)
+    await submission.abind(codec.FastJsonResponse({'reply': reply, 'status': 'success'}, status=200))
+    await connection.send_event({'type': 'done', 'reply': reply, 'id': reply_id})
+    return 200
+
+
+async def _relay_queued(connection, data, reply_id, submission):
+    """Entrega em fila (``delivery_mode = 'queue'``): enfileira e envia o resultado do job."""
+    config = connection.config
+    conversation_log.start_exchange(config.pk, connection.session_id, data['message'])
+    context = await session_context.aload(config, connection.session_id)
+    job_id = await delivery_queue.aenqueue(config, {**data, 'chatbot_id': str(config.pk)}, connection.session_id, context)
+    # Repetidas (WebSocket ou POST) recebem o mesmo job
+    await submission.abind(delivery_queue.queued_response(job_id))
+    return await _send_job_result(connection, job_id, reply_id)
+
+
+async def _send_job_result(connection, job_id, reply_id):
+    """
+    Espera o job e envia o resultado como frame.
+
+    A espera é só uma corrotina parada, como a do long-poll assíncrono.
+    """
+    result = await delivery_queue.await_result(job_id, _options()['QUEUED_REPLY_TIMEOUT'])
+    if result is None:
+        error = 'Job não encontrado'
+    elif result['status'] != DeliveryJob.STATUS_DONE:
+        error = result['error'] or 'Resposta ainda na fila'
+    else:
+        await connection.send_event({'type': 'done', 'reply': result['reply'], 'id': reply_id})
+        return 200
+    await connection.send_event({'type': 'error', 'error': error, 'reply': delivery_queue.FAILED_REPLY, 'id': reply_id})
+    return 502
+
+
+async def _send_replay(connection, response, reply_id):
+    """Envia a resposta guardada para a chave de idempotência do frame."""
+    if response.status_code == 202:
+        return await _send_job_result(connection, codec.loads(response.content)['job_id'], reply_id)
+    if response['Content-Type'].startswith(streaming.NDJSON_CONTENT_TYPE):
+        # Stream guardado: a última linha é o evento done
+        reply = codec.loads(response.content.splitlines()[-1])['reply']
+    else:
+        reply = proxy.normalize_reply(codec.loads(response.content))['reply']
+    await connection.send_event({'type': 'done', 'reply': reply, 'id': reply_id})
+    return 200
+
+
+async def _handle_message(connection, data):
+    """Responde a um frame de mensagem; retorna o status HTTP equivalente."""
+    reply_id = data.get('id')
+    if not await connection.refresh_config() or not connection.config.webhook_url:
+        await connection.send_event({
+            'type': 'error', 'error': 'Chatbot indisponível', 'reply': proxy.LEGACY_FALLBACK_REPLY, 'id': reply_id,
+        })
+        return 400
+
+    # Mensagem reenviada (ex.: o widget caiu para o POST e voltou) com a mesma chave
+    submission = idempotency.frame_submission(connection.config, data, connection.session_id)
+    replayed = await submission.afetch()
+    if replayed is not None:
+        return await _send_replay(connection, replayed, reply_id)
+    try:
+        return await _respond_message(connection, data, reply_id, submission)
+    finally:
+        await submission.arelease()
+
+
+async def _respond_message(connection, data, reply_id, submission):
+    config = connection.config
+
+    retry_after = await ratelimit.acheck_rate_limit(config, connection.ip)
+    if retry_after:
+        await connection.send_event({'type': 'error', **proxy.RATE_LIMITED_BODY, 'retry_after': retry_after, 'id': reply_id})
+        return 429
+
+    if config.delivery_mode == ChatbotConfig.DELIVERY_QUEUE:
+        return await _relay_queued(connection, data, reply_id, submission)
+
+    context = await session_context.aload(config, connection.session_id)
+    lookup = reply_cache.lookup(config, data['message'], context)
+    cached = await lookup.afetch(config.webhook_timeout)
+    if cached is not None:
+        conversation_log.start_exchange(config.pk, connection.session_id, data['message'])(cached['reply'])
+        await session_context.aremember(config, connection.session_id, data['message'], cached['reply'], context)
+        await submission.abind(reply_cache.hit_response(cached))
+        await connection.send_event({'type': 'done', 'reply': cached['reply'], 'id': reply_id})
+        return 200
+
+    try:
+        slot = await ratelimit.aacquire_slot(config)
+        if slot is None:
+            await connection.send_event({'type': 'error', **proxy.RATE_LIMITED_BODY, 'retry_after': 1, 'id': reply_id})
+            return 429
+        try:
+            return await _relay(connection, data, reply_id, lookup, context, submission)
+        finally:
+            await slot.arelease()
+    finally:
+        lookup.finish()
+
+
+async def _handle_frame(connection, data):
+    """
+    ``_handle_message`` no próprio contexto de threads, como uma requisição HTTP.
+
+    Sem ele, as chamadas ``sync_to_async`` de todas as conexões do processo
+    dividiriam uma única thread e rodariam uma de cada vez.
+    """
+    async with ThreadSensitiveContext():
+        try:
+            return await _handle_message(connection, data)
+        finally:
+            await sync_to_async(close_old_connections)()
+
+
+def _chatbot_id(path):
+    prefix = _options()['PATH_PREFIX']
+    if not path.startswith(prefix):
+        return None
+    return path[len(prefix):].strip('/') or None
+
+
+async def websocket_application(scope, receive, send):
+    """Aplicação ASGI das conexões WebSocket (roteada pelo ``asgi.py``)."""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    chatbot_id = _chatbot_id(scope['path'])
+    async with ThreadSensitiveContext():
+        config = await aget_chatbot_config(chatbot_id) if chatbot_id else None
+        # Não segurar a conexão do banco durante toda a vida do WebSocket
+        await sync_to_async(close_old_connections)()
+    if config is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    if not config.webhook_url:
+        await send({'type': 'websocket.close', 'code': CLOSE_WEBHOOK_MISSING})
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    session_id = conversation_log.clean_session_id((query.get('session_id') or [None])[0])
+    connection = ChatConnection(send, config, session_id, _client_ip(scope))
+    key = (str(config.pk), session_id)
+    if session_id:
+        _connections[key] = connection
+
+    await send({'type': 'websocket.accept'})
+    try:
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+            if event['type'] != 'websocket.receive':
+                continue
+            data = _parse_frame(event)
+            if data is None:
+                await connection.send_event({'type': 'error', 'error': 'Frame inválido', 'reply': ''})
+                continue
+            started = time.perf_counter()
+            try:
+                status = await _handle_frame(connection, data)
+            except Exception:
+                logger.exception('Erro interno no WebSocket de chat', extra={'chatbot_id': key[0]})
+                await connection.send_event({'type': 'error', **proxy.INTERNAL_ERROR_BODY, 'id': data.get('id')})
+                status = 500
+            usage.record(key[0], status, time.perf_counter() - started)
+    finally:
+        if _connections.get(key) is connection:
+            del _connections[key]
+
@@ -0,0 +1,28 @@
+"""
+Configuração do gunicorn, lida automaticamente quando ele é iniciado neste
+diretório (ver Procfile e railway.toml).
+
+As migrações e o collectstatic não rodam aqui: ficam na fase de release e no
+build, para que um worker novo só carregue a aplicação. Com
+``GUNICORN_PRELOAD=True`` a aplicação é carregada e aquecida uma vez no
+processo mestre (``core.startup``) e os workers nascem por fork, já prontos.
+"""
+import os
+import time
+
+# Importado como módulo: "config" é o nome de uma opção do gunicorn
+import decouple
+
+worker_class = 'uvicorn_worker.UvicornWorker'
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = decouple.config('WEB_CONCURRENCY', default=2, cast=int)
+preload_app = decouple.config('GUNICORN_PRELOAD', default=False, cast=bool)
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    # Sem preload, inclui carregar a aplicação (tempos detalhados no log "Aplicação pronta")
+    worker.log.info('Worker %s pronto em %.0f ms', worker.pid, (time.perf_counter() - worker.forked_at) * 1000)
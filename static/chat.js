@@ -1,6 +1,22 @@
 document.addEventListener('DOMContentLoaded', () => {
     const scriptTag = document.querySelector('script[data-chatbot-id]');
     const chatbotId = scriptTag.dataset.chatbotId;
+
+    // Identificador da conversa: mantido enquanto a aba estiver aberta
+    const sessionKey = `chat-session-${chatbotId}`;
+    const newId = () => (window.crypto && crypto.randomUUID)
+        ? crypto.randomUUID()
+        : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    let sessionId = null;
+    try {
+        sessionId = sessionStorage.getItem(sessionKey);
+        if (!sessionId) {
+            sessionId = newId();
+            sessionStorage.setItem(sessionKey, sessionId);
+        }
+    } catch (e) {
+        // sessionStorage indisponível (ex.: cookies bloqueados): conversa não é registrada
+    }
     const welcomeMessage = scriptTag.dataset.welcomeMessage || 'Olá! Como posso ajudar?';
 
     if (!chatbotId) {
@@ -59,6 +75,170 @@ document.addEventListener('DOMContentLoaded', () => {
         messageElement.textContent = text;
         chatMessages.appendChild(messageElement);
         chatMessages.scrollTop = chatMessages.scrollHeight; // Auto-scroll
+        return messageElement;
+    }
+
+    // Extrai o texto da resposta JSON (não streaming) do proxy
+    function extractReply(data) {
+        if (data.reply) {
+            return data.reply;
+        } else if (data.mensagem) {
+            return data.mensagem;
+        } else if (data.message) {
+            return data.message;
+        } else if (data.response) {
+            return data.response;
+        }
+        return 'Não recebi uma resposta válida.';
+    }
+
+    // Lê a resposta NDJSON do proxy e renderiza os tokens conforme chegam
+    async function renderStream(response) {
+        const messageElement = addMessage('', 'bot');
+        messageElement.classList.add('streaming');
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        const handleLine = (line) => {
+            if (!line.trim()) {
+                return;
+            }
+            const event = JSON.parse(line);
+            if (event.type === 'token') {
+                messageElement.textContent += event.token;
+            } else if (event.type === 'done' && !messageElement.textContent) {
+                messageElement.textContent = event.reply || 'Não recebi uma resposta válida.';
+            } else if (event.type === 'error') {
+                messageElement.textContent += (messageElement.textContent ? '\n' : '') + event.reply;
+            }
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        };
+
+        try {
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) {
+                    break;
+                }
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                lines.forEach(handleLine);
+            }
+            handleLine(buffer + decoder.decode());
+        } finally {
+            messageElement.classList.remove('streaming');
+        }
+    }
+
+    // Chatbots em modo fila respondem 202 com o job; a resposta vem por long-poll
+    async function waitForJob(pollUrl) {
+        const messageElement = addMessage('', 'bot');
+        messageElement.classList.add('streaming');
+        try {
+            while (true) {
+                const response = await fetch(pollUrl, { headers: { 'Accept': 'application/json' } });
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                const job = await response.json();
+                if (job.status === 'done' || job.status === 'failed') {
+                    messageElement.textContent = extractReply(job);
+                    return;
+                }
+            }
+        } finally {
+            messageElement.classList.remove('streaming');
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        }
+    }
+
+    // Canal WebSocket: aberto na primeira mensagem e reaproveitado nas
+    // seguintes. Se não estiver disponível, as mensagens vão pelo POST.
+    let socket = null;
+    let socketUnavailable = !('WebSocket' in window);
+    let messageCounter = 0;
+    const pendingReplies = new Map();
+
+    function openSocket() {
+        if (socketUnavailable) {
+            return Promise.resolve(null);
+        }
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            return Promise.resolve(socket);
+        }
+        return new Promise((resolve) => {
+            const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+            const query = sessionId ? `?session_id=${encodeURIComponent(sessionId)}` : '';
+            const ws = new WebSocket(`${scheme}://${location.host}/ws/chat/${chatbotId}/${query}`);
+            ws.onopen = () => {
+                socket = ws;
+                resolve(ws);
+            };
+            ws.onmessage = (e) => handleSocketEvent(JSON.parse(e.data));
+            ws.onclose = () => {
+                if (socket !== ws) {
+                    // Nunca abriu (servidor sem WebSocket, proxy bloqueando...): usar HTTP
+                    socketUnavailable = true;
+                    resolve(null);
+                    return;
+                }
+                socket = null;
+                pendingReplies.forEach((pending) => pending.reject(new Error('WebSocket fechado')));
+                pendingReplies.clear();
+            };
+        });
+    }
+
+    function handleSocketEvent(event) {
+        if (event.type === 'push') {
+            addMessage(event.message, 'bot');
+            return;
+        }
+        const pending = event.id !== undefined
+            ? pendingReplies.get(event.id)
+            : pendingReplies.values().next().value;
+        if (!pending) {
+            return;
+        }
+        const messageElement = pending.element;
+        if (event.type === 'token') {
+            messageElement.textContent += event.token;
+        } else if (event.type === 'done') {
+            if (!messageElement.textContent) {
+                messageElement.textContent = event.reply || 'Não recebi uma resposta válida.';
+            }
+            pending.resolve();
+        } else if (event.type === 'error') {
+            messageElement.textContent += (messageElement.textContent ? '\n' : '') + event.reply;
+            pending.resolve();
+        }
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
+    // Envia pelo WebSocket; false se a conexão caiu antes de qualquer resposta
+    async function sendOverSocket(ws, message, clientMessageId) {
+        const messageElement = addMessage('', 'bot');
+        messageElement.classList.add('streaming');
+        const id = `m${++messageCounter}`;
+        try {
+            await new Promise((resolve, reject) => {
+                pendingReplies.set(id, { element: messageElement, resolve, reject });
+                ws.send(JSON.stringify({ type: 'message', message, id, client_message_id: clientMessageId }));
+            });
+            return true;
+        } catch (error) {
+            if (messageElement.textContent) {
+                messageElement.textContent += '\nA conexão foi interrompida.';
+                return true;
+            }
+            messageElement.remove();
+            return false;
+        } finally {
+            pendingReplies.delete(id);
+            messageElement.classList.remove('streaming');
+        }
     }
 
     async function sendMessage(userMessage) {
@@ -66,42 +246,69 @@ document.addEventListener('DOMContentLoaded', () => {
         addMessage(userMessage, 'user');
         const messageToSend = userMessage;
         chatInput.value = '';
+        // Um id por mensagem, no WebSocket e no POST: se o WebSocket cair depois
+        // de entregar a mensagem, o servidor não chama o webhook de novo
+        const clientMessageId = newId();
+
+        const ws = await openSocket();
+        if (ws && await sendOverSocket(ws, messageToSend, clientMessageId)) {
+            return;
+        }
 
         try {
-            // Fazer a requisição fetch para o backend proxy usando a nova API
-            const response = await fetch('/api/v1/chat/', {
+            // Fazer a requisição fetch para o backend proxy usando a nova API.
+            // stream: true permite receber a resposta token a token (NDJSON).
+            // O mesmo Idempotency-Key no reenvio: o servidor não chama o webhook
+            // de novo e devolve a resposta da primeira tentativa.
+            const request = {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/x-ndjson, application/json',
+                    'Idempotency-Key': clientMessageId
                 },
                 body: JSON.stringify({ 
                     chatbot_id: chatbotId,
                     message: messageToSend,
-                    timestamp: new Date().toISOString()
+                    session_id: sessionId,
+                    timestamp: new Date().toISOString(),
+                    stream: true
                 })
-            });
+            };
+            let response;
+            try {
+                response = await fetch('/api/v1/chat/', request);
+            } catch (networkError) {
+                // Conexão perdida (rede móvel instável): reenviar uma vez
+                response = await fetch('/api/v1/chat/', request);
+            }
+            // 409: a primeira tentativa com este id ainda está em andamento
+            for (let tries = 0; response.status === 409 && tries < 20; tries++) {
+                const delay = Number(response.headers.get('Retry-After')) || 1;
+                await new Promise((resolve) => setTimeout(resolve, delay * 1000));
+                response = await fetch('/api/v1/chat/', request);
+            }
 
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
+            if (response.status === 202) {
+                const job = await response.json();
+                await waitForJob(job.poll_url);
+                return;
+            }
+
+            const contentType = response.headers.get('content-type') || '';
+            if (contentType.includes('application/x-ndjson') && response.body) {
+                await renderStream(response);
+                return;
+            }
+
             const data = await response.json();
             
             // Exibir a resposta da IA - verificar diferentes formatos de resposta
-            let aiReply;
-            if (data.reply) {
-                aiReply = data.reply;
-            } else if (data.mensagem) {
-                aiReply = data.mensagem;
-            } else if (data.message) {
-                aiReply = data.message;
-            } else if (data.response) {
-                aiReply = data.response;
-            } else {
-                aiReply = 'Não recebi uma resposta válida.';
-            }
-            
-            addMessage(aiReply, 'bot');
+            addMessage(extractReply(data), 'bot');
 
         } catch (error) {
             console.error('Erro ao enviar mensagem:', error);